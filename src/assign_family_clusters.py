@@ -8,10 +8,18 @@ family / protein.
 
 import argparse
 
+import numpy as np
 import polars as pl
-from bigtree import find_path, polars_to_tree_by_relation
 
-from utils.constants import get_ligand2cluster_fpath, get_target2cluster_fpath
+from utils.args import add_profiling_args, add_table_format_arg
+from utils.constants import (
+    get_ligand2cluster_fpath,
+    get_membership_fpath,
+    get_target2cluster_fpath,
+)
+from utils.membership import build_membership_matrix, save_membership
+from utils.profiling import StageProfiler
+from utils.tables import read_table, write_table
 
 
 def parse_args():
@@ -24,28 +32,28 @@ def parse_args():
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing active compound information",
+        help="Input TSV/Parquet file containing active compound information",
     )
     parser.add_argument(
         "--assay_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing TID and assay_id",
+        help="Input TSV/Parquet file containing TID and assay_id",
     )
     parser.add_argument(
         "--target_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing TID and protein_class_id for each protein",
+        help="Input TSV/Parquet file containing TID and protein_class_id for each protein",
     )
     parser.add_argument(
         "--family_details_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing protein_class_id and additional information (pref_name, short_name, class_level)",
+        help="Input TSV/Parquet file containing protein_class_id and additional information (pref_name, short_name, class_level)",
     )
     parser.add_argument(
         "--cluster_dir",
@@ -59,7 +67,7 @@ def parse_args():
         type=str,
         required=False,
         default=None,
-        help="(Optional) Output TSV file containing mapping from ligands (molregno) to targets (tid)",
+        help="(Optional) Output TSV/Parquet file containing mapping from ligands (molregno) to targets (tid)",
     )
     parser.add_argument(
         "--min_class_level",
@@ -75,87 +83,171 @@ def parse_args():
         default=argparse.SUPPRESS,
         help="Maximum class_level to cluster by (inclusive)",
     )
+    add_table_format_arg(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
-def get_protein_class_id_of_class_level(leaf_node, class_level: int) -> int:
-    if leaf_node.class_level < class_level:
-        return None
-    node = leaf_node
-    while node.class_level > class_level:
-        node = node.parent
-    return node.name  # will be protein_class_id based on main() construction
+def get_ancestor_table(
+    fam_df: pl.DataFrame, min_class_level: int, max_class_level: int
+) -> pl.DataFrame:
+    """
+    Get the ancestor of every protein class at each class_level in [min_class_level, max_class_level]
+    (the class itself at its own class_level). Classes with a class_level below a given level
+    have no ancestor at that level. Ancestors are found by following an array of parent
+    pointers for all classes at once, one step per level of the tree.
+
+    :param pl.DataFrame fam_df: protein_class_id, parent_id and class_level of each class
+    :param int min_class_level: minimum class_level (inclusive)
+    :param int max_class_level: maximum class_level (inclusive)
+    :return pl.DataFrame: table with columns protein_class_id, class_level, ancestor_id
+    """
+    fam_df = fam_df.sort("protein_class_id")
+    class_ids = fam_df["protein_class_id"].to_numpy()
+    class_levels = fam_df["class_level"].to_numpy()
+    assert len(np.unique(class_ids)) == len(class_ids)
+    # position of parent of each class (-1 if parent is not in fam_df, i.e. root)
+    parent_ids = fam_df["parent_id"].fill_null(-1).to_numpy()
+    parent_pos = np.minimum(np.searchsorted(class_ids, parent_ids), len(class_ids) - 1)
+    parent_pos[class_ids[parent_pos] != parent_ids] = -1
+
+    ancestor_dfs = []
+    for cl in range(min_class_level, max_class_level + 1):
+        pos = np.flatnonzero(class_levels >= cl)
+        ancestor_pos = pos.copy()
+        while True:
+            move = class_levels[ancestor_pos] > cl
+            if not move.any():
+                break
+            assert (
+                parent_pos[ancestor_pos[move]] >= 0
+            ).all(), f"Protein classes have no ancestor at class_level={cl}"
+            ancestor_pos[move] = parent_pos[ancestor_pos[move]]
+        ancestor_dfs.append(
+            pl.DataFrame(
+                {
+                    "protein_class_id": class_ids[pos],
+                    "class_level": np.full(len(pos), cl, dtype=np.int64),
+                    "ancestor_id": class_ids[ancestor_pos],
+                }
+            )
+        )
+    return pl.concat(ancestor_dfs)
 
 
 def main():
     args = parse_args()
-    target_df = pl.read_csv(
-        args.target_tsv_file, separator="\t", columns=["tid", "protein_class_id"]
-    )
-    fam_df = pl.read_csv(
-        args.family_details_tsv_file,
-        separator="\t",
-        columns=["protein_class_id", "parent_id", "class_level"],
-    )
-    activity_df = pl.read_csv(
-        args.activities_tsv_file, separator="\t", columns=["molregno", "assay_id"]
-    )
-    assay_df = pl.read_csv(
-        args.assay_tsv_file, separator="\t", columns=["assay_id", "tid"]
-    )
+    with StageProfiler(
+        "assign_family_clusters", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        with profiler.phase("load_tables", unit="activities"):
+            target_df = read_table(
+                args.target_tsv_file, columns=["tid", "protein_class_id"]
+            )
+            fam_df = read_table(
+                args.family_details_tsv_file,
+                columns=["protein_class_id", "parent_id", "class_level"],
+            )
+            activity_df = read_table(
+                args.activities_tsv_file, columns=["molregno", "assay_id"]
+            )
+            assay_df = read_table(args.assay_tsv_file, columns=["assay_id", "tid"])
+            profiler.add_items(len(activity_df))
 
-    # map active ligands to targets
-    joined = activity_df.join(assay_df, on="assay_id", how="inner")
-    mol2tid_df = joined.select(["molregno", "tid"]).unique()
-    assert len(mol2tid_df["molregno"].unique()) == len(activity_df["molregno"].unique())
+        # map active ligands to targets
+        with profiler.phase("map_ligands_to_targets"):
+            joined = activity_df.join(assay_df, on="assay_id", how="inner")
+            mol2tid_df = joined.select(["molregno", "tid"]).unique()
+            assert len(mol2tid_df["molregno"].unique()) == len(
+                activity_df["molregno"].unique()
+            )
 
-    # load family relationships
-    tree = polars_to_tree_by_relation(
-        fam_df, child_col="protein_class_id", parent_col="parent_id"
-    )
-    target_df = target_df.with_columns(
-        target_df["protein_class_id"]
-        .map_elements(lambda pid: find_path(tree, f"/{pid}"), return_dtype=pl.Object)
-        .alias("fam_path")
-    )
-    assert not (target_df["fam_path"].is_null().any())
-
-    # cluster ligands by protein family info
-    # NOTE: a single ligand can belong to multiple clusters because of:
-    # 1) ligand being active against > 1 target
-    # 2) ligand active against a single target, but that target has multiple classifications
-    # map ligands to active target(s) + family info
-    for cl in range(args.min_class_level, args.max_class_level + 1):
-        tid2cluster_df = target_df.with_columns(
-            target_df["fam_path"]
-            .map_elements(
-                lambda n: get_protein_class_id_of_class_level(n, cl), return_dtype=int
+            # rows of ligand x group membership matrices, reordered to match
+            # the similarity matrix on load (see utils/membership.py)
+            row_ids = activity_df["molregno"].unique().sort().to_list()
+
+        # load family relationships
+        with profiler.phase("build_ancestor_table"):
+            missing_classes = set(target_df["protein_class_id"]) - set(
+                fam_df["protein_class_id"]
             )
-            .alias("protein_class_id")
-        )
-        # null indicates no classification at this class_level
-        tid2cluster_df = tid2cluster_df.drop_nulls(subset=["protein_class_id"])
-        # help make it explicit that we're clustering by protein_class_id
-        unique_clusters = tid2cluster_df["protein_class_id"].unique().sort()
-        cluster_mapping = {cluster: i + 1 for i, cluster in enumerate(unique_clusters)}
-        tid2cluster_df = tid2cluster_df.with_columns(
-            pl.col("protein_class_id").replace(cluster_mapping).alias("cluster")
-        )
-        tid2cluster_df = tid2cluster_df[["tid", "protein_class_id", "cluster"]]
-        mol2cluster_df = mol2tid_df.join(tid2cluster_df, on="tid", how="inner")
-        mol2cluster_df = mol2cluster_df.sort(by="molregno")
-        tid2cluster_df = tid2cluster_df.sort(by="tid")
-        mol_save_path = get_ligand2cluster_fpath(args.cluster_dir, cl)
-        tid_save_path = get_target2cluster_fpath(args.cluster_dir, cl)
-        mol2cluster_df.write_csv(mol_save_path, separator="\t")
-        # saving tid2cluster_df bc there may be some targets which have no active ligands
-        tid2cluster_df.write_csv(tid_save_path, separator="\t")
-
-    # save mol2tid dataframe
-    if args.ligand2tid_tsv_file is not None:
-        mol2tid_df = mol2tid_df.sort(by="molregno")
-        mol2tid_df.write_csv(args.ligand2tid_tsv_file, separator="\t")
+            assert (
+                len(missing_classes) == 0
+            ), f"protein_class_id(s) of targets not found in family details: {missing_classes}"
+            ancestor_df = get_ancestor_table(
+                fam_df, args.min_class_level, args.max_class_level
+            )
+            # cluster (ancestor at class_level) of each target for all class levels at once
+            # targets w/o a classification at a class_level are dropped by the (inner) join
+            tid2ancestor_df = target_df.join(ancestor_df, on="protein_class_id").select(
+                "tid", pl.col("ancestor_id").alias("protein_class_id"), "class_level"
+            )
+            tid2ancestor_dfs = tid2ancestor_df.partition_by(
+                "class_level", as_dict=True, include_key=False
+            )
+
+        # cluster ligands by protein family info
+        # NOTE: a single ligand can belong to multiple clusters because of:
+        # 1) ligand being active against > 1 target
+        # 2) ligand active against a single target, but that target has multiple classifications
+        # map ligands to active target(s) + family info
+        for cl in range(args.min_class_level, args.max_class_level + 1):
+            with profiler.phase(f"class_level={cl}", unit="memberships"):
+                tid2cluster_df = tid2ancestor_dfs.get(
+                    (cl,), tid2ancestor_df.clear().drop("class_level")
+                )
+                # help make it explicit that we're clustering by protein_class_id
+                # (clusters numbered 1, 2, ... in order of protein_class_id)
+                tid2cluster_df = tid2cluster_df.with_columns(
+                    pl.col("protein_class_id")
+                    .rank("dense")
+                    .cast(pl.Int64)
+                    .alias("cluster")
+                )
+                tid2cluster_df = tid2cluster_df[["tid", "protein_class_id", "cluster"]]
+                mol2cluster_df = mol2tid_df.join(tid2cluster_df, on="tid", how="inner")
+                mol2cluster_df = mol2cluster_df.sort(by="molregno")
+                tid2cluster_df = tid2cluster_df.sort(by="tid")
+                mol_save_path = get_ligand2cluster_fpath(
+                    args.cluster_dir, cl, args.table_format
+                )
+                tid_save_path = get_target2cluster_fpath(
+                    args.cluster_dir, cl, args.table_format
+                )
+                write_table(mol2cluster_df, mol_save_path)
+                # saving tid2cluster_df bc there may be some targets which have no active ligands
+                write_table(tid2cluster_df, tid_save_path)
+                membership, col_ids = build_membership_matrix(
+                    mol2cluster_df, row_ids, "molregno", "cluster"
+                )
+                save_membership(
+                    membership,
+                    row_ids,
+                    col_ids,
+                    get_membership_fpath(args.cluster_dir, f"class_level={cl}"),
+                )
+                profiler.add_items(membership.nnz)
+
+        # save mol2tid dataframe
+        if args.ligand2tid_tsv_file is not None:
+            with profiler.phase("save_ligand2tid"):
+                mol2tid_df = mol2tid_df.sort(by="molregno")
+                write_table(mol2tid_df, args.ligand2tid_tsv_file)
+
+        # ligand x target and ligand x assay membership
+        for df, group_col in [(mol2tid_df, "tid"), (activity_df, "assay_id")]:
+            with profiler.phase(group_col, unit="memberships"):
+                membership, col_ids = build_membership_matrix(
+                    df, row_ids, "molregno", group_col
+                )
+                save_membership(
+                    membership,
+                    row_ids,
+                    col_ids,
+                    get_membership_fpath(args.cluster_dir, group_col),
+                )
+                profiler.add_items(membership.nnz)
 
 
 if __name__ == "__main__":
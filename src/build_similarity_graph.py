@@ -0,0 +1,86 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Create a sparse graph containing all pairs of ligands with
+similarity >= a given floor. For high floors this is a small
+fraction of the full similarity matrix (LTM), and can be used
+by probability_analysis.py instead of the dense LTM.
+"""
+
+import argparse
+
+from utils.args import add_profiling_args
+from utils.io import load_from_pkl
+from utils.ltm import check_size, load_sim_matrix
+from utils.profiling import StageProfiler
+from utils.sim_graph import get_sim_graph, save_sim_graph
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Create sparse graph of ligand pairs with similarity >= floor from lower-triangular similarity matrix (LTM)",
+        epilog="",
+    )
+    parser.add_argument(
+        "--similarity_npy_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input .npy file containing lower-triangular similarity matrix",
+    )
+    parser.add_argument(
+        "--similarity_id_pkl_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input .pkl file containing compound IDs (in order used by similarity_npy_file)",
+    )
+    parser.add_argument(
+        "--similarity_graph_npz_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output .npz file containing sparse graph of similarity values (indexed the same as similarity_npy_file)",
+    )
+    parser.add_argument(
+        "--similarity_floor",
+        type=float,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Minimum similarity value of pairs included in the graph",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=10_000_000,
+        help="Approximate number of LTM values to process at once (default: %(default)s)",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    with StageProfiler(
+        "build_similarity_graph", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        with profiler.phase("load_matrix"):
+            id_list = load_from_pkl(args.similarity_id_pkl_file)
+            N = len(id_list)
+            sim_matrix = load_sim_matrix(args.similarity_npy_file, mmap_mode="r")
+            check_size(sim_matrix, N)
+        with profiler.phase("build_graph", unit="pairs"):
+            graph = get_sim_graph(sim_matrix, N, args.similarity_floor, args.chunk_size)
+            graph = graph.tocsr()
+            profiler.add_items(len(sim_matrix))
+        print(
+            f"Graph contains {graph.nnz} of {len(sim_matrix)} pairs ({graph.nnz / max(len(sim_matrix), 1):.2%}) with similarity >= {args.similarity_floor}"
+        )
+        with profiler.phase("save_graph"):
+            save_sim_graph(graph, args.similarity_floor, args.similarity_graph_npz_file)
+
+
+if __name__ == "__main__":
+    main()
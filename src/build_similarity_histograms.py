@@ -0,0 +1,170 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Count the similarity values of the whole LTM and of every cluster/target/assay
+per value bin (exact counts, 1/65535 resolution, see utils/histograms.py).
+Values are streamed from the memory-mapped LTM/ragged arrays in chunks
+(processed in parallel if n_jobs > 1), whose counts are merged by summing them.
+The histograms are small enough to answer questions about the distributions
+(threshold counts, quantiles, medians, plots) without loading the values.
+"""
+
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse import csr_array
+
+from utils.args import add_grouping_args, add_profiling_args, get_groupings
+from utils.constants import get_group_values_fpath, get_histogram_fpath
+from utils.histograms import (
+    ALL_GROUP_ID,
+    get_chunk_histograms,
+    get_chunks,
+    merge_chunk_histograms,
+    save_histograms,
+)
+from utils.ltm import load_sim_matrix
+from utils.profiling import StageProfiler
+from utils.ragged import VALUES_FNAME, load_group_values
+
+# state of each worker process, set by init_worker
+_worker_state = {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compute exact histograms of the similarity values of the LTM and of each cluster/target/assay",
+        epilog="",
+    )
+    parser.add_argument(
+        "--similarity_npy_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output .npy file containing lower-triangular similarity matrix",
+    )
+    parser.add_argument(
+        "--cluster2sim_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input directory where similarity values gathered per class_level + cluster were saved to by gather_similarity_values.py",
+    )
+    parser.add_argument(
+        "--histogram_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output directory of the histograms (one .npz file per grouping)",
+    )
+    add_grouping_args(parser, "compute histograms of")
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=10_000_000,
+        help="Number of similarity values processed at once (per process) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to process chunks (default: %(default)s)",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def init_worker(values_npy_file: str, offsets: np.ndarray) -> None:
+    # each process memory-maps the (read-only) values itself
+    _worker_state["values"] = load_sim_matrix(values_npy_file, mmap_mode="r")
+    _worker_state["offsets"] = offsets
+
+
+def compute_chunk_histograms(
+    chunk: tuple[int, int],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # histograms of values[start:stop] of the values set by init_worker
+    start, stop = chunk
+    return get_chunk_histograms(
+        _worker_state["values"], _worker_state["offsets"], start, stop
+    )
+
+
+def summarize_values(
+    values_npy_file: str, offsets: np.ndarray, chunk_size: int, n_jobs: int = 1
+) -> csr_array:
+    """
+    Compute the histograms of each group of a ragged array of similarity values
+    (the whole LTM being a single group) in one pass over chunks of the values.
+
+    :param str values_npy_file: .npy file of the flat values (LTM or values of a ragged array)
+    :param np.ndarray offsets: offsets of the groups in the flat values
+    :param int chunk_size: number of values per chunk
+    :param int n_jobs: number of processes
+    :return csr_array: group x bin matrix of counts
+    """
+    chunks = get_chunks(int(offsets[-1]), chunk_size)
+    if n_jobs > 1 and len(chunks) > 1:
+        with Pool(
+            n_jobs, initializer=init_worker, initargs=(values_npy_file, offsets)
+        ) as pool:
+            # merged in order of the chunks, so results do not depend on scheduling
+            chunk_histograms = list(pool.imap(compute_chunk_histograms, chunks))
+    else:
+        init_worker(values_npy_file, offsets)
+        chunk_histograms = list(map(compute_chunk_histograms, chunks))
+    return merge_chunk_histograms(chunk_histograms, len(offsets) - 1)
+
+
+def main():
+    args = parse_args()
+    with StageProfiler(
+        "build_similarity_histograms", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        os.makedirs(args.histogram_dir, exist_ok=True)
+
+        with profiler.phase("all", unit="pairs"):
+            sim_matrix = load_sim_matrix(args.similarity_npy_file, mmap_mode="r")
+            histograms = summarize_values(
+                args.similarity_npy_file,
+                np.array([0, len(sim_matrix)], dtype=np.int64),
+                args.chunk_size,
+                args.n_jobs,
+            )
+            save_histograms(
+                histograms,
+                [ALL_GROUP_ID],
+                get_histogram_fpath(args.histogram_dir, "all"),
+            )
+            profiler.add_items(len(sim_matrix))
+
+        for grouping, _, _ in get_groupings(args):
+            with profiler.phase(grouping, unit="pairs"):
+                group_values_dir = get_group_values_fpath(
+                    args.cluster2sim_dir, grouping
+                )
+                group_values = load_group_values(group_values_dir)
+                histograms = summarize_values(
+                    os.path.join(group_values_dir, VALUES_FNAME),
+                    group_values.offsets,
+                    args.chunk_size,
+                    args.n_jobs,
+                )
+                save_histograms(
+                    histograms,
+                    group_values.group_ids,
+                    get_histogram_fpath(args.histogram_dir, grouping),
+                )
+                profiler.add_items(group_values.offsets[-1])
+                print(
+                    f"{grouping}: {len(group_values)} histograms with {histograms.nnz} non-empty bins"
+                )
+        print(f"Saved histograms to: {args.histogram_dir}")
+
+
+if __name__ == "__main__":
+    main()
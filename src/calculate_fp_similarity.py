@@ -9,11 +9,37 @@ adapted to other similarity metrics in the future.
 """
 
 import argparse
+import os
+import shutil
+from collections import deque
+from multiprocessing import Pool
 
 import numpy as np
+from rdkit import DataStructs
 from rdkit.DataManip.Metric.rdMetricMatrixCalc import GetTanimotoSimMat
 
+from utils.args import add_profiling_args
+from utils.fingerprints import (
+    bulk_tanimoto_packed,
+    fps_to_packed_array,
+    get_popcounts,
+    load_packed_fps,
+    packed_array_to_fps,
+)
 from utils.io import load_from_pkl, save_to_pkl
+from utils.ltm import (
+    SIM_DTYPES,
+    get_id2idx_map,
+    get_row_tiles,
+    get_triangle_number,
+    load_sim_matrix,
+    quantize_sim_values,
+    resize_sim_matrix_file,
+)
+from utils.profiling import StageProfiler
+
+# tile budget used when the matrix is built in memory with --backend numpy or --n_jobs > 1
+DEFAULT_TILE_BUDGET_MB = 256
 
 
 def parse_args():
@@ -21,13 +47,25 @@ def parse_args():
         description="Calculate lower-triangular similarity matrix from input fingerprints and save to .npy file",
         epilog="",
     )
-    parser.add_argument(
+    fingerprints_group = parser.add_mutually_exclusive_group(required=True)
+    fingerprints_group.add_argument(
         "--fingerprints_pkl_file",
         type=str,
-        required=True,
-        default=argparse.SUPPRESS,
+        default=None,
         help="Input Pickle file containing compound ID mapped to fingerprint",
     )
+    fingerprints_group.add_argument(
+        "--fingerprints_npy_file",
+        type=str,
+        default=None,
+        help="Input .npy file containing packed fingerprints (from generate_fingerprints.py). Must be given with --fingerprint_ids_npy_file",
+    )
+    parser.add_argument(
+        "--fingerprint_ids_npy_file",
+        type=str,
+        default=None,
+        help="Input .npy file containing compound IDs (in order used by fingerprints_npy_file)",
+    )
     parser.add_argument(
         "--similarity_npy_file",
         type=str,
@@ -46,15 +84,57 @@ def parse_args():
         "--max_n_compounds",
         type=int,
         default=20_000,
-        help="Maximum number of fingerprints to be processed. Included as a failsafe to help warn users of extreme computation/storage cost",
+        help="Maximum number of fingerprints to be processed. Included as a failsafe to help warn users of extreme computation/storage cost. Only used when building the matrix in memory (i.e., --tile_budget_mb not given)",
+    )
+    parser.add_argument(
+        "--tile_budget_mb",
+        type=int,
+        default=None,
+        help="(Optional) If given, build the matrix in blocks of rows (each using at most ~tile_budget_mb MB) written directly to a memory-mapped .npy file. Use this when the full matrix does not fit in RAM",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=["rdkit", "numpy"],
+        default="numpy",
+        help="Backend used to compute Tanimoto coeffs. 'numpy' converts fingerprints to packed uint64 arrays and uses vectorized popcounts (gives identical values to 'rdkit') (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--similarity_dtype",
+        type=str,
+        choices=SIM_DTYPES,
+        default="float64",
+        help="Storage type of the similarity matrix. Lower precision types reduce disk/RAM usage, 'uint16' stores fixed-point values (value * 65535) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to compute the similarity matrix (default: %(default)s)",
     )
+    parser.add_argument(
+        "--base_similarity_npy_file",
+        type=str,
+        default=None,
+        help="(Optional) Existing similarity matrix to extend (e.g., from a previous ChEMBL version). Only rows of compounds not in --base_similarity_id_pkl_file are computed and appended. Can be the same as --similarity_npy_file to extend it in place",
+    )
+    parser.add_argument(
+        "--base_similarity_id_pkl_file",
+        type=str,
+        default=None,
+        help="(Optional) Compound IDs of --base_similarity_npy_file",
+    )
+    add_profiling_args(parser)
     args = parser.parse_args()
+    assert (args.base_similarity_npy_file is None) == (
+        args.base_similarity_id_pkl_file is None
+    ), "--base_similarity_npy_file and --base_similarity_id_pkl_file must be given together"
     return args
 
 
-def assertion_msg(d: dict, max_n_compounds: int) -> str:
+def assertion_msg(ids: tuple, max_n_compounds: int) -> str:
     return f"""
-    Given number of compounds was {len(d)} when max_n_compounds={max_n_compounds}. 
+    Given number of compounds was {len(ids)} when max_n_compounds={max_n_compounds}. 
     Note that creating a full similarity matrix is O(N^2) in terms of both computational cost and storage, 
     so please make sure to set a reasonable limit on max_n_compounds. 
     If you have a very large number of compounds then you may want to use other methods 
@@ -62,15 +142,262 @@ def assertion_msg(d: dict, max_n_compounds: int) -> str:
     """
 
 
+def check_disk_space(save_path: str, n_bytes: int) -> None:
+    save_dir = os.path.dirname(os.path.abspath(save_path))
+    free_bytes = shutil.disk_usage(save_dir).free
+    assert (
+        n_bytes < free_bytes
+    ), f"Similarity matrix requires {n_bytes / 1e9:.2f} GB, but only {free_bytes / 1e9:.2f} GB free in {save_dir}"
+
+
+# set once per process by init_worker (avoids re-sending fingerprints with each tile)
+_worker_state = {}
+
+
+def init_worker(fingerprints, backend: str) -> None:
+    _worker_state["backend"] = backend
+    if backend == "numpy":
+        _worker_state["counts"] = get_popcounts(fingerprints)
+    _worker_state["fingerprints"] = fingerprints
+
+
+def compute_tile(tile: tuple[int, int]) -> np.ndarray:
+    """
+    Compute the similarity values of LTM rows [start, stop) using the
+    fingerprints/backend set by init_worker.
+    """
+    start, stop = tile
+    fingerprints = _worker_state["fingerprints"]
+    tile_offset = get_triangle_number(start)
+    values = np.empty(get_triangle_number(stop) - tile_offset, dtype=np.float64)
+    for row in range(start, stop):
+        row_offset = get_triangle_number(row) - tile_offset
+        if _worker_state["backend"] == "numpy":
+            counts = _worker_state["counts"]
+            row_values = bulk_tanimoto_packed(
+                fingerprints[row], fingerprints[:row], counts[row], counts[:row]
+            )
+        else:
+            row_values = DataStructs.BulkTanimotoSimilarity(
+                fingerprints[row], fingerprints[:row]
+            )
+        values[row_offset : row_offset + row] = row_values
+    return values
+
+
+def write_tile(sim_matrix: np.ndarray, start: int, values: np.ndarray) -> None:
+    # values of the rows of a tile starting at row start, converted to the storage type
+    tile_offset = get_triangle_number(start)
+    sim_matrix[tile_offset : tile_offset + len(values)] = quantize_sim_values(
+        values, sim_matrix.dtype.name
+    )
+    if isinstance(sim_matrix, np.memmap):
+        sim_matrix.flush()
+
+
+def fill_sim_matrix(
+    sim_matrix: np.ndarray,
+    fingerprints,
+    tile_budget_mb: int,
+    backend: str = "rdkit",
+    n_jobs: int = 1,
+    start_row: int = 1,
+) -> None:
+    """
+    Compute the LTM of Tanimoto coeffs in tiles of rows and write each tile
+    into sim_matrix (which can be memory-mapped). The layout is the same as the
+    output of GetTanimotoSimMat (row-major lower triangle, float64).
+
+    :param np.ndarray sim_matrix: output array of length N*(N-1)/2 (any of SIM_DTYPES)
+    :param fingerprints: RDKit fingerprints ("rdkit") or packed fingerprints ("numpy")
+    :param int tile_budget_mb: approximate memory budget of a single tile (in MB)
+    :param str backend: "rdkit" or "numpy"
+    :param int n_jobs: number of processes used to compute tiles
+    :param int start_row: first row to compute, rows before it are left untouched
+    """
+    N = len(fingerprints)
+    # tiles are computed as float64 prior to conversion to the storage type
+    max_tile_values = max(1, (tile_budget_mb * 1024**2) // 8)
+    if n_jobs > 1:
+        # bound tile size so work is spread across all processes
+        n_values = get_triangle_number(N) - get_triangle_number(start_row)
+        max_tile_values = min(max_tile_values, max(1, n_values // (4 * n_jobs)))
+    tiles = list(get_row_tiles(N, max_tile_values, start_row))
+    if n_jobs > 1:
+        with Pool(
+            n_jobs, initializer=init_worker, initargs=(fingerprints, backend)
+        ) as pool:
+            # tiles are written in order, with at most 2 * n_jobs tiles in flight so
+            # finished tiles do not pile up in memory when writing is slower than computing
+            pending = deque()
+            for tile in tiles:
+                if len(pending) == 2 * n_jobs:
+                    start, result = pending.popleft()
+                    write_tile(sim_matrix, start, result.get())
+                pending.append((tile[0], pool.apply_async(compute_tile, (tile,))))
+            while pending:
+                start, result = pending.popleft()
+                write_tile(sim_matrix, start, result.get())
+    else:
+        init_worker(fingerprints, backend)
+        for (start, _), values in zip(tiles, map(compute_tile, tiles)):
+            write_tile(sim_matrix, start, values)
+
+
+def get_extended_ids(base_ids: tuple, ids: tuple) -> tuple[tuple, list]:
+    """
+    Get the ID order of the base LTM extended with the new IDs (appended as new rows).
+
+    :param tuple base_ids: IDs of the existing LTM (in LTM order)
+    :param tuple ids: IDs of all current compounds
+    :return tuple[tuple, list]: extended IDs and IDs of base LTM no longer present
+    """
+    id_set, base_id_set = set(ids), set(base_ids)
+    removed_ids = [x for x in base_ids if x not in id_set]
+    added_ids = [x for x in ids if x not in base_id_set]
+    return tuple(base_ids) + tuple(added_ids), removed_ids
+
+
+def extend_sim_matrix(
+    base_similarity_npy_file: str,
+    similarity_npy_file: str,
+    n_base: int,
+    fingerprints,
+    tile_budget_mb: int,
+    backend: str = "rdkit",
+    n_jobs: int = 1,
+) -> None:
+    """
+    Extend the LTM of the first n_base fingerprints with the rows of the remaining ones.
+    Only the new rows are computed (O(N*M) for M new compounds).
+    """
+    N = len(fingerprints)
+    if os.path.abspath(base_similarity_npy_file) != os.path.abspath(
+        similarity_npy_file
+    ):
+        shutil.copyfile(base_similarity_npy_file, similarity_npy_file)
+    sim_matrix = load_sim_matrix(similarity_npy_file, mmap_mode="r")
+    assert len(sim_matrix) >= get_triangle_number(
+        n_base
+    ), f"Base LTM has {len(sim_matrix)} values, expected {get_triangle_number(n_base)} for {n_base} compounds"
+    n_new_bytes = (get_triangle_number(N) - len(sim_matrix)) * sim_matrix.dtype.itemsize
+    del sim_matrix
+    check_disk_space(similarity_npy_file, n_new_bytes)
+    sim_matrix = resize_sim_matrix_file(similarity_npy_file, get_triangle_number(N))
+    fill_sim_matrix(
+        sim_matrix, fingerprints, tile_budget_mb, backend, n_jobs, start_row=n_base
+    )
+    del sim_matrix
+
+
 def main():
     args = parse_args()
-    assert args.similarity_npy_file.endswith(".npy")
-    d = load_from_pkl(args.fingerprints_pkl_file)
-    assert len(d) < args.max_n_compounds, assertion_msg(d, args.max_n_compounds)
-    ids, fingerprints = zip(*d.items())
-    sim_matrix = GetTanimotoSimMat(fingerprints)
-    np.save(args.similarity_npy_file, sim_matrix)
-    save_to_pkl(ids, args.similarity_id_pkl_file)
+    with StageProfiler(
+        "calculate_fp_similarity", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        with profiler.phase("load_fingerprints", unit="fingerprints"):
+            assert args.similarity_npy_file.endswith(".npy")
+            if args.fingerprints_npy_file is not None:
+                assert (
+                    args.fingerprint_ids_npy_file is not None
+                ), "--fingerprint_ids_npy_file must be given with --fingerprints_npy_file"
+                ids, fingerprints = load_packed_fps(
+                    args.fingerprints_npy_file, args.fingerprint_ids_npy_file
+                )
+                ids = tuple(ids.tolist())
+                if args.backend == "rdkit":
+                    fingerprints = tuple(packed_array_to_fps(fingerprints))
+            else:
+                d = load_from_pkl(args.fingerprints_pkl_file)
+                ids, fingerprints = zip(*d.items())
+                if args.backend == "numpy":
+                    fingerprints = fps_to_packed_array(fingerprints)
+            profiler.add_items(len(ids))
+        if args.base_similarity_npy_file is not None:
+            base_ids = load_from_pkl(args.base_similarity_id_pkl_file)
+            extended_ids, removed_ids = get_extended_ids(base_ids, ids)
+            if len(removed_ids) > 0:
+                print(
+                    f"{len(removed_ids)} compounds of base similarity matrix no longer present, "
+                    "compaction needed: computing full similarity matrix instead"
+                )
+            else:
+                base_dtype = load_sim_matrix(
+                    args.base_similarity_npy_file, mmap_mode="r"
+                ).dtype.name
+                assert (
+                    base_dtype == args.similarity_dtype
+                ), f"dtype of base similarity matrix ({base_dtype}) differs from --similarity_dtype ({args.similarity_dtype})"
+                print(
+                    f"Extending similarity matrix of {len(base_ids)} compounds with {len(extended_ids) - len(base_ids)} new compounds"
+                )
+                id2idx = get_id2idx_map(ids)
+                order = [id2idx[x] for x in extended_ids]
+                if args.backend == "numpy":
+                    fingerprints = fingerprints[order]
+                else:
+                    fingerprints = tuple(fingerprints[i] for i in order)
+                tile_budget_mb = (
+                    DEFAULT_TILE_BUDGET_MB
+                    if args.tile_budget_mb is None
+                    else args.tile_budget_mb
+                )
+                with profiler.phase("extend_matrix", unit="pairs"):
+                    extend_sim_matrix(
+                        args.base_similarity_npy_file,
+                        args.similarity_npy_file,
+                        len(base_ids),
+                        fingerprints,
+                        tile_budget_mb,
+                        args.backend,
+                        args.n_jobs,
+                    )
+                    profiler.add_items(
+                        get_triangle_number(len(extended_ids))
+                        - get_triangle_number(len(base_ids))
+                    )
+                save_to_pkl(extended_ids, args.similarity_id_pkl_file)
+                return
+
+        N = len(ids)
+        n_values = get_triangle_number(N)
+        with profiler.phase("compute_matrix", unit="pairs"):
+            if args.tile_budget_mb is not None:
+                # build matrix out-of-core
+                dtype = np.dtype(args.similarity_dtype)
+                check_disk_space(args.similarity_npy_file, n_values * dtype.itemsize)
+                sim_matrix = np.lib.format.open_memmap(
+                    args.similarity_npy_file, mode="w+", dtype=dtype, shape=(n_values,)
+                )
+                fill_sim_matrix(
+                    sim_matrix,
+                    fingerprints,
+                    args.tile_budget_mb,
+                    args.backend,
+                    args.n_jobs,
+                )
+                del sim_matrix
+            else:
+                assert N < args.max_n_compounds, assertion_msg(
+                    ids, args.max_n_compounds
+                )
+                if args.backend == "rdkit" and args.n_jobs == 1:
+                    sim_matrix = GetTanimotoSimMat(fingerprints)
+                    sim_matrix = quantize_sim_values(sim_matrix, args.similarity_dtype)
+                else:
+                    sim_matrix = np.empty(n_values, dtype=args.similarity_dtype)
+                    fill_sim_matrix(
+                        sim_matrix,
+                        fingerprints,
+                        DEFAULT_TILE_BUDGET_MB,
+                        args.backend,
+                        args.n_jobs,
+                    )
+            profiler.add_items(n_values)
+        if args.tile_budget_mb is None:
+            with profiler.phase("save_matrix"):
+                np.save(args.similarity_npy_file, sim_matrix)
+        save_to_pkl(ids, args.similarity_id_pkl_file)
 
 
 if __name__ == "__main__":
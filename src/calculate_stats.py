@@ -5,9 +5,27 @@ Description:
 Compute statistics from the similarity values of the overall
 population (e.g., all protein kinase ligands) and the
 sub-clusters (e.g., kinase groups).
+Statistics are derived from the exact histograms saved by
+build_similarity_histograms.py (see utils/histograms.py), so the
+similarity values themselves are not read again.
 """
 
 import argparse
+import os
+
+import numpy as np
+import polars as pl
+
+from utils.args import (
+    add_grouping_args,
+    add_profiling_args,
+    add_table_format_arg,
+    get_groupings,
+)
+from utils.constants import get_histogram_fpath, get_stats_fpath
+from utils.histograms import get_histogram_stats, load_histograms
+from utils.profiling import StageProfiler
+from utils.tables import write_table
 
 
 def parse_args():
@@ -15,5 +33,68 @@ def parse_args():
         description="Calculate statistics (mean, median, std) from the provided files",
         epilog="",
     )
+    parser.add_argument(
+        "--histogram_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input directory where histograms of the similarity values were saved to by build_similarity_histograms.py",
+    )
+    parser.add_argument(
+        "--stats_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output directory of the statistics (one table per grouping)",
+    )
+    add_grouping_args(parser, "calculate statistics of")
+    add_table_format_arg(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
+
+
+def get_stats_df(
+    histogram_fpath: str, group_col: str = None
+) -> tuple[pl.DataFrame, int]:
+    """
+    Get the statistics of each group of the histograms saved to histogram_fpath.
+
+    :param str histogram_fpath: .npz file saved by build_similarity_histograms.py
+    :param str group_col: (Optional) name of the column of group IDs, omitted if None
+    :return tuple[pl.DataFrame, int]: table with one row per group and total number of values
+    """
+    histograms, group_ids = load_histograms(histogram_fpath)
+    stats = get_histogram_stats(histograms)
+    if group_col is not None:
+        stats = {group_col: group_ids, **stats}
+    return pl.DataFrame(stats), int(np.sum(stats["n_pairs"]))
+
+
+def main():
+    args = parse_args()
+    with StageProfiler(
+        "calculate_stats", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        os.makedirs(args.stats_dir, exist_ok=True)
+
+        # overall population (all values of the LTM) + one table per grouping
+        groupings = [("all", None)]
+        groupings += [
+            (grouping, group_col) for grouping, group_col, _ in get_groupings(args)
+        ]
+        for grouping, group_col in groupings:
+            with profiler.phase(grouping, unit="pairs"):
+                stats_df, n_values = get_stats_df(
+                    get_histogram_fpath(args.histogram_dir, grouping), group_col
+                )
+                write_table(
+                    stats_df,
+                    get_stats_fpath(args.stats_dir, grouping, args.table_format),
+                )
+                profiler.add_items(n_values)
+        print(f"Saved statistics to: {args.stats_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Run the full ChEMBL extraction chain (targets -> families -> assays ->
+activities -> structures) in a single read-only REPEATABLE READ transaction,
+so all outputs come from one consistent snapshot of the DB. Produces the same
+TSV/Parquet files as get_protein_targets.py, get_addl_family_info.py,
+get_relevant_assays.py, get_active_ligands.py and get_ligand_structures.py
+(which remain available for ad-hoc use).
+"""
+
+import argparse
+from functools import partial
+
+import psycopg2
+from psycopg2.extras import DictCursor
+
+from get_active_ligands import get_active_mol_info_query
+from get_addl_family_info import get_addl_info
+from get_ligand_structures import get_compound_structures_query
+from get_protein_targets import get_protein_class_relations, get_target_info
+from get_relevant_assays import get_assays_query
+from utils.args import (
+    add_batch_size_arg,
+    add_chembl_db_args,
+    add_profiling_args,
+    add_query_cache_args,
+)
+from utils.profiling import StageProfiler
+from utils.query_cache import cached_query_to_file
+from utils.tables import write_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Extract targets, protein families, assays, active ligands and ligand structures from ChEMBL using a single DB session.",
+        epilog="",
+    )
+    add_chembl_db_args(parser)
+    add_batch_size_arg(parser)
+    add_query_cache_args(parser)
+    # target selection
+    parser.add_argument(
+        "--protein_class_id",
+        type=int,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="ID of the protein class. Should match against 'protein_class_id' column in 'protein_classification' table.",
+    )
+    parser.add_argument(
+        "--organism",
+        type=str,
+        required=False,
+        default=None,
+        help="(Optional) If given, will only select proteins belonging to the given organism",
+    )
+    parser.add_argument(
+        "--target_type",
+        type=str,
+        required=False,
+        default=None,
+        help="(Optional) If given, will only select proteins of the given type",
+    )
+    # assay selection
+    parser.add_argument(
+        "--assay_type",
+        type=str,
+        required=False,
+        default=None,
+        help="(Optional) Filter by given assay_type",
+    )
+    parser.add_argument(
+        "--doc_type",
+        type=str,
+        required=False,
+        default=None,
+        help="(Optional) Filter to only include assays associated with the given doc_type",
+    )
+    parser.add_argument(
+        "--confidence_score",
+        type=int,
+        required=False,
+        default=None,
+        help="(Optional) Filter by given confidence_score",
+    )
+    parser.add_argument(
+        "--exclude_variants",
+        action=argparse.BooleanOptionalAction,
+        help="Exclude assays which target a variant",
+    )
+    # ligand selection
+    parser.add_argument(
+        "--pchembl_min_value",
+        type=float,
+        default=5.0,
+        help="Minimum activity threshold (defined by pchembl_value)",
+    )
+    parser.add_argument(
+        "--min_mw",
+        type=float,
+        default=200.0,
+        help="Minimum full molecular weight of selected compounds (in Da)",
+    )
+    parser.add_argument(
+        "--max_mw",
+        type=float,
+        default=900.0,
+        help="Maximum full molecular weight of selected compounds (in Da)",
+    )
+    parser.add_argument(
+        "--structural_alert_set_ids",
+        type=lambda s: [int(item) for item in s.split(",")],
+        default=None,
+        help="(Optional) One or more alert_set_ids to filter on (comma-separated)",
+    )
+    parser.add_argument(
+        "--query_cache_pchembl_min_value",
+        type=float,
+        default=None,
+        help="(Optional) On a query cache miss, fetch and cache activities with pchembl_value >= this (lower) value instead",
+    )
+    # outputs
+    parser.add_argument(
+        "--target_tsv_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output TSV/Parquet file containing TID and protein_class_id for each protein",
+    )
+    parser.add_argument(
+        "--family_tsv_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output TSV/Parquet file containing family relationship information from protein_classification table",
+    )
+    parser.add_argument(
+        "--family_details_tsv_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output TSV/Parquet file containing protein_class_id and additional information (pref_name, short_name, class_level)",
+    )
+    parser.add_argument(
+        "--assay_tsv_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output TSV/Parquet file containing TID and assay_id",
+    )
+    parser.add_argument(
+        "--activities_tsv_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output TSV/Parquet file containing active compound information",
+    )
+    parser.add_argument(
+        "--compound_structures_tsv_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output TSV/Parquet file containing compound ID, Inchi, and SMILES",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    with StageProfiler(
+        "extract_chembl_data", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        connection = psycopg2.connect(
+            dbname=args.db_name,
+            host=args.db_host,
+            user=args.db_user,
+            password=args.db_password,
+            port=args.db_port,
+            cursor_factory=DictCursor,
+        )
+        # all queries below run in a single transaction (one snapshot of the DB)
+        connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        cursor = connection.cursor()
+
+        # Targets + protein families
+        with profiler.phase("targets_and_families", unit="rows"):
+            protein_class_relations = get_protein_class_relations(
+                cursor, args.protein_class_id
+            )
+            protein_class_ids = [x[0] for x in protein_class_relations]
+            target_info = get_target_info(
+                cursor, protein_class_ids, args.organism, args.target_type
+            )
+            family_details = get_addl_info(cursor, protein_class_ids)
+            write_rows(
+                args.family_tsv_file,
+                protein_class_relations,
+                ["protein_class_id", "parent_id"],
+            )
+            write_rows(
+                args.target_tsv_file,
+                target_info,
+                ["tid", "protein_class_id", "component_id", "accession"],
+            )
+            write_rows(
+                args.family_details_tsv_file,
+                family_details,
+                [
+                    "protein_class_id",
+                    "parent_id",
+                    "pref_name",
+                    "short_name",
+                    "class_level",
+                ],
+            )
+            profiler.add_items(len(target_info) + len(family_details))
+        print(f"Found {len(target_info)} target components")
+
+        # Assays, IDs are collected while streaming instead of re-reading the TSV
+        tids = list(set(row[0] for row in target_info))
+        assay_ids = []
+        query = get_assays_query(
+            tids,
+            args.assay_type,
+            args.confidence_score,
+            args.doc_type,
+            args.exclude_variants,
+        )
+        with profiler.phase("assays", unit="rows"):
+            n_assays = cached_query_to_file(
+                connection,
+                query,
+                args.assay_tsv_file,
+                ["assay_id", "tid"],
+                args.query_cache_dir,
+                args.batch_size,
+                args.query_cache_max_mb,
+                on_batch=lambda rows: assay_ids.extend(int(row[0]) for row in rows),
+            )
+            profiler.add_items(n_assays)
+        print(f"Found {n_assays} assays")
+
+        # Activities
+        molregnos = set()
+        get_query = partial(
+            get_active_mol_info_query,
+            assay_ids,
+            min_mw=args.min_mw,
+            max_mw=args.max_mw,
+            structural_alert_set_ids=args.structural_alert_set_ids,
+        )
+        with profiler.phase("activities", unit="rows"):
+            n_activities = cached_query_to_file(
+                connection,
+                get_query(args.pchembl_min_value),
+                args.activities_tsv_file,
+                ["molregno", "chembl_id", "assay_id", "standard_type", "pchembl_value"],
+                args.query_cache_dir,
+                args.batch_size,
+                args.query_cache_max_mb,
+                on_batch=lambda rows: molregnos.update(int(row[0]) for row in rows),
+                min_filter=(get_query, "pchembl_value", args.pchembl_min_value),
+                superset_min_value=args.query_cache_pchembl_min_value,
+            )
+            profiler.add_items(n_activities)
+        print(f"Found {n_activities} activities of {len(molregnos)} compounds")
+
+        # Structures
+        with profiler.phase("structures", unit="rows"):
+            query = get_compound_structures_query(sorted(molregnos))
+            n_structures = cached_query_to_file(
+                connection,
+                query,
+                args.compound_structures_tsv_file,
+                ["molregno", "chembl_id", "standard_inchi", "canonical_smiles"],
+                args.query_cache_dir,
+                args.batch_size,
+                args.query_cache_max_mb,
+            )
+            profiler.add_items(n_structures)
+
+        # Close connections
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,20 +6,28 @@ Collect similarity values in clusters.
 """
 
 import argparse
-from itertools import combinations
+from math import comb
 
 import numpy as np
-import polars as pl
 from rdkit import DataStructs  # for validation
+from scipy.sparse import csr_array
 
-from utils.constants import (
-    get_assay2sim_fpath,
-    get_cluster2sim_fpath,
-    get_ligand2cluster_fpath,
-    get_tid2sim_fpath,
+from utils.constants import get_group_values_fpath, get_membership_fpath
+from utils.args import add_grouping_args, add_profiling_args, get_groupings
+from utils.fingerprints import load_packed_fps, packed_fps_to_dict
+from utils.io import load_from_pkl
+from utils.ltm import (
+    check_size,
+    dequantize_sim_values,
+    get_group_ltm_indices,
+    get_max_quantization_error,
+    get_pair_positions,
+    iter_group_ltm_indices,
+    load_sim_matrix,
 )
-from utils.io import load_from_pkl, save_to_pkl
-from utils.ltm import check_size, get_id2idx_map, get_ltm_idx
+from utils.membership import get_group_members, load_membership
+from utils.profiling import StageProfiler
+from utils.ragged import create_group_values
 
 
 def parse_args():
@@ -52,22 +60,9 @@ def parse_args():
         "--cluster2sim_dir",
         type=str,
         required=True,
-        help="Output directory where .pkl files containing similarity values gathered per class_level + cluster",
-    )
-    parser.add_argument(
-        "--min_class_level",
-        type=int,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Minimum class_level to visualize (inclusive)",
-    )
-    parser.add_argument(
-        "--max_class_level",
-        type=int,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Maximum class_level to visualize (inclusive)",
+        help="Output directory where similarity values gathered per class_level + cluster (as well as per target/assay) are saved as ragged arrays (see utils/ragged.py)",
     )
+    add_grouping_args(parser, "gather similarity values of")
     parser.add_argument(
         "--fingerprints_pkl_file",
         type=str,
@@ -75,126 +70,189 @@ def parse_args():
         help="(Optional) Input Pickle file containing compound ID mapped to fingerprint. If given will be used to validate the logic of this script.",
     )
     parser.add_argument(
-        "--ligand2tid_tsv_file",
+        "--fingerprints_npy_file",
         type=str,
-        required=False,
         default=None,
-        help="(Optional) TSV file containing mapping from ligands (molregno) to targets (tid). If given will also gather ligand similarity values per TID.",
+        help="(Optional) Input .npy file containing packed fingerprints (alternative to fingerprints_pkl_file). Must be given with --fingerprint_ids_npy_file",
     )
     parser.add_argument(
-        "--activities_tsv_file",
+        "--fingerprint_ids_npy_file",
         type=str,
+        default=None,
+        help="(Optional) Input .npy file containing compound IDs (in order used by fingerprints_npy_file)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
         required=False,
         default=None,
-        help="(Optional) Input TSV file containing active compound information (ligand <-> assay_id mapping). If given will also gather ligand similarity values per ASSAY_ID.",
+        help="(Optional) Max number of ligand pairs to gather at once per group. If not given all pairs of a group are gathered in a single pass (fastest, but uses the most memory for large groups).",
     )
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
-def run_check(fetched_sim: float, fp_dict: dict, id1: int, id2: int, i1: int, i2: int):
+def run_check(
+    fetched_sim: float,
+    fp_dict: dict,
+    id1: int,
+    id2: int,
+    i1: int,
+    i2: int,
+    atol: float = 1e-8,
+):
     true_sim = DataStructs.TanimotoSimilarity(fp_dict[id1], fp_dict[id2])
     assert np.isclose(
-        fetched_sim, true_sim
+        fetched_sim, true_sim, atol=atol
     ), f"ids={(id1, id2)}\nindices={(i1, i2)}\nfetched_sim={fetched_sim}\ntrue_sim={true_sim}\nLogic for get_ltm_idx is incorrect, check logic."
 
 
+def run_checks(
+    sim_values: np.ndarray,
+    fp_dict: dict,
+    id_list: list[int],
+    idx_array: np.ndarray,
+    a: np.ndarray,
+    b: np.ndarray,
+    atol: float = 1e-8,
+):
+    for sim_value, p1, p2 in zip(sim_values, a, b):
+        run_check(
+            sim_value,
+            fp_dict,
+            id_list[idx_array[p1]],
+            id_list[idx_array[p2]],
+            idx_array[p1],
+            idx_array[p2],
+            atol,
+        )
+
+
 def get_similarity_values(
-    ligand_ids: list[int],
+    idx_array: np.ndarray,
     sim_matrix: np.ndarray,
-    id2idx_map: dict,
+    id_list: list[int],
     validate: bool,
     fp_dict: dict = None,
-) -> list[float]:
-    sim_values = []
-    for id1, id2 in combinations(ligand_ids, 2):
-        i1, i2 = id2idx_map[id1], id2idx_map[id2]
-        row = max(i1, i2)
-        col = min(i1, i2)
-        sim_idx = get_ltm_idx(row, col)
-        sim_value = sim_matrix[sim_idx]
-        sim_values.append(sim_value)
+    chunk_size: int = None,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Gather the similarity values of all pairs of the given ligands.
+    Values are ordered the same as itertools.combinations(idx_array, 2).
+
+    :param np.ndarray idx_array: indices (in id_list) of ligands in the group
+    :param np.ndarray sim_matrix: 1D array containing similarity values (LTM, any storage type)
+    :param list[int] id_list: compound IDs (in order used by sim_matrix)
+    :param bool validate: if True, recompute each value from fp_dict and compare
+    :param dict fp_dict: compound ID mapped to fingerprint (only used if validate)
+    :param int chunk_size: if given, gather at most ~chunk_size pairs at a time
+    :param np.ndarray out: (Optional) array to write the values to (e.g., view of a memory-mapped file)
+    :return np.ndarray: similarity values of all pairs in the group
+    """
+    atol = max(get_max_quantization_error(sim_matrix.dtype), 1e-8)
+    n = len(idx_array)
+    sim_values = out if out is not None else np.empty(comb(n, 2), dtype=np.float64)
+    assert len(sim_values) == comb(n, 2)
+    if chunk_size is None:
+        sim_values[:] = dequantize_sim_values(
+            sim_matrix[get_group_ltm_indices(idx_array)]
+        )
         if validate:
-            run_check(sim_value, fp_dict, id1, id2, i1, i2)
+            a, b = get_pair_positions(n)
+            run_checks(sim_values, fp_dict, id_list, idx_array, a, b, atol)
+        return sim_values
+
+    i = 0
+    for a, b, ltm_indices in iter_group_ltm_indices(idx_array, chunk_size):
+        chunk_values = dequantize_sim_values(sim_matrix[ltm_indices])
+        sim_values[i : i + len(chunk_values)] = chunk_values
+        i += len(chunk_values)
+        if validate:
+            run_checks(chunk_values, fp_dict, id_list, idx_array, a, b, atol)
     return sim_values
 
 
 def gather_and_save_cluster_sim_values(
-    l2c_df: pl.DataFrame,
+    membership: csr_array,
+    cluster_ids: np.ndarray,
     sim_matrix: np.ndarray,
-    id2idx_map: dict,
+    id_list: list[int],
     save_path: str,
     validate: bool = False,
     fp_dict: dict = None,
-    group_col: str = "cluster",
-    id_col: str = "molregno",
-) -> None:
-    cluster2simvalues = {}
-    for cluster_tup, cluster_df in l2c_df.group_by(group_col):
-        cluster_ligand_ids = cluster_df[id_col].unique().to_list()
-        sim_values = get_similarity_values(
-            cluster_ligand_ids, sim_matrix, id2idx_map, validate, fp_dict
+    chunk_size: int = None,
+) -> int:
+    # returns the number of pairs gathered
+    cluster_members = get_group_members(membership)
+    # values of each cluster are written straight to a (memory-mapped) ragged array
+    cluster2simvalues = create_group_values(
+        save_path,
+        cluster_ids,
+        [comb(len(idx_array), 2) for idx_array in cluster_members],
+    )
+    for cluster_id, idx_array in zip(cluster_ids, cluster_members):
+        get_similarity_values(
+            idx_array,
+            sim_matrix,
+            id_list,
+            validate,
+            fp_dict,
+            chunk_size,
+            out=cluster2simvalues[cluster_id],
         )
-        cluster_id = cluster_tup[0]  # polars quirk
-        cluster2simvalues[cluster_id] = sim_values
-    save_to_pkl(cluster2simvalues, save_path)
+    cluster2simvalues.flush()
+    return len(cluster2simvalues.flat_values)
 
 
 def main():
     args = parse_args()
-    id_list = load_from_pkl(args.similarity_id_pkl_file)
-    N = len(id_list)
-    id2idx_map = get_id2idx_map(id_list)
-    sim_matrix = np.load(args.similarity_npy_file)
-    check_size(sim_matrix, N)
-
-    # check if we do extra validation
-    fp_dict = {}
-    validate = False
-    if args.fingerprints_pkl_file is not None:
-        fp_dict = load_from_pkl(args.fingerprints_pkl_file)
-        validate = True
-
-    # gather compounds in each cluster and their similarities
-    # then save result to pkl file
-    for cl in range(args.min_class_level, args.max_class_level + 1):
-        l2c_path = get_ligand2cluster_fpath(args.cluster_dir, cl)
-        l2c_df = pl.read_csv(l2c_path, separator="\t", columns=["molregno", "cluster"])
-        save_path = get_cluster2sim_fpath(args.cluster2sim_dir, cl)
-        gather_and_save_cluster_sim_values(
-            l2c_df, sim_matrix, id2idx_map, save_path, validate, fp_dict
-        )
+    with StageProfiler(
+        "gather_similarity_values", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        with profiler.phase("load_matrix"):
+            id_list = load_from_pkl(args.similarity_id_pkl_file)
+            N = len(id_list)
+            sim_matrix = load_sim_matrix(args.similarity_npy_file)
+            check_size(sim_matrix, N)
 
-    # save per tid sim values (if requested)
-    if args.ligand2tid_tsv_file is not None:
-        ligand2tid_df = pl.read_csv(
-            args.ligand2tid_tsv_file, separator="\t", columns=["molregno", "tid"]
-        )
-        save_path = get_tid2sim_fpath(args.cluster2sim_dir)
-        gather_and_save_cluster_sim_values(
-            ligand2tid_df,
-            sim_matrix,
-            id2idx_map,
-            save_path,
-            validate,
-            fp_dict,
-            group_col="tid",
-        )
+        # check if we do extra validation
+        fp_dict = {}
+        validate = False
+        with profiler.phase("load_fingerprints"):
+            if args.fingerprints_pkl_file is not None:
+                fp_dict = load_from_pkl(args.fingerprints_pkl_file)
+                validate = True
+            elif args.fingerprints_npy_file is not None:
+                fp_dict = packed_fps_to_dict(
+                    *load_packed_fps(
+                        args.fingerprints_npy_file, args.fingerprint_ids_npy_file
+                    )
+                )
+                validate = True
 
-    if args.activities_tsv_file is not None:
-        assay2tid_df = pl.read_csv(
-            args.activities_tsv_file, separator="\t", columns=["molregno", "assay_id"]
-        )
-        save_path = get_assay2sim_fpath(args.cluster2sim_dir)
-        gather_and_save_cluster_sim_values(
-            assay2tid_df,
-            sim_matrix,
-            id2idx_map,
-            save_path,
-            validate,
-            fp_dict,
-            group_col="assay_id",
-        )
+        # gather compounds in each cluster and their similarities
+        # then save result as ragged array
+        # per tid / assay sim values (if requested)
+        for grouping, _, _ in get_groupings(args):
+            save_path = get_group_values_fpath(args.cluster2sim_dir, grouping)
+            with profiler.phase(grouping, unit="pairs"):
+                with profiler.phase("load_membership"):
+                    membership, cluster_ids = load_membership(
+                        get_membership_fpath(args.cluster_dir, grouping), id_list
+                    )
+                n_pairs = gather_and_save_cluster_sim_values(
+                    membership,
+                    cluster_ids,
+                    sim_matrix,
+                    id_list,
+                    save_path,
+                    validate,
+                    fp_dict,
+                    chunk_size=args.chunk_size,
+                )
+                profiler.add_items(n_pairs)
 
 
 if __name__ == "__main__":
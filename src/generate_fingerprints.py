@@ -6,13 +6,34 @@ input file containing mol SMILES.
 """
 
 import argparse
+from multiprocessing import Pool
 
 import numpy as np
 import polars as pl
 from rdkit import Chem
 from rdkit.Chem import DataStructs, rdFingerprintGenerator
 
+from utils.args import add_profiling_args
+from utils.fingerprints import (
+    fps_to_packed_array,
+    get_n_words,
+    packed_array_to_fps,
+    save_packed_fps,
+)
+from utils.fp_cache import (
+    add_to_cache,
+    evict_from_cache,
+    get_cache_subdir,
+    lookup_cached_fps,
+    smiles_to_keys,
+)
 from utils.io import save_to_pkl
+from utils.profiling import StageProfiler
+from utils.tables import read_table
+
+# Morgan fingerprint settings
+RADIUS = 2
+FP_SIZE = 2048
 
 
 def parse_args():
@@ -25,20 +46,73 @@ def parse_args():
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing compound ID and SMILES",
+        help="Input TSV/Parquet file containing compound ID and SMILES",
     )
     parser.add_argument(
         "--fingerprints_pkl_file",
         type=str,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Output Pickle file containing compound ID mapped to fingerprint",
+        required=False,
+        default=None,
+        help="(Optional) Output Pickle file containing compound ID mapped to fingerprint",
+    )
+    parser.add_argument(
+        "--fingerprints_npy_file",
+        type=str,
+        required=False,
+        default=None,
+        help="(Optional) Output .npy file containing packed fingerprints (N, n_bits/64) uint64 array, sorted by compound ID. Must be given with --fingerprint_ids_npy_file",
+    )
+    parser.add_argument(
+        "--fingerprint_ids_npy_file",
+        type=str,
+        required=False,
+        default=None,
+        help="(Optional) Output .npy file containing sorted compound IDs (in order used by fingerprints_npy_file)",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to generate fingerprints (default: %(default)s)",
     )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=10_000,
+        help="Number of SMILES processed per chunk (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--skip_invalid",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Drop compounds with invalid SMILES (these are always reported) instead of raising an error",
+    )
+    parser.add_argument(
+        "--fp_cache_dir",
+        type=str,
+        default=None,
+        help="(Optional) Directory of persistent fingerprint cache (keyed by canonical SMILES + generator settings), shared between runs",
+    )
+    parser.add_argument(
+        "--fp_cache_max_mb",
+        type=float,
+        default=None,
+        help="(Optional) Maximum size of fingerprint cache in MB, least-recently-used entries are evicted beyond this",
+    )
+    add_profiling_args(parser)
     args = parser.parse_args()
+    assert (args.fingerprints_npy_file is None) == (
+        args.fingerprint_ids_npy_file is None
+    ), "--fingerprints_npy_file and --fingerprint_ids_npy_file must be given together"
+    assert (
+        args.fingerprints_pkl_file is not None or args.fingerprints_npy_file is not None
+    ), "No output file given, provide --fingerprints_pkl_file and/or --fingerprints_npy_file"
     return args
 
 
 def smiles_to_fp(smiles: str, fp_gen) -> np.ndarray:
+    if smiles is None:
+        return None
     mol = Chem.MolFromSmiles(smiles)
     if mol is None:
         return None
@@ -46,20 +120,167 @@ def smiles_to_fp(smiles: str, fp_gen) -> np.ndarray:
     return fp
 
 
+# set once per process by init_worker (generators can't be sent between processes)
+_worker_state = {}
+
+
+def init_worker(radius: int, fp_size: int) -> None:
+    _worker_state["fp_size"] = fp_size
+    _worker_state["fp_gen"] = rdFingerprintGenerator.GetMorganGenerator(
+        radius=radius, fpSize=fp_size
+    )
+
+
+def fingerprint_chunk(smiles_list: list[str]) -> tuple[np.ndarray, list[int]]:
+    """
+    Generate packed fingerprints for a chunk of SMILES.
+
+    :param list[str] smiles_list: SMILES of chunk
+    :return tuple[np.ndarray, list[int]]: packed fingerprints (empty fingerprint for invalid SMILES)
+        and positions of invalid SMILES within the chunk
+    """
+    fps, invalid_positions = [], []
+    for i, smiles in enumerate(smiles_list):
+        fp = smiles_to_fp(smiles, _worker_state["fp_gen"])
+        if fp is None:
+            invalid_positions.append(i)
+            fp = DataStructs.ExplicitBitVect(_worker_state["fp_size"])
+        fps.append(fp)
+    return fps_to_packed_array(fps), invalid_positions
+
+
+def generate_packed_fps(
+    smiles: list[str],
+    chunk_size: int,
+    n_jobs: int = 1,
+    radius: int = 2,
+    fp_size: int = 2048,
+) -> tuple[np.ndarray, list[int]]:
+    """
+    Generate packed fingerprints of all SMILES, split into chunks processed by n_jobs processes.
+    Output is in the same order as the given SMILES.
+
+    :return tuple[np.ndarray, list[int]]: packed fingerprints and indices of invalid SMILES
+    """
+    chunks = [smiles[i : i + chunk_size] for i in range(0, len(smiles), chunk_size)]
+    if n_jobs > 1:
+        with Pool(n_jobs, initializer=init_worker, initargs=(radius, fp_size)) as pool:
+            results = pool.map(fingerprint_chunk, chunks)
+    else:
+        init_worker(radius, fp_size)
+        results = map(fingerprint_chunk, chunks)
+
+    packed_chunks, invalid_indices = [], []
+    for chunk_i, (packed, invalid_positions) in enumerate(results):
+        chunk_offset = chunk_i * chunk_size
+        if len(invalid_positions) > 0:
+            invalid_smiles = [chunks[chunk_i][i] for i in invalid_positions]
+            print(
+                f"Chunk {chunk_i}: {len(invalid_positions)} invalid SMILES: {invalid_smiles}"
+            )
+        packed_chunks.append(packed)
+        invalid_indices += [chunk_offset + i for i in invalid_positions]
+    packed = (
+        np.concatenate(packed_chunks)
+        if len(packed_chunks) > 0
+        else np.zeros((0, get_n_words(fp_size)), dtype="<u8")
+    )
+    return packed, invalid_indices
+
+
+def generate_packed_fps_with_cache(
+    smiles: list[str],
+    cache_dir: str,
+    cache_max_mb: float,
+    chunk_size: int,
+    n_jobs: int = 1,
+    radius: int = 2,
+    fp_size: int = 2048,
+) -> tuple[np.ndarray, list[int]]:
+    """
+    Same as generate_packed_fps, but fingerprints found in the cache are reused.
+    Only the misses are computed, these are then added to the cache.
+    """
+    cache_subdir = get_cache_subdir(cache_dir, radius, fp_size)
+    is_null = np.array([s is None for s in smiles], dtype=bool)
+    keys = smiles_to_keys(["" if s is None else s for s in smiles])
+    packed, found = lookup_cached_fps(cache_subdir, keys, fp_size)
+    found &= ~is_null
+    miss_indices = np.flatnonzero(~found)
+    print(f"Fingerprint cache: {found.sum()} hits, {len(miss_indices)} misses")
+
+    miss_packed, miss_invalid = generate_packed_fps(
+        [smiles[i] for i in miss_indices], chunk_size, n_jobs, radius, fp_size
+    )
+    packed[miss_indices] = miss_packed
+    # only cache valid fingerprints
+    is_valid_miss = np.ones(len(miss_indices), dtype=bool)
+    is_valid_miss[miss_invalid] = False
+    add_to_cache(
+        cache_subdir, keys[miss_indices[is_valid_miss]], miss_packed[is_valid_miss]
+    )
+    if cache_max_mb is not None:
+        n_removed = evict_from_cache(cache_subdir, cache_max_mb)
+        print(f"Fingerprint cache: evicted {n_removed} shard(s)")
+    invalid_indices = miss_indices[miss_invalid].tolist()
+    return packed, invalid_indices
+
+
 def main():
     args = parse_args()
-    df = pl.read_csv(args.compound_structures_tsv_file, separator="\t")
-    mfpgen = rdFingerprintGenerator.GetMorganGenerator(radius=2, fpSize=2048)
-    df = df.with_columns(
-        pl.col("canonical_smiles")
-        .map_elements(lambda x: smiles_to_fp(x, mfpgen))
-        .alias("fingerprint")
-    )
-    assert not (
-        df["fingerprint"].is_null().any()
-    ), "Null fingerprint was generated, check input TSV file and ensure all SMILEs are valid"
-    fp_dict = dict(zip(df["molregno"], df["fingerprint"]))
-    save_to_pkl(fp_dict, args.fingerprints_pkl_file)
+    with StageProfiler(
+        "generate_fingerprints", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        with profiler.phase("load_structures"):
+            df = read_table(
+                args.compound_structures_tsv_file,
+                columns=["molregno", "canonical_smiles"],
+            )
+        with profiler.phase("generate", unit="molecules"):
+            smiles = df["canonical_smiles"].to_list()
+            if args.fp_cache_dir is not None:
+                packed, invalid_indices = generate_packed_fps_with_cache(
+                    smiles,
+                    args.fp_cache_dir,
+                    args.fp_cache_max_mb,
+                    args.chunk_size,
+                    args.n_jobs,
+                    RADIUS,
+                    FP_SIZE,
+                )
+            else:
+                packed, invalid_indices = generate_packed_fps(
+                    smiles,
+                    args.chunk_size,
+                    args.n_jobs,
+                    RADIUS,
+                    FP_SIZE,
+                )
+            profiler.add_items(len(smiles))
+        if len(invalid_indices) > 0:
+            invalid_df = df[invalid_indices]
+            print(f"Invalid SMILES:\n{invalid_df[['molregno', 'canonical_smiles']]}")
+            assert (
+                args.skip_invalid
+            ), f"{len(invalid_indices)} invalid SMILES found, check input TSV file and ensure all SMILEs are valid (or use --skip_invalid)"
+            is_valid = np.ones(len(df), dtype=bool)
+            is_valid[invalid_indices] = False
+            df = df.filter(pl.Series(is_valid))
+            packed = packed[is_valid]
+
+        with profiler.phase("save"):
+            if args.fingerprints_pkl_file is not None:
+                fp_dict = dict(
+                    zip(df["molregno"], packed_array_to_fps(packed, FP_SIZE))
+                )
+                save_to_pkl(fp_dict, args.fingerprints_pkl_file)
+            if args.fingerprints_npy_file is not None:
+                save_packed_fps(
+                    args.fingerprints_npy_file,
+                    args.fingerprint_ids_npy_file,
+                    df["molregno"].to_numpy(),
+                    packed,
+                )
 
 
 if __name__ == "__main__":
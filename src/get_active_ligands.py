@@ -7,15 +7,23 @@ meet the given criteria for being "active".
 """
 
 import argparse
+from functools import partial
 from typing import Optional
 
-import polars as pl
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import DictCursor
 
-from utils.args import add_chembl_db_args
-from utils.io import write_to_tsv
+from utils.args import (
+    add_batch_size_arg,
+    add_chembl_db_args,
+    add_profiling_args,
+    add_query_cache_args,
+)
+from utils.db import get_int_array_literal
+from utils.profiling import StageProfiler
+from utils.query_cache import cached_query_to_file
+from utils.tables import read_table
 
 
 def parse_args():
@@ -24,19 +32,21 @@ def parse_args():
         epilog="",
     )
     add_chembl_db_args(parser)
+    add_batch_size_arg(parser)
+    add_query_cache_args(parser)
     parser.add_argument(
         "--assay_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing TID and assay_id",
+        help="Input TSV/Parquet file containing TID and assay_id",
     )
     parser.add_argument(
         "--activities_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Output TSV file containing active compound information",
+        help="Output TSV/Parquet file containing active compound information",
     )
     parser.add_argument(
         "--pchembl_min_value",
@@ -62,18 +72,24 @@ def parse_args():
         default=None,
         help="(Optional) One or more alert_set_ids to filter on (comma-separated)",
     )
+    parser.add_argument(
+        "--query_cache_pchembl_min_value",
+        type=float,
+        default=None,
+        help="(Optional) On a query cache miss, fetch and cache activities with pchembl_value >= this (lower) value instead, so that later runs with any pchembl_min_value above it are served from the cache",
+    )
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
-def get_active_mol_info(
-    cursor: DictCursor,
+def get_active_mol_info_query(
     assay_ids: list[int],
     pchembl_min_value: int,
     min_mw: float,
     max_mw: float,
     structural_alert_set_ids: Optional[list[int]] = None,
-) -> list[list]:
+) -> sql.Composed:
     query = sql.SQL(
         """
         SELECT md.molregno,md.chembl_id,a.assay_id,a.standard_type,a.pchembl_value
@@ -82,7 +98,7 @@ def get_active_mol_info(
         JOIN compound_properties cp ON a.molregno = cp.molregno
         JOIN compound_structural_alerts csa ON a.molregno = csa.molregno
         JOIN structural_alerts sa ON csa.alert_id = sa.alert_id
-        WHERE a.assay_id IN {assay_ids}
+        WHERE a.assay_id = ANY({assay_ids})
         AND a.pchembl_value >= {pchembl_min_value}
         AND a.relation = '='
         AND a.standard_flag = 1
@@ -91,49 +107,62 @@ def get_active_mol_info(
         AND (a.potential_duplicate = 0)
         AND (cp.full_mwt >= {min_mw})
         AND (cp.full_mwt <= {max_mw})
-        AND (sa.alert_set_id NOT IN {structural_alert_set_ids});
+        AND NOT (sa.alert_set_id = ANY({structural_alert_set_ids}));
         """
     ).format(
-        assay_ids=sql.Literal(tuple(assay_ids)),
+        assay_ids=get_int_array_literal(assay_ids),
         pchembl_min_value=sql.Literal(pchembl_min_value),
         min_mw=sql.Literal(min_mw),
         max_mw=sql.Literal(max_mw),
-        structural_alert_set_ids=sql.Literal(tuple(structural_alert_set_ids)),
+        structural_alert_set_ids=get_int_array_literal(
+            structural_alert_set_ids if structural_alert_set_ids is not None else []
+        ),
     )
-    cursor.execute(query)
-    result = cursor.fetchall()
-    return result
+    return query
 
 
 def main():
     args = parse_args()
-    connection = psycopg2.connect(
-        dbname=args.db_name,
-        host=args.db_host,
-        user=args.db_user,
-        password=args.db_password,
-        port=args.db_port,
-        cursor_factory=DictCursor,
-    )
-    connection.set_session(readonly=True)
-    cursor = connection.cursor()
+    with StageProfiler(
+        "get_active_ligands", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        connection = psycopg2.connect(
+            dbname=args.db_name,
+            host=args.db_host,
+            user=args.db_user,
+            password=args.db_password,
+            port=args.db_port,
+            cursor_factory=DictCursor,
+        )
+        connection.set_session(readonly=True)
 
-    df = pl.read_csv(args.assay_tsv_file, separator="\t")
-    assay_ids = list(df["assay_id"])
-    mol_info = get_active_mol_info(
-        cursor,
-        assay_ids,
-        args.pchembl_min_value,
-        args.min_mw,
-        args.max_mw,
-        args.structural_alert_set_ids,
-    )
-    header = ["molregno", "chembl_id", "assay_id", "standard_type", "pchembl_value"]
-    write_to_tsv(args.activities_tsv_file, mol_info, header)
+        df = read_table(args.assay_tsv_file, columns=["assay_id"])
+        assay_ids = list(df["assay_id"])
+        # query as a function of pchembl_min_value (allows serving it from a cached superset)
+        get_query = partial(
+            get_active_mol_info_query,
+            assay_ids,
+            min_mw=args.min_mw,
+            max_mw=args.max_mw,
+            structural_alert_set_ids=args.structural_alert_set_ids,
+        )
+        header = ["molregno", "chembl_id", "assay_id", "standard_type", "pchembl_value"]
+        with profiler.phase("query", unit="rows"):
+            n_rows = cached_query_to_file(
+                connection,
+                get_query(args.pchembl_min_value),
+                args.activities_tsv_file,
+                header,
+                args.query_cache_dir,
+                args.batch_size,
+                args.query_cache_max_mb,
+                min_filter=(get_query, "pchembl_value", args.pchembl_min_value),
+                superset_min_value=args.query_cache_pchembl_min_value,
+            )
+            profiler.add_items(n_rows)
 
-    # Close connections
-    cursor.close()
-    connection.close()
+        # Close connection
+        connection.close()
 
 
 if __name__ == "__main__":
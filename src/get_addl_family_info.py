@@ -10,13 +10,14 @@ separate allows for greater flexibility in future (if need be).
 
 import argparse
 
-import polars as pl
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import DictCursor
 
-from utils.args import add_chembl_db_args
-from utils.io import write_to_tsv
+from utils.args import add_chembl_db_args, add_profiling_args
+from utils.db import get_int_array_literal
+from utils.profiling import StageProfiler
+from utils.tables import read_table, write_rows
 
 
 def parse_args():
@@ -30,15 +31,16 @@ def parse_args():
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing family relationship information from protein_classification table",
+        help="Input TSV/Parquet file containing family relationship information from protein_classification table",
     )
     parser.add_argument(
         "--family_details_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Output TSV file containing protein_class_id and additional information (pref_name, short_name, class_level)",
+        help="Output TSV/Parquet file containing protein_class_id and additional information (pref_name, short_name, class_level)",
     )
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
@@ -48,9 +50,9 @@ def get_addl_info(cursor: DictCursor, protein_class_ids: list[int]):
         """
         SELECT protein_class_id,parent_id,pref_name,short_name,class_level
         FROM protein_classification
-        WHERE protein_class_id IN {protein_class_ids};
+        WHERE protein_class_id = ANY({protein_class_ids});
         """
-    ).format(protein_class_ids=sql.Literal(tuple(protein_class_ids)))
+    ).format(protein_class_ids=get_int_array_literal(protein_class_ids))
 
     cursor.execute(query)
     result = cursor.fetchall()
@@ -59,29 +61,40 @@ def get_addl_info(cursor: DictCursor, protein_class_ids: list[int]):
 
 def main():
     args = parse_args()
-    connection = psycopg2.connect(
-        dbname=args.db_name,
-        host=args.db_host,
-        user=args.db_user,
-        password=args.db_password,
-        port=args.db_port,
-        cursor_factory=DictCursor,
-    )
-    connection.set_session(readonly=True)
-    cursor = connection.cursor()
+    with StageProfiler(
+        "get_addl_family_info", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        connection = psycopg2.connect(
+            dbname=args.db_name,
+            host=args.db_host,
+            user=args.db_user,
+            password=args.db_password,
+            port=args.db_port,
+            cursor_factory=DictCursor,
+        )
+        connection.set_session(readonly=True)
+        cursor = connection.cursor()
 
-    df = pl.read_csv(args.family_tsv_file, separator="\t")
-    protein_class_ids = list(df["protein_class_id"])
-    family_details = get_addl_info(cursor, protein_class_ids)
-    write_to_tsv(
-        args.family_details_tsv_file,
-        family_details,
-        ["protein_class_id", "parent_id", "pref_name", "short_name", "class_level"],
-    )
+        with profiler.phase("query", unit="rows"):
+            df = read_table(args.family_tsv_file, columns=["protein_class_id"])
+            protein_class_ids = list(df["protein_class_id"])
+            family_details = get_addl_info(cursor, protein_class_ids)
+            write_rows(
+                args.family_details_tsv_file,
+                family_details,
+                [
+                    "protein_class_id",
+                    "parent_id",
+                    "pref_name",
+                    "short_name",
+                    "class_level",
+                ],
+            )
+            profiler.add_items(len(family_details))
 
-    # Close connections
-    cursor.close()
-    connection.close()
+        # Close connections
+        cursor.close()
+        connection.close()
 
 
 if __name__ == "__main__":
@@ -8,13 +8,20 @@ and save to a TSV file.
 
 import argparse
 
-import polars as pl
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import DictCursor
 
-from utils.args import add_chembl_db_args
-from utils.io import write_to_tsv
+from utils.args import (
+    add_batch_size_arg,
+    add_chembl_db_args,
+    add_profiling_args,
+    add_query_cache_args,
+)
+from utils.db import get_int_array_literal
+from utils.profiling import StageProfiler
+from utils.query_cache import cached_query_to_file
+from utils.tables import read_table
 
 
 def parse_args():
@@ -23,68 +30,74 @@ def parse_args():
         epilog="",
     )
     add_chembl_db_args(parser)
+    add_batch_size_arg(parser)
+    add_query_cache_args(parser)
     parser.add_argument(
         "--activities_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing active compound information",
+        help="Input TSV/Parquet file containing active compound information",
     )
     parser.add_argument(
         "--compound_structures_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Output TSV file containing compound ID, Inchi, and SMILES",
+        help="Output TSV/Parquet file containing compound ID, Inchi, and SMILES",
     )
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
-def get_compound_structures(
-    cursor: DictCursor,
-    molregno_list: list[int],
-) -> list[list]:
+def get_compound_structures_query(molregno_list: list[int]) -> sql.Composed:
     query = sql.SQL(
         """
         SELECT cs.molregno, md.chembl_id, cs.standard_inchi, cs.canonical_smiles
         FROM compound_structures cs
         JOIN molecule_dictionary md on cs.molregno = md.molregno
-        WHERE (cs.molregno in {molregno_list});
+        WHERE cs.molregno = ANY({molregno_list});
         """
     ).format(
-        molregno_list=sql.Literal(tuple(molregno_list)),
+        molregno_list=get_int_array_literal(molregno_list),
     )
-    cursor.execute(query)
-    result = cursor.fetchall()
-    return result
+    return query
 
 
 def main():
     args = parse_args()
-    connection = psycopg2.connect(
-        dbname=args.db_name,
-        host=args.db_host,
-        user=args.db_user,
-        password=args.db_password,
-        port=args.db_port,
-        cursor_factory=DictCursor,
-    )
-    connection.set_session(readonly=True)
-    cursor = connection.cursor()
+    with StageProfiler(
+        "get_ligand_structures", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        connection = psycopg2.connect(
+            dbname=args.db_name,
+            host=args.db_host,
+            user=args.db_user,
+            password=args.db_password,
+            port=args.db_port,
+            cursor_factory=DictCursor,
+        )
+        connection.set_session(readonly=True)
 
-    df = pl.read_csv(args.activities_tsv_file, separator="\t")
-    molregno_list = list(set(df["molregno"]))
-    structure_info = get_compound_structures(
-        cursor,
-        molregno_list,
-    )
-    header = ["molregno", "chembl_id", "standard_inchi", "canonical_smiles"]
-    write_to_tsv(args.compound_structures_tsv_file, structure_info, header)
+        df = read_table(args.activities_tsv_file, columns=["molregno"])
+        molregno_list = list(set(df["molregno"]))
+        query = get_compound_structures_query(molregno_list)
+        header = ["molregno", "chembl_id", "standard_inchi", "canonical_smiles"]
+        with profiler.phase("query", unit="rows"):
+            n_rows = cached_query_to_file(
+                connection,
+                query,
+                args.compound_structures_tsv_file,
+                header,
+                args.query_cache_dir,
+                args.batch_size,
+                args.query_cache_max_mb,
+            )
+            profiler.add_items(n_rows)
 
-    # Close connections
-    cursor.close()
-    connection.close()
+        # Close connection
+        connection.close()
 
 
 if __name__ == "__main__":
@@ -13,8 +13,9 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import DictCursor
 
-from utils.args import add_chembl_db_args
-from utils.io import write_to_tsv
+from utils.args import add_chembl_db_args, add_profiling_args
+from utils.profiling import StageProfiler
+from utils.tables import write_rows
 
 
 def get_protein_class_relations(
@@ -90,14 +91,14 @@ def parse_args():
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Output TSV file containing TID and protein_class_id for each protein",
+        help="Output TSV/Parquet file containing TID and protein_class_id for each protein",
     )
     parser.add_argument(
         "--family_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Output TSV file containing family relationship information from protein_classification table",
+        help="Output TSV/Parquet file containing family relationship information from protein_classification table",
     )
     parser.add_argument(
         "--organism",
@@ -113,45 +114,56 @@ def parse_args():
         default=None,
         help="(Optional) If given, will only select proteins of the given type. Make sure this arg matches the 'target_type' column in the 'target_dictionary' table.",
     )
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
 def main():
     args = parse_args()
-    connection = psycopg2.connect(
-        dbname=args.db_name,
-        host=args.db_host,
-        user=args.db_user,
-        password=args.db_password,
-        port=args.db_port,
-        cursor_factory=DictCursor,
-    )
-    connection.set_session(readonly=True)
-    cursor = connection.cursor()
-
-    # Get class and all subclasses
-    protein_class_relations = get_protein_class_relations(cursor, args.protein_class_id)
-    protein_class_ids = [x[0] for x in protein_class_relations]
-
-    # Get components of selected classes
-    target_info = get_target_info(
-        cursor, protein_class_ids, args.organism, args.target_type
-    )
-
-    # Write outputs
-    write_to_tsv(
-        args.family_tsv_file, protein_class_relations, ["protein_class_id", "parent_id"]
-    )
-    write_to_tsv(
-        args.target_tsv_file,
-        target_info,
-        ["tid", "protein_class_id", "component_id", "accession"],
-    )
-
-    # Close connections
-    cursor.close()
-    connection.close()
+    with StageProfiler(
+        "get_protein_targets", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        connection = psycopg2.connect(
+            dbname=args.db_name,
+            host=args.db_host,
+            user=args.db_user,
+            password=args.db_password,
+            port=args.db_port,
+            cursor_factory=DictCursor,
+        )
+        connection.set_session(readonly=True)
+        cursor = connection.cursor()
+
+        with profiler.phase("query", unit="rows"):
+            # Get class and all subclasses
+            protein_class_relations = get_protein_class_relations(
+                cursor, args.protein_class_id
+            )
+            protein_class_ids = [x[0] for x in protein_class_relations]
+
+            # Get components of selected classes
+            target_info = get_target_info(
+                cursor, protein_class_ids, args.organism, args.target_type
+            )
+            profiler.add_items(len(target_info))
+
+        # Write outputs
+        with profiler.phase("save"):
+            write_rows(
+                args.family_tsv_file,
+                protein_class_relations,
+                ["protein_class_id", "parent_id"],
+            )
+            write_rows(
+                args.target_tsv_file,
+                target_info,
+                ["tid", "protein_class_id", "component_id", "accession"],
+            )
+
+        # Close connections
+        cursor.close()
+        connection.close()
 
 
 if __name__ == "__main__":
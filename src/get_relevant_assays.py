@@ -9,13 +9,20 @@ all assays exploring activity of the given targets.
 import argparse
 from typing import Optional
 
-import polars as pl
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import DictCursor
 
-from utils.args import add_chembl_db_args
-from utils.io import write_to_tsv
+from utils.args import (
+    add_batch_size_arg,
+    add_chembl_db_args,
+    add_profiling_args,
+    add_query_cache_args,
+)
+from utils.db import get_int_array_literal
+from utils.profiling import StageProfiler
+from utils.query_cache import cached_query_to_file
+from utils.tables import read_table
 
 
 def parse_args():
@@ -24,19 +31,21 @@ def parse_args():
         epilog="",
     )
     add_chembl_db_args(parser)
+    add_batch_size_arg(parser)
+    add_query_cache_args(parser)
     parser.add_argument(
         "--target_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing TID and protein_class_id for each protein",
+        help="Input TSV/Parquet file containing TID and protein_class_id for each protein",
     )
     parser.add_argument(
         "--assay_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Output TSV file containing TID and assay_id",
+        help="Output TSV/Parquet file containing TID and assay_id",
     )
     parser.add_argument(
         "--assay_type",
@@ -64,70 +73,77 @@ def parse_args():
         action=argparse.BooleanOptionalAction,
         help="Exclude assays which target a variant. Based on criteria described by: https://pubs.acs.org/doi/10.1021/acs.jcim.4c00049",
     )
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
-def get_assays(
-    cursor: DictCursor,
+def get_assays_query(
     tids: list[int],
     assay_type: Optional[str] = None,
     confidence_score: Optional[int] = None,
     doc_type: Optional[str] = None,
     exclude_variants: bool = False,
-) -> list[list]:
+) -> sql.Composed:
     query = sql.SQL(
         """
         SELECT assay_id, tid
         FROM assays ass
         JOIN docs d ON ass.doc_id = d.doc_id
-        WHERE tid IN {tids}
+        WHERE tid = ANY({tids})
         AND ({assay_type} IS NULL OR assay_type = {assay_type})
         AND ({confidence_score} IS NULL OR confidence_score = {confidence_score})
         AND ({doc_type} IS NULL OR d.doc_type = {doc_type})
         AND (NOT {exclude_variants} OR (variant_id is NULL AND NOT(LOWER(description) LIKE '%mutant%' OR LOWER(description) LIKE '%mutation%' OR LOWER(description) LIKE '%variant%')));
         """
     ).format(
-        tids=sql.Literal(tuple(tids)),
+        tids=get_int_array_literal(tids),
         assay_type=sql.Literal(assay_type),
         confidence_score=sql.Literal(confidence_score),
         doc_type=sql.Literal(doc_type),
         exclude_variants=sql.Literal(exclude_variants),
     )
-
-    cursor.execute(query)
-    result = cursor.fetchall()
-    return result
+    return query
 
 
 def main():
     args = parse_args()
-    connection = psycopg2.connect(
-        dbname=args.db_name,
-        host=args.db_host,
-        user=args.db_user,
-        password=args.db_password,
-        port=args.db_port,
-        cursor_factory=DictCursor,
-    )
-    connection.set_session(readonly=True)
-    cursor = connection.cursor()
+    with StageProfiler(
+        "get_relevant_assays", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        connection = psycopg2.connect(
+            dbname=args.db_name,
+            host=args.db_host,
+            user=args.db_user,
+            password=args.db_password,
+            port=args.db_port,
+            cursor_factory=DictCursor,
+        )
+        connection.set_session(readonly=True)
 
-    target_df = pl.read_csv(args.target_tsv_file, separator="\t")
-    tids = list(set(target_df["tid"]))
-    assays = get_assays(
-        cursor,
-        tids,
-        args.assay_type,
-        args.confidence_score,
-        args.doc_type,
-        args.exclude_variants,
-    )
-    write_to_tsv(args.assay_tsv_file, assays, ["assay_id", "tid"])
+        target_df = read_table(args.target_tsv_file, columns=["tid"])
+        tids = list(set(target_df["tid"]))
+        query = get_assays_query(
+            tids,
+            args.assay_type,
+            args.confidence_score,
+            args.doc_type,
+            args.exclude_variants,
+        )
+        with profiler.phase("query", unit="rows"):
+            n_rows = cached_query_to_file(
+                connection,
+                query,
+                args.assay_tsv_file,
+                ["assay_id", "tid"],
+                args.query_cache_dir,
+                args.batch_size,
+                args.query_cache_max_mb,
+            )
+            profiler.add_items(n_rows)
 
-    # Close connections
-    cursor.close()
-    connection.close()
+        # Close connection
+        connection.close()
 
 
 if __name__ == "__main__":
@@ -7,18 +7,52 @@ to individual group distributions using the Mann-Whitney U-test.
 Note that I've written this script to deal with the distributions
 observed for Kinase data. For other protein families a different
 statistical test/approach may be more appropriate.
+The test is run for the clusters of each class_level in [min_class_level, max_class_level]
+(and optionally each target/assay) in one invocation, with the 'counts' method
+the value counts of the full LTM are only computed once for all of these.
+With --similarity_sample_dir the test is run on random samples of pairs
+(see sample_similarity_pairs.py) instead of all pairs.
 """
 
 import argparse
+import os
 from math import comb
 
 import numpy as np
 import polars as pl
 from scipy.stats import mannwhitneyu
 
-from utils.constants import get_cluster2sim_fpath, get_ligand2cluster_fpath
+from utils.args import (
+    add_grouping_args,
+    add_profiling_args,
+    add_table_format_arg,
+    get_groupings,
+)
+from utils.constants import (
+    get_group_sample_fpath,
+    get_group_values_fpath,
+    get_ligand2cluster_fpath,
+    get_membership_fpath,
+)
 from utils.io import load_from_pkl
-from utils.ltm import check_size, get_all_ltm_indices_from_idx, get_id2idx_map
+from utils.ltm import (
+    check_size,
+    dequantize_sim_values,
+    get_all_ltm_indices_from_idx,
+    get_ltm_indices_from_rows_cols,
+    load_sim_matrix,
+)
+from utils.membership import get_group_members, load_membership
+from utils.pair_sample import get_median_ci, load_global_sample
+from utils.profiling import StageProfiler
+from utils.ragged import RaggedGroupValues, load_group_values
+from utils.tables import read_table, write_table
+from utils.utest import (
+    get_counts_on_values,
+    get_median_from_counts,
+    get_value_counts,
+    mannwhitneyu_from_counts,
+)
 
 
 def parse_args():
@@ -26,13 +60,19 @@ def parse_args():
         description="Perform Mann-Whitney U-test comparing overall distribution of similarity values to subgroups/families",
         epilog="",
     )
-    parser.add_argument(
+    similarity_group = parser.add_mutually_exclusive_group(required=True)
+    similarity_group.add_argument(
         "--similarity_npy_file",
         type=str,
-        required=True,
-        default=argparse.SUPPRESS,
+        default=None,
         help="Output .npy file containing lower-triangular similarity matrix",
     )
+    similarity_group.add_argument(
+        "--similarity_sample_dir",
+        type=str,
+        default=None,
+        help="Output directory of sample_similarity_pairs.py. Can be given instead of similarity_npy_file, in which case the test is run on the sampled pairs (medians are reported with 95%% CIs)",
+    )
     parser.add_argument(
         "--cluster_dir",
         type=str,
@@ -43,146 +83,315 @@ def parse_args():
     parser.add_argument(
         "--cluster2sim_dir",
         type=str,
-        required=True,
-        help="Input directory where .pkl files containing similarity values gathered per class_level + cluster",
+        default=None,
+        help="Input directory where similarity values gathered per class_level + cluster were saved to by gather_similarity_values.py, not needed with --similarity_sample_dir",
     )
     parser.add_argument(
         "--similarity_id_pkl_file",
         type=str,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Output .pkl file containing compound IDs (in order used by similarity_npy_file)",
+        default=None,
+        help="Output .pkl file containing compound IDs (in order used by similarity_npy_file), not needed with --similarity_sample_dir",
     )
     parser.add_argument(
         "--family_details_tsv_file",
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing protein_class_id and additional information (pref_name, short_name, class_level)",
+        help="Input TSV/Parquet file containing protein_class_id and additional information (pref_name, short_name, class_level)",
     )
     parser.add_argument(
-        "--class_level",
-        type=int,
+        "--mann_whitney_utest_dir",
+        type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="The class_level to run the test on",
+        help="Output directory of the TSV/Parquet files containing results from running the mann-whitney u-test on each cluster (one file per class_level/grouping)",
     )
+    add_grouping_args(parser, "test")
     parser.add_argument(
-        "--mann_whitney_utest_tsv_file",
+        "--utest_method",
         type=str,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Output TSV file containing results from running the mann-whitney u-test on each cluster",
+        choices=["counts", "scipy"],
+        default="counts",
+        help="How to run the test. 'counts' computes U from exact counts of each distinct similarity value (the LTM is only scanned once), 'scipy' removes cluster values from a copy of the LTM and calls scipy.stats.mannwhitneyu for each cluster. Ignored with --similarity_sample_dir (default: %(default)s)",
     )
+    add_table_format_arg(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
-def sanity_checks(ligand_cluster_df: pl.DataFrame, cluster_dict: dict):
-    assert len(cluster_dict.keys()) == ligand_cluster_df["cluster"].n_unique()
-    for cluster_tup, cluster_df in ligand_cluster_df.group_by("cluster"):
-        cluster_id = cluster_tup[0]
+def sanity_checks(
+    cluster_ids: np.ndarray,
+    cluster_members: list[np.ndarray],
+    cluster_dict: RaggedGroupValues,
+):
+    assert len(cluster_dict.keys()) == len(cluster_ids)
+    for cluster_id, idx_array in zip(cluster_ids, cluster_members):
         dict_n_pairs = len(cluster_dict[cluster_id])
-        df_n_pairs = comb(cluster_df["molregno"].n_unique(), 2)
+        membership_n_pairs = comb(len(idx_array), 2)
         assert (
-            dict_n_pairs == df_n_pairs
-        ), f"Mismatch with cluster={cluster_id} ({dict_n_pairs} != {df_n_pairs})"
+            dict_n_pairs == membership_n_pairs
+        ), f"Mismatch with cluster={cluster_id} ({dict_n_pairs} != {membership_n_pairs})"
+
+
+def get_other_sim_values(
+    cluster_ligand_indices: list[int], N: int, sim_matrix: np.ndarray
+) -> np.ndarray:
+    # similarity values of all pairs not involving any ligand in the cluster (copy of LTM)
+    cluster_indices = []
+    for i in cluster_ligand_indices:
+        ligand_indices = get_all_ltm_indices_from_idx(i, N)
+        assert len(ligand_indices) == (
+            N - 1
+        ), f"Each ligand would have been compared against N-1 = {N-1} other ligands, but found len(ligand_indices)={len(ligand_indices)}"
+        cluster_indices += ligand_indices
+    return dequantize_sim_values(np.delete(sim_matrix, cluster_indices))
+
+
+def get_cross_pair_counts(
+    cluster_ligand_indices: list[int],
+    N: int,
+    sim_matrix: np.ndarray,
+    unique_values: np.ndarray,
+) -> np.ndarray:
+    """
+    Count the similarity values of all pairs with exactly one ligand in the cluster.
+    Together with the within-cluster pairs, these are the values excluded from the
+    'other' distribution.
+    """
+    in_cluster = np.zeros(N, dtype=bool)
+    in_cluster[cluster_ligand_indices] = True
+    other_indices = np.flatnonzero(~in_cluster)
+    counts = np.zeros(len(unique_values), dtype=np.int64)
+    for i in np.flatnonzero(in_cluster):
+        ltm_indices = get_ltm_indices_from_rows_cols(i, other_indices)
+        counts += get_counts_on_values(
+            dequantize_sim_values(sim_matrix[ltm_indices]), unique_values
+        )
+    return counts
+
+
+def get_sampled_other_sim_values(
+    cluster_ligand_indices: np.ndarray,
+    N: int,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    values: np.ndarray,
+) -> np.ndarray:
+    # similarity values of the globally sampled pairs not involving any ligand in the cluster
+    in_cluster = np.zeros(N, dtype=bool)
+    in_cluster[cluster_ligand_indices] = True
+    return values[~in_cluster[rows] & ~in_cluster[cols]]
+
+
+def get_cluster_names(
+    family_details_tsv_file: str, cluster_dir: str, class_level: int, table_format: str
+) -> pl.DataFrame:
+    # short_name of each cluster of the given class_level
+    family_info_df = read_table(
+        family_details_tsv_file,
+        columns=["protein_class_id", "short_name"],
+        predicate=pl.col("class_level") == class_level,
+    )
+    ligand_cluster_df = read_table(
+        get_ligand2cluster_fpath(cluster_dir, class_level, table_format),
+        columns=["protein_class_id", "cluster"],
+    )
+    ligand_cluster_df = ligand_cluster_df.join(family_info_df, on="protein_class_id")
+    return ligand_cluster_df[["cluster", "short_name"]].unique().sort(by="cluster")
 
 
 def main():
     args = parse_args()
-    id_list = load_from_pkl(args.similarity_id_pkl_file)
-    N = len(id_list)
-    id2idx_map = get_id2idx_map(id_list)
-    sim_matrix = np.load(args.similarity_npy_file)
-    check_size(sim_matrix, N)
+    with StageProfiler(
+        "mann_whitney_utest", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        sampled = args.similarity_sample_dir is not None
+        with profiler.phase("load_inputs"):
+            if sampled:
+                id_list, sample_rows, sample_cols, sample_values = load_global_sample(
+                    args.similarity_sample_dir
+                )
+                N = len(id_list)
+            else:
+                assert (
+                    args.similarity_id_pkl_file is not None
+                    and args.cluster2sim_dir is not None
+                ), "--similarity_id_pkl_file and --cluster2sim_dir must be given with --similarity_npy_file"
+                id_list = load_from_pkl(args.similarity_id_pkl_file)
+                N = len(id_list)
+                sim_matrix = load_sim_matrix(args.similarity_npy_file)
+                check_size(sim_matrix, N)
 
-    family_info_df = pl.read_csv(args.family_details_tsv_file, separator="\t")
+        if not sampled and args.utest_method == "counts":
+            # distinct values + counts of the full LTM, only computed once for all groupings
+            with profiler.phase("value_counts", unit="pairs"):
+                unique_values, all_counts = get_value_counts(sim_matrix)
+                unique_values = dequantize_sim_values(unique_values)
+                profiler.add_items(len(sim_matrix))
 
-    cluster_dict = load_from_pkl(
-        get_cluster2sim_fpath(args.cluster2sim_dir, args.class_level)
-    )
+        os.makedirs(args.mann_whitney_utest_dir, exist_ok=True)
+        for grouping, group_col, save_name in get_groupings(args):
+            with profiler.phase(grouping, unit="clusters"):
+                with profiler.phase("load_inputs"):
+                    if sampled:
+                        cluster_dict = load_group_values(
+                            get_group_sample_fpath(args.similarity_sample_dir, grouping)
+                        )
+                    else:
+                        cluster_dict = load_group_values(
+                            get_group_values_fpath(args.cluster2sim_dir, grouping)
+                        )
+                    membership, cluster_ids = load_membership(
+                        get_membership_fpath(args.cluster_dir, grouping), id_list
+                    )
+                    cluster_members = get_group_members(membership)
+                    if not sampled:
+                        # (sampled clusters have at most n_group_pairs pairs)
+                        sanity_checks(cluster_ids, cluster_members, cluster_dict)
+                    cluster2members = dict(zip(cluster_ids.tolist(), cluster_members))
 
-    ligand_cluster_df = pl.read_csv(
-        get_ligand2cluster_fpath(args.cluster_dir, args.class_level), separator="\t"
-    )
+                with profiler.phase("utests", unit="clusters"):
+                    cluster2result_dict = {
+                        "cluster": [],
+                        "cluster_size": [],
+                        "other_size": [],
+                        "cluster_median": [],
+                        "other_median": [],
+                        "U1": [],
+                        "U2": [],
+                        "p_val": [],
+                        "corrected_p_val": [],  # using a Bonferroni correction to avoid multiple comparisons problem
+                    }
+                    if sampled:
+                        for col in [
+                            "cluster_median_ci_low",
+                            "cluster_median_ci_high",
+                            "other_median_ci_low",
+                            "other_median_ci_high",
+                        ]:
+                            cluster2result_dict[col] = []
+                    n_clusters = len(cluster_dict)
+                    for cluster in cluster_dict:
+                        cluster_sim_values = cluster_dict[cluster]
+                        # need to remove similarity values computed wrt to all ligands belonging to this cluster for test to be valid
+                        # note we can't just add together other clusters to get other_sim_values due to multitarget/group activity of some ligands
+                        cluster_ligand_indices = cluster2members[cluster]
+                        if sampled:
+                            other_sim_values = np.sort(
+                                get_sampled_other_sim_values(
+                                    cluster_ligand_indices,
+                                    N,
+                                    sample_rows,
+                                    sample_cols,
+                                    sample_values,
+                                )
+                            )
+                            # "greater" because we want to know if the distribution of cluster_sim_values is stochastically greater than other_sim_values
+                            U1, p_val = mannwhitneyu(
+                                cluster_sim_values,
+                                other_sim_values,
+                                alternative="greater",
+                            )
+                            other_size = len(other_sim_values)
+                            other_median = np.median(other_sim_values)
+                            cluster_ci = get_median_ci(np.sort(cluster_sim_values))
+                            other_ci = get_median_ci(other_sim_values)
+                            cluster2result_dict["cluster_median_ci_low"] += [
+                                cluster_ci[0]
+                            ]
+                            cluster2result_dict["cluster_median_ci_high"] += [
+                                cluster_ci[1]
+                            ]
+                            cluster2result_dict["other_median_ci_low"] += [other_ci[0]]
+                            cluster2result_dict["other_median_ci_high"] += [other_ci[1]]
+                        elif args.utest_method == "counts":
+                            cluster_counts = get_counts_on_values(
+                                cluster_sim_values, unique_values
+                            )
+                            cross_counts = get_cross_pair_counts(
+                                cluster_ligand_indices, N, sim_matrix, unique_values
+                            )
+                            other_counts = all_counts - cluster_counts - cross_counts
+                            # "greater" because we want to know if the distribution of cluster_sim_values is stochastically greater than other_sim_values
+                            U1, p_val = mannwhitneyu_from_counts(
+                                cluster_counts, other_counts, alternative="greater"
+                            )
+                            other_size = int(other_counts.sum())
+                            other_median = get_median_from_counts(
+                                unique_values, other_counts
+                            )
+                        else:
+                            other_sim_values = get_other_sim_values(
+                                cluster_ligand_indices, N, sim_matrix
+                            )
+                            # "greater" because we want to know if the distribution of cluster_sim_values is stochastically greater than other_sim_values
+                            U1, p_val = mannwhitneyu(
+                                cluster_sim_values,
+                                other_sim_values,
+                                alternative="greater",
+                            )
+                            other_size = len(other_sim_values)
+                            other_median = np.median(other_sim_values)
+                        # see notes of: https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.mannwhitneyu.html
+                        cluster_size = len(cluster_sim_values)
+                        U2 = cluster_size * other_size - U1
+                        cluster2result_dict["cluster"] += [cluster]
+                        cluster2result_dict["cluster_size"] += [cluster_size]
+                        cluster2result_dict["other_size"] += [other_size]
+                        cluster2result_dict["cluster_median"] += [
+                            np.median(cluster_sim_values)
+                        ]
+                        cluster2result_dict["other_median"] += [other_median]
+                        cluster2result_dict["U1"] += [U1]
+                        cluster2result_dict["U2"] += [U2]
+                        cluster2result_dict["p_val"] += [p_val]
+                        cluster2result_dict["corrected_p_val"] += [
+                            min(p_val * n_clusters, 1.0)
+                        ]
+                    profiler.add_items(n_clusters)
 
-    ligand_cluster_df = ligand_cluster_df.join(family_info_df, on="protein_class_id")
-    sanity_checks(ligand_cluster_df, cluster_dict)
-
-    cluster2result_dict = {
-        "cluster": [],
-        "cluster_size": [],
-        "other_size": [],
-        "cluster_median": [],
-        "other_median": [],
-        "U1": [],
-        "U2": [],
-        "p_val": [],
-        "corrected_p_val": [],  # using a Bonferroni correction to avoid multiple comparisons problem
-    }
-    n_clusters = len(cluster_dict)
-    for cluster in cluster_dict:
-        cluster_sim_values = cluster_dict[cluster]
-        # need to remove similarity values computed wrt to all ligands belonging to this cluster for test to be valid
-        # note we can't just add together other clusters to get other_sim_values due to multitarget/group activity of some ligands
-        cluster_ligands = (
-            ligand_cluster_df.filter(ligand_cluster_df["cluster"] == cluster)[
-                "molregno"
-            ]
-            .unique()
-            .to_list()
-        )
-        cluster_ligand_indices = [id2idx_map[lig_id] for lig_id in cluster_ligands]
-        cluster_indices = []
-        for i in cluster_ligand_indices:
-            ligand_indices = get_all_ltm_indices_from_idx(i, N)
-            assert len(ligand_indices) == (
-                N - 1
-            ), f"Each ligand would have been compared against N-1 = {N-1} other ligands, but found len(ligand_indices)={len(ligand_indices)}"
-            cluster_indices += ligand_indices
-
-        other_sim_values = np.delete(sim_matrix, cluster_indices)
-
-        # "greater" because we want to know if the distribution of cluster_sim_values is stochastically greater than other_sim_values
-        U1, p_val = mannwhitneyu(
-            cluster_sim_values, other_sim_values, alternative="greater"
-        )
-        # see notes of: https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.mannwhitneyu.html
-        cluster_size = len(cluster_sim_values)
-        other_size = len(other_sim_values)
-        U2 = cluster_size * other_size - U1
-        cluster2result_dict["cluster"] += [cluster]
-        cluster2result_dict["cluster_size"] += [cluster_size]
-        cluster2result_dict["other_size"] += [other_size]
-        cluster2result_dict["cluster_median"] += [np.median(cluster_sim_values)]
-        cluster2result_dict["other_median"] += [np.median(other_sim_values)]
-        cluster2result_dict["U1"] += [U1]
-        cluster2result_dict["U2"] += [U2]
-        cluster2result_dict["p_val"] += [p_val]
-        cluster2result_dict["corrected_p_val"] += [min(p_val * n_clusters, 1.0)]
-
-    cluster2name_df = (
-        ligand_cluster_df[["cluster", "short_name"]].unique().sort(by="cluster")
-    )
-    result_df = pl.from_dict(cluster2result_dict)
-    result_df = result_df.join(cluster2name_df, on="cluster")
-    result_df = result_df[
-        [
-            "cluster",
-            "short_name",
-            "cluster_size",
-            "other_size",
-            "cluster_median",
-            "other_median",
-            "U1",
-            "U2",
-            "p_val",
-            "corrected_p_val",
-        ]
-    ]
-    result_df = result_df.sort(by="cluster")
-    result_df.write_csv(args.mann_whitney_utest_tsv_file, separator="\t")
+                with profiler.phase("save"):
+                    result_df = pl.from_dict(cluster2result_dict)
+                    columns = ["cluster"]
+                    if grouping.startswith("class_level="):
+                        result_df = result_df.join(
+                            get_cluster_names(
+                                args.family_details_tsv_file,
+                                args.cluster_dir,
+                                int(grouping.removeprefix("class_level=")),
+                                args.table_format,
+                            ),
+                            on="cluster",
+                        )
+                        columns += ["short_name"]
+                    columns += [
+                        "cluster_size",
+                        "other_size",
+                        "cluster_median",
+                        "other_median",
+                        "U1",
+                        "U2",
+                        "p_val",
+                        "corrected_p_val",
+                    ]
+                    if sampled:
+                        # sizes are the number of sampled pairs
+                        columns += [
+                            "cluster_median_ci_low",
+                            "cluster_median_ci_high",
+                            "other_median_ci_low",
+                            "other_median_ci_high",
+                        ]
+                    result_df = result_df[columns]
+                    result_df = result_df.sort(by="cluster")
+                    result_df = result_df.rename({"cluster": group_col})
+                    save_path = os.path.join(
+                        args.mann_whitney_utest_dir,
+                        f"mann_whitney_utest_{save_name}.{args.table_format}",
+                    )
+                    write_table(result_df, save_path)
+                    print(f"Saved Mann-Whitney U-test results to: {save_path}")
 
 
 if __name__ == "__main__":
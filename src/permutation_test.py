@@ -0,0 +1,414 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Permutation test of the enrichment of high similarity pairs within clusters
+(see probability_analysis.py). The null distribution is obtained by shuffling
+the group labels of ligands: each permutation assigns the full membership row
+of one ligand (all of its clusters/targets/assays) to another ligand, so group
+sizes and multi-membership of ligands are preserved. For each permutation the
+number of high similarity pairs within each group is counted for all thresholds
+at once with sparse matrix operations, over batches of permutations that are
+spread across a pool of processes.
+"""
+
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import polars as pl
+from scipy.sparse import csr_array, hstack
+
+from utils.args import (
+    add_grouping_args,
+    add_profiling_args,
+    add_table_format_arg,
+    get_groupings,
+)
+from utils.constants import get_membership_fpath
+from utils.io import load_from_pkl
+from utils.ltm import (
+    check_size,
+    dequantize_sim_values,
+    get_triangle_number,
+    load_sim_matrix,
+)
+from utils.membership import load_membership
+from utils.profiling import StageProfiler
+from utils.sim_graph import get_sim_graph, load_sim_graph
+from utils.tables import write_table
+
+# state of each worker process, set by init_worker
+_worker_state = {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Permutation test of the enrichment of high similarity pairs within clusters/targets/assays",
+        epilog="",
+    )
+    parser.add_argument(
+        "--cluster_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input directory where clustered ligands and targets were saved to by assign_family_clusters.py",
+    )
+    similarity_group = parser.add_mutually_exclusive_group(required=True)
+    similarity_group.add_argument(
+        "--similarity_npy_file",
+        type=str,
+        default=None,
+        help="Output .npy file containing lower-triangular similarity matrix",
+    )
+    similarity_group.add_argument(
+        "--similarity_graph_npz_file",
+        type=str,
+        default=None,
+        help="Output .npz file from build_similarity_graph.py. Can be given instead of similarity_npy_file, in which case all thresholds must be >= the floor of the graph",
+    )
+    parser.add_argument(
+        "--similarity_id_pkl_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output .pkl file containing compound IDs (in order used by similarity_npy_file)",
+    )
+    parser.add_argument(
+        "--permutation_test_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output directory of the test results and null distributions",
+    )
+    add_grouping_args(parser, "test")
+    parser.add_argument(
+        "--similarity_threshold_min",
+        type=float,
+        default=0.2,
+        help="Minimum similarity threshold (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--similarity_threshold_max",
+        type=float,
+        default=0.9,
+        help="Maximum similarity threshold (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--similarity_threshold_N",
+        type=int,
+        default=8,
+        help="Number of thresholds, np.linspace(min, max, N) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_permutations",
+        type=int,
+        default=1000,
+        help="Number of permutations (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10,
+        help="Number of permutations evaluated together in one matrix operation (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pair_chunk_size",
+        type=int,
+        default=1_000_000,
+        help="Number of high similarity pairs processed at once per batch, bounds memory use (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=10_000_000,
+        help="Approximate number of LTM values scanned at once for high similarity pairs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to evaluate batches of permutations (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed, results do not depend on n_jobs (default: %(default)s)",
+    )
+    add_table_format_arg(parser)
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def get_pair_levels(
+    rows: np.ndarray, cols: np.ndarray, values: np.ndarray, thresholds: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, csr_array]:
+    """
+    Keep the pairs with similarity > the lowest threshold and get the matrix
+    used to count pairs per threshold level.
+
+    :param np.ndarray rows: first ligand of each pair
+    :param np.ndarray cols: second ligand of each pair
+    :param np.ndarray values: similarity value of each pair
+    :param np.ndarray thresholds: sorted similarity thresholds
+    :return tuple: (rows, cols, level matrix), the level matrix being a
+        (n_thresholds x n_pairs) indicator of the highest threshold exceeded by each pair
+    """
+    # number of thresholds each value is > than
+    levels = np.searchsorted(thresholds, dequantize_sim_values(values), side="left")
+    keep = levels > 0
+    rows, cols, levels = rows[keep], cols[keep], levels[keep]
+    level_matrix = csr_array(
+        (
+            np.ones(len(levels), dtype=np.int64),
+            (levels - 1, np.arange(len(levels))),
+        ),
+        shape=(len(thresholds), len(levels)),
+    )
+    return rows, cols, level_matrix
+
+
+def count_group_high_sim_pairs(
+    membership: csr_array,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    level_matrix: csr_array,
+    pair_chunk_size: int,
+) -> np.ndarray:
+    """
+    Count the pairs > each threshold with both ligands in each group.
+
+    :param csr_array membership: ligand x group membership matrix (int)
+    :param np.ndarray rows: first ligand of each high similarity pair
+    :param np.ndarray cols: second ligand of each high similarity pair
+    :param csr_array level_matrix: level matrix of the pairs (see get_pair_levels)
+    :param int pair_chunk_size: number of pairs processed at once
+    :return np.ndarray: array of shape (n_thresholds, n_groups)
+    """
+    counts = np.zeros((level_matrix.shape[0], membership.shape[1]), dtype=np.int64)
+    for start in range(0, len(rows), pair_chunk_size):
+        stop = start + pair_chunk_size
+        # pair x group, 1 if both ligands of the pair are in the group
+        both_in_group = membership[rows[start:stop]].multiply(
+            membership[cols[start:stop]]
+        )
+        counts += (level_matrix[:, start:stop] @ both_in_group).toarray()
+    # pairs > threshold j are the pairs of level >= j
+    return np.cumsum(counts[::-1], axis=0)[::-1]
+
+
+def init_worker(
+    membership: csr_array,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    level_matrix: csr_array,
+    pair_chunk_size: int,
+) -> None:
+    # with fork, workers share (read-only) the arrays of the parent process
+    _worker_state["membership"] = membership
+    _worker_state["rows"] = rows
+    _worker_state["cols"] = cols
+    _worker_state["level_matrix"] = level_matrix
+    _worker_state["pair_chunk_size"] = pair_chunk_size
+
+
+def run_permutation_batch(
+    batch: tuple[np.random.SeedSequence, int],
+) -> np.ndarray:
+    """
+    Evaluate a batch of permutations of the membership matrix set by init_worker.
+    Group columns of all permuted matrices are stacked, so each batch is a single
+    set of sparse matrix products.
+
+    :param tuple batch: (seed of the batch, number of permutations)
+    :return np.ndarray: counts of shape (n_permutations, n_thresholds, n_groups)
+    """
+    seed, n_permutations = batch
+    rng = np.random.default_rng(seed)
+    membership = _worker_state["membership"]
+    N, n_groups = membership.shape
+    permuted = hstack(
+        [membership[rng.permutation(N)] for _ in range(n_permutations)],
+        format="csr",
+    )
+    counts = count_group_high_sim_pairs(
+        permuted,
+        _worker_state["rows"],
+        _worker_state["cols"],
+        _worker_state["level_matrix"],
+        _worker_state["pair_chunk_size"],
+    )
+    n_thresholds = counts.shape[0]
+    return counts.reshape(n_thresholds, n_permutations, n_groups).transpose(1, 0, 2)
+
+
+def get_null_distribution(
+    membership: csr_array,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    level_matrix: csr_array,
+    n_permutations: int,
+    batch_size: int,
+    pair_chunk_size: int,
+    seed: int,
+    n_jobs: int = 1,
+) -> np.ndarray:
+    """
+    Count high similarity pairs within each group for random permutations of the ligand labels.
+
+    :return np.ndarray: counts of shape (n_permutations, n_thresholds, n_groups)
+    """
+    batch_sizes = [
+        min(batch_size, n_permutations - start)
+        for start in range(0, n_permutations, batch_size)
+    ]
+    # independent random streams per batch, so results do not depend on n_jobs
+    batches = list(
+        zip(np.random.SeedSequence(seed).spawn(len(batch_sizes)), batch_sizes)
+    )
+    initargs = (membership, rows, cols, level_matrix, pair_chunk_size)
+    if n_jobs > 1 and len(batches) > 1:
+        with Pool(n_jobs, initializer=init_worker, initargs=initargs) as pool:
+            null_counts = list(pool.imap(run_permutation_batch, batches))
+    else:
+        init_worker(*initargs)
+        null_counts = list(map(run_permutation_batch, batches))
+    return np.concatenate(null_counts)
+
+
+def get_test_results(
+    observed: np.ndarray,
+    null_counts: np.ndarray,
+    group_ids: np.ndarray,
+    group_sizes: np.ndarray,
+    high_sim_total: np.ndarray,
+    total_pairs: int,
+    thresholds: np.ndarray,
+    group_col: str,
+) -> pl.DataFrame:
+    """
+    Empirical (one-sided) p-values of the observed counts of high similarity pairs within
+    each group with at least 2 ligands, one row per group and threshold.
+    """
+    n_permutations = null_counts.shape[0]
+    p_vals = (1 + (null_counts >= observed).sum(axis=0)) / (n_permutations + 1)
+    n_tested = int((group_sizes > 1).sum())
+    both_in_group_total = group_sizes * (group_sizes - 1) // 2
+    # P(sim > threshold) over all pairs
+    p_high_sim = high_sim_total / total_pairs
+    results = []
+    for j, threshold in enumerate(thresholds):
+        for k in np.flatnonzero(group_sizes > 1):
+            expected = both_in_group_total[k] * p_high_sim[j]
+            results.append(
+                {
+                    group_col: group_ids[k].item(),
+                    "threshold": threshold.item(),
+                    "cluster_size": group_sizes[k].item(),
+                    "high_sim_pairs": observed[j, k].item(),
+                    "null_mean_high_sim_pairs": null_counts[:, j, k].mean().item(),
+                    "null_std_high_sim_pairs": null_counts[:, j, k].std().item(),
+                    "enrichment_factor": (
+                        float(observed[j, k] / expected) if expected > 0 else 0.0
+                    ),
+                    "p_val": p_vals[j, k].item(),
+                    # using a Bonferroni correction to avoid multiple comparisons problem
+                    "corrected_p_val": float(min(p_vals[j, k] * n_tested, 1.0)),
+                }
+            )
+    return pl.DataFrame(results)
+
+
+def main():
+    args = parse_args()
+    with StageProfiler(
+        "permutation_test", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        id_list = load_from_pkl(args.similarity_id_pkl_file)
+        N = len(id_list)
+        thresholds = np.linspace(
+            args.similarity_threshold_min,
+            args.similarity_threshold_max,
+            args.similarity_threshold_N,
+        )
+
+        with profiler.phase("high_sim_pairs", unit="pairs"):
+            if args.similarity_graph_npz_file is not None:
+                graph, floor = load_sim_graph(args.similarity_graph_npz_file)
+                assert graph.shape == (
+                    N,
+                    N,
+                ), f"Expected graph of shape {(N, N)}, given shape: {graph.shape}"
+                assert (
+                    thresholds.min() >= floor
+                ), f"All thresholds must be >= the floor of the similarity graph ({floor})"
+                graph = graph.tocoo()
+            else:
+                # scanned in chunks of the memory-mapped LTM
+                sim_matrix = load_sim_matrix(args.similarity_npy_file, mmap_mode="r")
+                check_size(sim_matrix, N)
+                graph = get_sim_graph(sim_matrix, N, thresholds.min(), args.chunk_size)
+            rows, cols, level_matrix = get_pair_levels(
+                graph.row, graph.col, graph.data, thresholds
+            )
+            del graph
+            high_sim_total = np.cumsum(level_matrix.sum(axis=1)[::-1])[::-1]
+            profiler.add_items(len(rows))
+        print(f"Found {len(rows)} pairs with similarity > {thresholds.min()}")
+
+        os.makedirs(args.permutation_test_dir, exist_ok=True)
+        for grouping, group_col, save_name in get_groupings(args):
+            with profiler.phase(grouping, unit="permutations"):
+                membership, group_ids = load_membership(
+                    get_membership_fpath(args.cluster_dir, grouping), id_list
+                )
+                membership = membership.astype(np.int32)
+                group_sizes = np.diff(membership.tocsc().indptr)
+                observed = count_group_high_sim_pairs(
+                    membership, rows, cols, level_matrix, args.pair_chunk_size
+                )
+                null_counts = get_null_distribution(
+                    membership,
+                    rows,
+                    cols,
+                    level_matrix,
+                    args.n_permutations,
+                    args.batch_size,
+                    args.pair_chunk_size,
+                    args.seed,
+                    args.n_jobs,
+                )
+                profiler.add_items(args.n_permutations)
+
+                results = get_test_results(
+                    observed,
+                    null_counts,
+                    group_ids,
+                    group_sizes,
+                    high_sim_total,
+                    get_triangle_number(N),
+                    thresholds,
+                    group_col,
+                )
+                save_path = os.path.join(
+                    args.permutation_test_dir,
+                    f"permutation_test_{save_name}.{args.table_format}",
+                )
+                write_table(results, save_path)
+                np.savez_compressed(
+                    os.path.join(
+                        args.permutation_test_dir, f"null_distribution_{save_name}.npz"
+                    ),
+                    null_high_sim_pairs=null_counts,
+                    observed_high_sim_pairs=observed,
+                    group_ids=group_ids,
+                    thresholds=thresholds,
+                )
+                print(f"Saved permutation test results to: {save_path}")
+
+
+if __name__ == "__main__":
+    main()
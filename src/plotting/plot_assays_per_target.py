@@ -23,7 +23,7 @@ def parse_args():
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing TID and assay_id",
+        help="Input TSV/Parquet file containing TID and assay_id",
     )
     parser.add_argument(
         "--out_path",
@@ -38,7 +38,10 @@ def parse_args():
 
 def main():
     args = parse_args()
-    df = pl.read_csv(args.assay_tsv_file, separator="\t")
+    if args.assay_tsv_file.endswith(".parquet"):
+        df = pl.read_parquet(args.assay_tsv_file, columns=["tid"])
+    else:
+        df = pl.read_csv(args.assay_tsv_file, separator="\t", columns=["tid"])
     n_a_per_t = df["tid"].value_counts()["count"]
     sns.histplot(n_a_per_t)
     plt.title("Number of Unique Assay Records per Target")
@@ -10,15 +10,37 @@ Credit to Claude for helping write some of the code here.
 import argparse
 import os
 import sys
-from itertools import combinations
 
 import numpy as np
 import polars as pl
+from scipy.sparse import csr_array, issparse
 from tqdm import tqdm
 
-from utils.constants import get_ligand2cluster_fpath
+from utils.args import (
+    add_grouping_args,
+    add_profiling_args,
+    add_table_format_arg,
+    get_groupings,
+)
+from utils.constants import get_group_sample_fpath, get_membership_fpath
 from utils.io import load_from_pkl
-from utils.ltm import check_size, get_id2idx_map, get_ltm_idx
+from utils.ltm import (
+    check_size,
+    dequantize_sim_values,
+    get_group_ltm_indices,
+    get_triangle_number,
+    load_sim_matrix,
+)
+from utils.membership import get_group_members, load_membership
+from utils.pair_sample import (
+    get_proportion_rel_var,
+    get_ratio_error_bars,
+    load_global_sample,
+)
+from utils.profiling import StageProfiler
+from utils.ragged import RaggedGroupValues, load_group_values
+from utils.sim_graph import get_group_graph_values, load_sim_graph
+from utils.tables import write_table
 
 
 # TODO: it would likely make sense here to not consider similarity values for ligands active against same target
@@ -35,54 +57,38 @@ def parse_args():
         default=argparse.SUPPRESS,
         help="Input directory where clustered ligands and targets were saved to by assign_family_clusters.py",
     )
-    parser.add_argument(
+    similarity_group = parser.add_mutually_exclusive_group(required=True)
+    similarity_group.add_argument(
         "--similarity_npy_file",
         type=str,
-        required=True,
-        default=argparse.SUPPRESS,
+        default=None,
         help="Output .npy file containing lower-triangular similarity matrix",
     )
-    parser.add_argument(
-        "--similarity_id_pkl_file",
+    similarity_group.add_argument(
+        "--similarity_graph_npz_file",
         type=str,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Output .pkl file containing compound IDs (in order used by similarity_npy_file)",
+        default=None,
+        help="Output .npz file from build_similarity_graph.py. Can be given instead of similarity_npy_file, in which case all thresholds must be >= the floor of the graph",
     )
-    parser.add_argument(
-        "--prob_analysis_dir",
+    similarity_group.add_argument(
+        "--similarity_sample_dir",
         type=str,
-        required=True,
-        help="Output directory where .pkl and .tsv files containing computed probabilities will be saved",
-    )
-    parser.add_argument(
-        "--min_class_level",
-        type=int,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Minimum class_level to visualize (inclusive)",
-    )
-    parser.add_argument(
-        "--max_class_level",
-        type=int,
-        required=True,
-        default=argparse.SUPPRESS,
-        help="Maximum class_level to visualize (inclusive)",
+        default=None,
+        help="Output directory of sample_similarity_pairs.py. Can be given instead of similarity_npy_file, in which case probabilities are estimated from random pairs of ligands (with error bars)",
     )
     parser.add_argument(
-        "--ligand2tid_tsv_file",
+        "--similarity_id_pkl_file",
         type=str,
-        required=False,
         default=None,
-        help="(Optional) TSV file containing mapping from ligands (molregno) to targets (tid). If given will also calculate probabilities for ligand similarity values per TID.",
+        help="Output .pkl file containing compound IDs (in order used by similarity_npy_file), not needed with --similarity_sample_dir",
     )
     parser.add_argument(
-        "--activities_tsv_file",
+        "--prob_analysis_dir",
         type=str,
-        required=False,
-        default=None,
-        help="(Optional) Input TSV file containing active compound information (ligand <-> assay_id mapping). If given will also calculate probabilities for ligand similarity values per ASSAY_ID.",
+        required=True,
+        help="Output directory where .pkl and .tsv files containing computed probabilities will be saved",
     )
+    add_grouping_args(parser, "calculate probabilities for")
     parser.add_argument(
         "--similarity_threshold_min",
         type=float,
@@ -104,118 +110,180 @@ def parse_args():
         default=3,
         help="Number of similarity thresholds to test. Used threshold values calculated as np.linspace(similarity_threshold_min, similarity_threshold_max, similarity_threshold_N)",
     )
+    add_table_format_arg(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
 
+def count_values_above_thresholds(
+    values: np.ndarray, thresholds: np.ndarray, chunk_size: int = 10_000_000
+) -> np.ndarray:
+    """
+    Count the number of values > threshold for every threshold,
+    using a single pass over values (done in chunks to limit memory use).
+
+    :param np.ndarray values: 1D array of similarity values
+    :param np.ndarray thresholds: similarity thresholds
+    :param int chunk_size: number of values to process at once
+    :return np.ndarray: counts[k] = (values > thresholds[k]).sum()
+    """
+    order = np.argsort(thresholds)
+    sorted_thresholds = np.asarray(thresholds)[order]
+    n_thresholds = len(sorted_thresholds)
+    # bin_counts[k] = number of values with exactly k thresholds below them
+    bin_counts = np.zeros(n_thresholds + 1, dtype=np.int64)
+    for i in range(0, len(values), chunk_size):
+        chunk = dequantize_sim_values(values[i : i + chunk_size])
+        bins = np.searchsorted(sorted_thresholds, chunk, side="left")
+        bin_counts += np.bincount(bins, minlength=n_thresholds + 1)
+    # value is > sorted_thresholds[k] if more than k thresholds are below it
+    sorted_counts = np.cumsum(bin_counts[::-1])[::-1][1:]
+    counts = np.empty(n_thresholds, dtype=np.int64)
+    counts[order] = sorted_counts
+    return counts
+
+
+def count_sorted_values_above_thresholds(
+    sorted_values: np.ndarray, thresholds: np.ndarray
+) -> np.ndarray:
+    return len(sorted_values) - np.searchsorted(sorted_values, thresholds, side="right")
+
+
 def get_overall_dist_stats(
-    sim_matrix: np.ndarray,
-    similarity_threshold: float = 0.85,
+    sim_matrix: np.ndarray | csr_array,
+    thresholds: np.ndarray,
 ) -> dict:
-    total_pairs = len(sim_matrix)
-    high_sim_total = (sim_matrix > similarity_threshold).sum()
+    if issparse(sim_matrix):
+        # graph only contains pairs >= floor, which is fine as long as thresholds >= floor
+        total_pairs = get_triangle_number(sim_matrix.shape[0])
+        high_sim_total = count_values_above_thresholds(sim_matrix.data, thresholds)
+    else:
+        total_pairs = len(sim_matrix)
+        high_sim_total = count_values_above_thresholds(sim_matrix, thresholds)
     results = {"total_pairs": total_pairs, "high_sim_total": high_sim_total}
     return results
 
 
+def get_cluster_sim_values(
+    idx_array: np.ndarray,
+    sim_matrix: np.ndarray | csr_array,
+) -> tuple[np.ndarray, int]:
+    """
+    Gather similarity values of pairs within the cluster.
+    If sim_matrix is a graph from build_similarity_graph.py only the values >= floor are returned.
+
+    Returns:
+        Tuple of (similarity values, total number of pairs in cluster)
+    """
+    n = len(idx_array)
+    if issparse(sim_matrix):
+        sim_values = get_group_graph_values(sim_matrix, idx_array)
+    else:
+        sim_values = sim_matrix[get_group_ltm_indices(idx_array)]
+    return dequantize_sim_values(sim_values), get_triangle_number(n)
+
+
 def calculate_cluster_probability_for_single_cluster(
-    cluster_ligands: set,
+    idx_array: np.ndarray,
     overall_dist_stats: dict,
-    sim_matrix: np.ndarray,
-    id2idx_map: dict,
-    similarity_threshold: float = 0.85,
-) -> dict:
-    high_sim_both_in_cluster = 0  # P(both in cluster AND sim > threshold)
+    sim_matrix: np.ndarray | csr_array,
+    thresholds: np.ndarray,
+) -> list[dict]:
+    """
+    Calculate probability statistics of a single cluster for every threshold.
+    Similarity values of the cluster are gathered and sorted once, after which
+    each threshold is answered with a binary search.
 
+    Returns:
+        List containing probability statistics for each threshold (same order as thresholds)
+    """
     # Additional counters for comprehensive analysis
     total_pairs = overall_dist_stats["total_pairs"]
-    high_sim_total = overall_dist_stats["high_sim_total"]
-    both_in_cluster_total = 0
-
-    # Iterate through all pairs of ligands
-    for id1, id2 in combinations(cluster_ligands, 2):
-        # Get similarity value
-        i1, i2 = id2idx_map[id1], id2idx_map[id2]
-        row = max(i1, i2)
-        col = min(i1, i2)
-        sim_idx = get_ltm_idx(row, col)
-        sim_value = sim_matrix[sim_idx]
-
-        both_in_cluster_total += 1
-        if sim_value > similarity_threshold:
-            high_sim_both_in_cluster += 1
-
-    # Calculate probabilities
-    if high_sim_total == 0:
-        conditional_prob = 0.0
-    else:
-        conditional_prob = high_sim_both_in_cluster / high_sim_total
+    high_sim_totals = overall_dist_stats["high_sim_total"]
+
+    # Gather all similarity values within the cluster
+    sim_values, both_in_cluster_total = get_cluster_sim_values(idx_array, sim_matrix)
+    sim_values = np.sort(sim_values)
+    # P(both in cluster AND sim > threshold) for every threshold
+    high_sim_both_in_cluster_counts = count_sorted_values_above_thresholds(
+        sim_values, thresholds
+    )
 
     # Additional useful statistics
     baseline_prob = both_in_cluster_total / total_pairs if total_pairs > 0 else 0
 
-    results = {
-        "conditional_probability": conditional_prob,
-        "baseline_probability": baseline_prob,
-        "high_sim_both_in_cluster_count": high_sim_both_in_cluster,
-        "high_sim_total_count": high_sim_total,
-        "total_pairs": total_pairs,
-        "both_in_cluster_total": both_in_cluster_total,
-        "similarity_threshold": similarity_threshold,
-        "enrichment_factor": (
-            conditional_prob / baseline_prob if baseline_prob > 0 else float("inf")
-        ),
-        "cluster_size": len(cluster_ligands),
-    }
+    results = []
+    for similarity_threshold, high_sim_both_in_cluster, high_sim_total in zip(
+        thresholds, high_sim_both_in_cluster_counts, high_sim_totals
+    ):
+        # Calculate probabilities
+        if high_sim_total == 0:
+            conditional_prob = 0.0
+        else:
+            conditional_prob = high_sim_both_in_cluster / high_sim_total
+
+        results.append(
+            {
+                "conditional_probability": conditional_prob,
+                "baseline_probability": baseline_prob,
+                "high_sim_both_in_cluster_count": high_sim_both_in_cluster,
+                "high_sim_total_count": high_sim_total,
+                "total_pairs": total_pairs,
+                "both_in_cluster_total": both_in_cluster_total,
+                "similarity_threshold": similarity_threshold,
+                "enrichment_factor": (
+                    conditional_prob / baseline_prob
+                    if baseline_prob > 0
+                    else float("inf")
+                ),
+                "cluster_size": len(idx_array),
+            }
+        )
 
     return results
 
 
 def calculate_cluster_probabilities_all_clusters(
-    l2c_df: pl.DataFrame,
-    sim_matrix: np.ndarray,
-    id2idx_map: dict,
-    similarity_threshold: float = 0.85,
-    group_col: str = "cluster",
-    id_col: str = "molregno",
+    membership: csr_array,
+    cluster_ids: np.ndarray,
+    sim_matrix: np.ndarray | csr_array,
+    thresholds: np.ndarray,
 ) -> dict:
     """
     Calculate P(both in cluster | similarity > threshold) for each cluster individually.
 
     Args:
-        l2c_df: DataFrame with ligand-to-cluster mappings
-        sim_matrix: 1D array containing similarity values (lower triangular matrix)
-        id2idx_map: Mapping from ligand IDs to matrix indices
-        similarity_threshold: Threshold for high similarity (default 0.85)
-        group_col: Column name for cluster assignments
-        id_col: Column name for ligand IDs
+        membership: ligand x cluster membership matrix (rows in order of the similarity matrix)
+        cluster_ids: cluster ID of each column of membership
+        sim_matrix: 1D array containing similarity values (lower triangular matrix) or sparse graph of similarity values
+        thresholds: Thresholds for high similarity
 
     Returns:
-        Dictionary mapping cluster_id -> probability statistics
+        Dictionary mapping cluster_id -> list of probability statistics (one per threshold)
     """
-    overall_dist_stats = get_overall_dist_stats(sim_matrix, similarity_threshold)
-    # Get unique clusters
-    unique_clusters = l2c_df[group_col].unique().to_list()
+    # single pass over the full LTM for all thresholds
+    overall_dist_stats = get_overall_dist_stats(sim_matrix, thresholds)
 
     cluster_results = {}
 
-    for cluster_id in unique_clusters:
-        # Get ligands in this cluster
-        cluster_ligands = set(
-            l2c_df.filter(pl.col(group_col) == cluster_id)[id_col].to_list()
-        )
-
+    # ligands (matrix indices) in each cluster, from a single pass over the membership matrix
+    cluster_members = get_group_members(membership)
+    for cluster_id, idx_array in tqdm(
+        zip(cluster_ids.tolist(), cluster_members),
+        total=len(cluster_ids),
+        file=sys.stdout,
+    ):
         # Skip clusters with too few ligands (need at least 2 for pairs)
-        if len(cluster_ligands) < 2:
+        if len(idx_array) < 2:
             continue
 
         # Calculate probability statistics for this cluster
         cluster_stats = calculate_cluster_probability_for_single_cluster(
-            cluster_ligands,
+            idx_array,
             overall_dist_stats,
             sim_matrix,
-            id2idx_map,
-            similarity_threshold,
+            thresholds,
         )
 
         cluster_results[cluster_id] = cluster_stats
@@ -224,12 +292,11 @@ def calculate_cluster_probabilities_all_clusters(
 
 
 def analyze_probability_vs_threshold_per_cluster(
-    l2c_df: pl.DataFrame,
-    sim_matrix: np.ndarray,
-    id2idx_map: dict,
+    membership: csr_array,
+    cluster_ids: np.ndarray,
+    sim_matrix: np.ndarray | csr_array,
     thresholds: list[float],
     group_col: str = "cluster",
-    id_col: str = "molregno",
 ) -> pl.DataFrame:
     """
     Analyze how conditional probability changes with threshold for each cluster.
@@ -237,14 +304,15 @@ def analyze_probability_vs_threshold_per_cluster(
     Returns:
         DataFrame with threshold analysis results per cluster
     """
-    results = []
-
-    for threshold in tqdm(thresholds, file=sys.stdout):
-        cluster_results = calculate_cluster_probabilities_all_clusters(
-            l2c_df, sim_matrix, id2idx_map, threshold, group_col, id_col
-        )
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    cluster_results = calculate_cluster_probabilities_all_clusters(
+        membership, cluster_ids, sim_matrix, thresholds
+    )
 
-        for cluster_id, stats in cluster_results.items():
+    results = []
+    for i, threshold in enumerate(thresholds):
+        for cluster_id in sorted(cluster_results):
+            stats = cluster_results[cluster_id][i]
             result_row = {
                 group_col: cluster_id,
                 "threshold": threshold,
@@ -259,14 +327,106 @@ def analyze_probability_vs_threshold_per_cluster(
     return pl.DataFrame(results)
 
 
+def analyze_sampled_probability_vs_threshold_per_cluster(
+    membership: csr_array,
+    cluster_ids: np.ndarray,
+    cluster2sample: RaggedGroupValues,
+    global_sample: np.ndarray,
+    total_pairs: int,
+    thresholds: list[float],
+    group_col: str = "cluster",
+) -> pl.DataFrame:
+    """
+    Estimate the results of analyze_probability_vs_threshold_per_cluster from random
+    samples of pairs (see sample_similarity_pairs.py). P(sim > threshold) is estimated
+    from the global sample and P(sim > threshold | both in cluster) from the sample of
+    the cluster, the enrichment factor being their ratio. Standard errors and 95% CIs
+    of the estimates are computed with the delta method (nan if no pair of the global
+    sample is above the threshold, in which case the enrichment factor is reported as 0).
+
+    Args:
+        membership: ligand x cluster membership matrix (rows in order of the sampled ligands)
+        cluster_ids: cluster ID of each column of membership
+        cluster2sample: similarity values of the pairs sampled within each cluster
+        global_sample: similarity values of the pairs sampled from all pairs
+        total_pairs: total number of ligand pairs
+        thresholds: Thresholds for high similarity
+
+    Returns:
+        DataFrame with threshold analysis results per cluster (+ error bars)
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    n_global = len(global_sample)
+    high_sim_global = count_values_above_thresholds(global_sample, thresholds)
+    p_high_sim = high_sim_global / max(n_global, 1)
+    rel_var_global = get_proportion_rel_var(high_sim_global, n_global, total_pairs)
+
+    cluster_sizes = np.diff(membership.tocsc().indptr)
+    cluster_results = {}
+    for cluster_id, cluster_size in zip(cluster_ids.tolist(), cluster_sizes.tolist()):
+        # Skip clusters with too few ligands (need at least 2 for pairs)
+        if cluster_size < 2:
+            continue
+        sim_values = np.sort(cluster2sample[cluster_id])
+        n_sampled = len(sim_values)
+        both_in_cluster_total = get_triangle_number(cluster_size)
+        high_sim_cluster = count_sorted_values_above_thresholds(sim_values, thresholds)
+        p_high_sim_cluster = high_sim_cluster / n_sampled
+        # no high similarity pairs at all -> conditional probability of 0 (as for the full matrix)
+        enrichment = np.divide(
+            p_high_sim_cluster,
+            p_high_sim,
+            out=np.zeros(len(thresholds)),
+            where=p_high_sim > 0,
+        )
+        rel_var_cluster = get_proportion_rel_var(
+            high_sim_cluster, n_sampled, both_in_cluster_total
+        )
+        enrichment_se, enrichment_lo, enrichment_hi = get_ratio_error_bars(
+            enrichment, rel_var_cluster, rel_var_global
+        )
+        # no sampled pair of the cluster above threshold: one-sided upper bound ("rule of three")
+        no_hits = (
+            (high_sim_cluster == 0)
+            & (n_sampled < both_in_cluster_total)
+            & (p_high_sim > 0)
+        )
+        enrichment_lo[no_hits] = 0.0
+        enrichment_hi[no_hits] = 3 / n_sampled / p_high_sim[no_hits]
+        baseline_prob = both_in_cluster_total / total_pairs
+        cluster_results[cluster_id] = {
+            "conditional_probability": baseline_prob * enrichment,
+            "conditional_probability_se": baseline_prob * enrichment_se,
+            "baseline_probability": np.full(len(thresholds), baseline_prob),
+            # estimated number of pairs in the cluster with similarity > threshold
+            "high_sim_pairs": p_high_sim_cluster * both_in_cluster_total,
+            "enrichment_factor": enrichment,
+            "enrichment_factor_se": enrichment_se,
+            "enrichment_factor_ci_low": enrichment_lo,
+            "enrichment_factor_ci_high": enrichment_hi,
+            "cluster_size": np.full(len(thresholds), cluster_size),
+            "n_sampled_pairs": np.full(len(thresholds), n_sampled),
+        }
+
+    results = []
+    for i, threshold in enumerate(thresholds):
+        for cluster_id in sorted(cluster_results):
+            stats = cluster_results[cluster_id]
+            result_row = {group_col: cluster_id, "threshold": threshold}
+            for key, values in stats.items():
+                result_row[key] = values[i].item()
+            results.append(result_row)
+
+    return pl.DataFrame(results)
+
+
 def run_probability_analysis(
-    l2c_df: pl.DataFrame,
-    sim_matrix: np.ndarray,
-    id2idx_map: dict,
+    membership: csr_array,
+    cluster_ids: np.ndarray,
+    sim_matrix: np.ndarray | csr_array,
     thresholds: list[float],
     tsv_save_path: str,
     group_col: str = "cluster",
-    id_col: str = "molregno",
 ) -> None:
     """
     Run comprehensive probability analysis per cluster and save results.
@@ -274,81 +434,100 @@ def run_probability_analysis(
 
     # Threshold sweep analysis
     threshold_analysis = analyze_probability_vs_threshold_per_cluster(
-        l2c_df, sim_matrix, id2idx_map, thresholds, group_col=group_col, id_col=id_col
+        membership, cluster_ids, sim_matrix, thresholds, group_col=group_col
     )
 
     # Save results
-    threshold_analysis.write_csv(tsv_save_path, separator="\t")
+    write_table(threshold_analysis, tsv_save_path)
 
     print(f"Saved threshold analysis to: {tsv_save_path}")
 
 
 def main():
     args = parse_args()
-    id_list = load_from_pkl(args.similarity_id_pkl_file)
-    N = len(id_list)
-    id2idx_map = get_id2idx_map(id_list)
-    sim_matrix = np.load(args.similarity_npy_file)
-    check_size(sim_matrix, N)
-
-    thresholds = np.linspace(
-        args.similarity_threshold_min,
-        args.similarity_threshold_max,
-        args.similarity_threshold_N,
-    )
-
-    prob_analysis_dir = args.prob_analysis_dir
-    os.makedirs(prob_analysis_dir, exist_ok=True)
-
-    # gather compounds in each cluster and their similarities
-    # then save result to pkl file
-    for cl in range(args.min_class_level, args.max_class_level + 1):
-        l2c_path = get_ligand2cluster_fpath(args.cluster_dir, cl)
-        l2c_df = pl.read_csv(l2c_path, separator="\t", columns=["molregno", "cluster"])
-
-        save_path = os.path.join(
-            prob_analysis_dir,
-            f"per_cluster_threshold_analysis_class_level={cl}.tsv",
+    with StageProfiler(
+        "probability_analysis", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        if args.similarity_sample_dir is not None:
+            id_list, _, _, global_sample = load_global_sample(
+                args.similarity_sample_dir
+            )
+        else:
+            assert (
+                args.similarity_id_pkl_file is not None
+            ), "--similarity_id_pkl_file must be given with --similarity_npy_file/--similarity_graph_npz_file"
+            id_list = load_from_pkl(args.similarity_id_pkl_file)
+        N = len(id_list)
+        thresholds = np.linspace(
+            args.similarity_threshold_min,
+            args.similarity_threshold_max,
+            args.similarity_threshold_N,
         )
-        run_probability_analysis(l2c_df, sim_matrix, id2idx_map, thresholds, save_path)
 
-    # save per tid sim values (if requested)
-    if args.ligand2tid_tsv_file is not None:
-        ligand2tid_df = pl.read_csv(
-            args.ligand2tid_tsv_file, separator="\t", columns=["molregno", "tid"]
-        )
-        save_path = os.path.join(
-            prob_analysis_dir,
-            f"per_cluster_threshold_analysis_per_target.tsv",
-        )
-        run_probability_analysis(
-            ligand2tid_df,
-            sim_matrix,
-            id2idx_map,
-            thresholds,
-            save_path,
-            group_col="tid",
-        )
-
-    if args.activities_tsv_file is not None:
-        print(
-            "WARNING: The probability analysis done here is only looking at the population of active ligands across the protein family you provided. When looking at assays, it perhaps would make more sense to look at all of the tested compounds within each assay (this is not currently implemented)"
-        )
-        assay2tid_df = pl.read_csv(
-            args.activities_tsv_file, separator="\t", columns=["molregno", "assay_id"]
-        )
-        save_path = os.path.join(
-            prob_analysis_dir,
-            f"per_cluster_threshold_analysis_per_assay.tsv",
-        )
-        run_probability_analysis(
-            assay2tid_df,
-            sim_matrix,
-            id2idx_map,
-            thresholds,
-            save_path,
-            group_col="assay_id",
-        )
+        with profiler.phase("load_matrix"):
+            if args.similarity_sample_dir is not None:
+                # only the sampled values are used
+                sim_matrix = None
+            elif args.similarity_graph_npz_file is not None:
+                sim_matrix, floor = load_sim_graph(args.similarity_graph_npz_file)
+                assert sim_matrix.shape == (
+                    N,
+                    N,
+                ), f"Expected graph of shape {(N, N)}, given shape: {sim_matrix.shape}"
+                assert (
+                    thresholds.min() >= floor
+                ), f"Similarity thresholds must be >= floor of the similarity graph (floor={floor})"
+                sim_matrix.data = dequantize_sim_values(sim_matrix.data)
+            else:
+                sim_matrix = load_sim_matrix(args.similarity_npy_file)
+                check_size(sim_matrix, N)
+
+        prob_analysis_dir = args.prob_analysis_dir
+        os.makedirs(prob_analysis_dir, exist_ok=True)
+
+        # calculate probabilities per cluster of each class_level (and per tid/assay if requested)
+        if args.per_assay:
+            print(
+                "WARNING: The probability analysis done here is only looking at the population of active ligands across the protein family you provided. When looking at assays, it perhaps would make more sense to look at all of the tested compounds within each assay (this is not currently implemented)"
+            )
+        for grouping, group_col, save_name in get_groupings(args):
+            with profiler.phase(grouping, unit="clusters"):
+                with profiler.phase("load_membership"):
+                    membership, cluster_ids = load_membership(
+                        get_membership_fpath(args.cluster_dir, grouping), id_list
+                    )
+                save_path = os.path.join(
+                    prob_analysis_dir,
+                    f"per_cluster_threshold_analysis_{save_name}.{args.table_format}",
+                )
+                if args.similarity_sample_dir is not None:
+                    threshold_analysis = (
+                        analyze_sampled_probability_vs_threshold_per_cluster(
+                            membership,
+                            cluster_ids,
+                            load_group_values(
+                                get_group_sample_fpath(
+                                    args.similarity_sample_dir, grouping
+                                )
+                            ),
+                            global_sample,
+                            get_triangle_number(N),
+                            thresholds,
+                            group_col=group_col,
+                        )
+                    )
+                    write_table(threshold_analysis, save_path)
+                    print(f"Saved threshold analysis to: {save_path}")
+                else:
+                    run_probability_analysis(
+                        membership,
+                        cluster_ids,
+                        sim_matrix,
+                        thresholds,
+                        save_path,
+                        group_col=group_col,
+                    )
+                profiler.add_items(len(cluster_ids))
 
 
 if __name__ == "__main__":
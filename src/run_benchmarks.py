@@ -0,0 +1,739 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Benchmark the similarity and statistics stages of the workflow on synthetic
+data (no PostgreSQL / ChEMBL needed). For each number of ligands, synthetic
+fingerprints and ligand -> assay -> target -> protein family tables are
+generated, after which calculate_fp_similarity.py, assign_family_clusters.py,
+gather_similarity_values.py, probability_analysis.py and mann_whitney_utest.py
+are run as they would be by Snakemake. The wall-clock time, CPU time and peak
+memory (RSS) of each stage (and of each phase of a stage, see utils/profiling.py)
+are saved to a JSON report, so that results of different versions/machines can
+be compared. Stage/phase times are measured within the stage process, so they
+exclude interpreter startup and imports.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import polars as pl
+
+from utils.constants import get_membership_fpath
+from utils.fingerprints import get_n_words, save_packed_fps
+from utils.io import load_from_pkl
+from utils.ltm import (
+    SIM_DTYPES,
+    dequantize_sim_values,
+    get_triangle_number,
+    load_sim_matrix,
+)
+from utils.membership import load_membership
+from utils.tables import TABLE_FORMATS, write_table
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_CLASS_ID = 1
+ROOT_CLASS_LEVEL = 3
+# lowest similarity threshold of probability_analysis.py
+SIMILARITY_THRESHOLD_MIN = 0.2
+# Runs a stage script (argv: peak_rss_file, script, *script_args) and writes its
+# peak RSS in KB. ru_maxrss of a child process also counts the memory the parent
+# had when forking, so the peak is read in the child itself (VmHWM is reset on exec).
+STAGE_RUNNER = """
+import os, resource, runpy, sys
+peak_rss_file = sys.argv.pop(1)
+sys.argv.pop(0)
+sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    peak_rss_kb = None
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak_rss_kb = int(line.split()[1])
+    if peak_rss_kb is None:
+        # bytes on macOS, KB elsewhere
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak_rss_kb //= 1024
+    with open(peak_rss_file, "w") as f:
+        f.write(str(peak_rss_kb))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark similarity/statistics stages of the workflow on synthetic data",
+        epilog="",
+    )
+    parser.add_argument(
+        "--report_json_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output .json file containing benchmark results",
+    )
+    parser.add_argument(
+        "--n_ligands",
+        type=int,
+        nargs="+",
+        default=[1_000, 5_000, 10_000],
+        help="Number(s) of synthetic ligands to benchmark with (default: %(default)s). Note the similarity matrix of N ligands takes N(N-1)/2 values of --similarity_dtype on disk",
+    )
+    parser.add_argument(
+        "--n_groups",
+        type=int,
+        default=10,
+        help="Number of protein groups (class_level=4) in the synthetic family tree (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_families_per_group",
+        type=int,
+        default=5,
+        help="Number of protein families (class_level=5) per group (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_targets",
+        type=int,
+        default=500,
+        help="Number of targets, each assigned to a random family (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_assays",
+        type=int,
+        default=2_000,
+        help="Number of assays, each against a random target (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=0.5,
+        help="Mean number of additional assays (Poisson) each ligand is active in, controls overlap between groups (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fp_size",
+        type=int,
+        default=2048,
+        help="Number of bits per synthetic fingerprint (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fp_density",
+        type=float,
+        default=0.002,
+        help="Fraction of random bits set in each synthetic fingerprint (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fp_scaffold_density",
+        type=float,
+        default=0.04,
+        help="Fraction of bits set in the scaffold fingerprint of each protein group (class_level=4), shared by the ligands of the group (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fp_scaffold_share_min",
+        type=float,
+        default=0.3,
+        help="Minimum fraction of the scaffold bits each ligand keeps, drawn from [fp_scaffold_share_min, 1] (skewed towards 1), so similarities within a group span the thresholds (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--similarity_backends",
+        type=str,
+        nargs="+",
+        choices=["rdkit", "numpy"],
+        default=["numpy"],
+        help="Backend(s) of calculate_fp_similarity.py to benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--similarity_dtype",
+        type=str,
+        choices=SIM_DTYPES,
+        default="float64",
+        help="Storage type of the similarity matrix (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tile_budget_mb",
+        type=int,
+        default=None,
+        help="(Optional) Passed to calculate_fp_similarity.py, needed when the similarity matrix does not fit in RAM",
+    )
+    parser.add_argument(
+        "--utest_methods",
+        type=str,
+        nargs="+",
+        choices=["counts", "scipy"],
+        default=["counts"],
+        help="Method(s) of mann_whitney_utest.py to benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes used by calculate_fp_similarity.py (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_repeats",
+        type=int,
+        default=1,
+        help="Number of times each stage is run per number of ligands (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--table_format",
+        type=str,
+        choices=TABLE_FORMATS,
+        default="tsv",
+        help="File format of synthetic/intermediate tables (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed of synthetic data (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=str,
+        default=None,
+        help="(Optional) Directory to save synthetic data and stage outputs to. If not given a temporary directory is used (and removed afterwards)",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def generate_family_tables(
+    n_groups: int,
+    n_families_per_group: int,
+    n_targets: int,
+    n_assays: int,
+    rng: np.random.Generator,
+) -> tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    Generate a protein family tree (root -> groups -> families), targets assigned
+    to random families and assays against random targets.
+
+    :return tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]: family details, targets and assays
+    """
+    group_ids = ROOT_CLASS_ID + 1 + np.arange(n_groups)
+    family_ids = group_ids[-1] + 1 + np.arange(n_groups * n_families_per_group)
+    class_ids = np.concatenate([[ROOT_CLASS_ID], group_ids, family_ids])
+    parent_ids = np.concatenate(
+        [
+            [0],
+            np.full(n_groups, ROOT_CLASS_ID),
+            np.repeat(group_ids, n_families_per_group),
+        ]
+    )
+    class_levels = np.concatenate(
+        [
+            [ROOT_CLASS_LEVEL],
+            np.full(n_groups, ROOT_CLASS_LEVEL + 1),
+            np.full(len(family_ids), ROOT_CLASS_LEVEL + 2),
+        ]
+    )
+    fam_df = pl.DataFrame(
+        {
+            "protein_class_id": class_ids,
+            "parent_id": parent_ids,
+            "short_name": [f"C{class_id}" for class_id in class_ids],
+            "class_level": class_levels,
+        }
+    )
+    target_df = pl.DataFrame(
+        {
+            "tid": np.arange(1, n_targets + 1),
+            "protein_class_id": rng.choice(family_ids, n_targets),
+        }
+    )
+    assay_df = pl.DataFrame(
+        {
+            "assay_id": np.arange(1, n_assays + 1),
+            "tid": rng.integers(1, n_targets + 1, n_assays),
+        }
+    )
+    return fam_df, target_df, assay_df
+
+
+def generate_activities(
+    n_ligands: int, n_assays: int, overlap: float, rng: np.random.Generator
+) -> pl.DataFrame:
+    """
+    Assign each ligand (molregno 1..n_ligands) to 1 + Poisson(overlap) random assays.
+    The first assay of each ligand is its "primary" assay (see get_scaffold_ids).
+    """
+    n_per_ligand = 1 + rng.poisson(overlap, n_ligands)
+    molregnos = np.repeat(np.arange(1, n_ligands + 1), n_per_ligand)
+    assay_ids = rng.integers(1, n_assays + 1, len(molregnos))
+    return pl.DataFrame({"molregno": molregnos, "assay_id": assay_ids})
+
+
+def get_scaffold_ids(
+    primary_assay_ids: np.ndarray,
+    fam_df: pl.DataFrame,
+    target_df: pl.DataFrame,
+    assay_df: pl.DataFrame,
+) -> tuple[np.ndarray, int]:
+    """
+    Get the scaffold of each ligand: the protein group (class_level=4) of the
+    target of its primary assay.
+
+    :return tuple[np.ndarray, int]: scaffold index of each ligand and number of scaffolds
+    """
+    group_ids = np.sort(
+        fam_df.filter(pl.col("class_level") == ROOT_CLASS_LEVEL + 1)[
+            "protein_class_id"
+        ].to_numpy()
+    )
+    assay2group_df = (
+        assay_df.join(target_df, on="tid")
+        .join(
+            fam_df.select(
+                pl.col("protein_class_id"), pl.col("parent_id").alias("group_id")
+            ),
+            on="protein_class_id",
+        )
+        .select("assay_id", "group_id")
+    )
+    ligand_group_ids = (
+        pl.DataFrame({"assay_id": primary_assay_ids})
+        .join(assay2group_df, on="assay_id", how="left", maintain_order="left")[
+            "group_id"
+        ]
+        .to_numpy()
+    )
+    return np.searchsorted(group_ids, ligand_group_ids), len(group_ids)
+
+
+def generate_fingerprints(
+    scaffold_ids: np.ndarray,
+    n_scaffolds: int,
+    fp_size: int,
+    fp_density: float,
+    fp_scaffold_density: float,
+    fp_scaffold_share_min: float,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    Generate packed fingerprints: random bits (fp_density) plus a random subset of
+    the bits of the ligand's scaffold. The share of scaffold bits kept varies per
+    ligand, so pairs of ligands of the same scaffold cover a wide range of similarities
+    while pairs of different scaffolds have similarities close to 0.
+    """
+    n_words = get_n_words(fp_size)
+    scaffolds = np.packbits(
+        rng.random((n_scaffolds, fp_size), dtype=np.float32) < fp_scaffold_density,
+        axis=1,
+        bitorder="little",
+    )
+    # skewed towards 1, so highly similar pairs are not too rare
+    shares = 1 - (1 - fp_scaffold_share_min) * rng.random(len(scaffold_ids)) ** 2
+    packed = np.zeros((len(scaffold_ids), n_words), dtype="<u8")
+    packed_bytes = packed.view(np.uint8)
+    # in chunks to limit memory used by the unpacked bits
+    chunk_size = 10_000
+    for i in range(0, len(scaffold_ids), chunk_size):
+        chunk_scaffold_ids = scaffold_ids[i : i + chunk_size]
+        shape = (len(chunk_scaffold_ids), fp_size)
+        random_bits = np.packbits(
+            rng.random(shape, dtype=np.float32) < fp_density, axis=1, bitorder="little"
+        )
+        share_mask = np.packbits(
+            rng.random(shape, dtype=np.float32)
+            < shares[i : i + chunk_size, None].astype(np.float32),
+            axis=1,
+            bitorder="little",
+        )
+        chunk_bytes = random_bits | (scaffolds[chunk_scaffold_ids] & share_mask)
+        packed_bytes[i : i + len(chunk_scaffold_ids), : chunk_bytes.shape[1]] = (
+            chunk_bytes
+        )
+    return packed
+
+
+def run_stage(cmd: list[str], log_path: str) -> dict:
+    """
+    Run a stage (script) as a subprocess and measure its resource usage.
+    CPU times include worker processes of the stage, the peak RSS only covers
+    the main process of the stage.
+
+    :param list[str] cmd: script to run followed by its arguments
+    :param str log_path: file stdout/stderr of the stage is written to
+    :return dict: exit code, wall-clock time of the process and of the stage itself (excluding interpreter
+        startup/imports), CPU times, peak RSS (MB) and phases (see utils/profiling.py) of the stage
+    """
+    peak_rss_file = log_path + ".peak_rss"
+    profile_json_file = os.path.splitext(log_path)[0] + ".profile.json"
+    cmd = cmd + ["--profile_json_file", profile_json_file]
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, "-c", STAGE_RUNNER, peak_rss_file, *cmd],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        _, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = time.perf_counter() - start
+    peak_rss_mb = None
+    if os.path.exists(peak_rss_file):
+        with open(peak_rss_file) as f:
+            peak_rss_mb = int(f.read()) / 1024
+        os.remove(peak_rss_file)
+    phases = None
+    stage_time = None
+    if os.path.exists(profile_json_file):
+        with open(profile_json_file) as f:
+            profile = json.load(f)
+        phases = profile["phases"]
+        stage_time = profile["total"]["wall_time_s"]
+        # phases reset the peak RSS of the process (VmHWM), total of the profile includes all phases
+        peak_rss_mb = profile["total"]["peak_rss_mb"]
+    return {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "wall_time_s": wall_time,
+        "stage_time_s": stage_time,
+        "user_time_s": rusage.ru_utime,
+        "sys_time_s": rusage.ru_stime,
+        "peak_rss_mb": peak_rss_mb,
+        "phases": phases,
+    }
+
+
+def get_git_commit() -> str:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment_info() -> dict:
+    return {
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "polars": pl.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_synthetic_data(
+    data_dir: str, n_ligands: int, args: argparse.Namespace
+) -> dict[str, str]:
+    """
+    Generate and save synthetic inputs for n_ligands ligands.
+
+    :return dict[str, str]: paths of the saved files
+    """
+    rng = np.random.default_rng([args.seed, n_ligands])
+    fam_df, target_df, assay_df = generate_family_tables(
+        args.n_groups, args.n_families_per_group, args.n_targets, args.n_assays, rng
+    )
+    activity_df = generate_activities(n_ligands, args.n_assays, args.overlap, rng)
+    primary_assay_ids = (
+        activity_df.group_by("molregno", maintain_order=True)
+        .first()
+        .sort("molregno")["assay_id"]
+        .to_numpy()
+    )
+    scaffold_ids, n_scaffolds = get_scaffold_ids(
+        primary_assay_ids, fam_df, target_df, assay_df
+    )
+    packed = generate_fingerprints(
+        scaffold_ids,
+        n_scaffolds,
+        args.fp_size,
+        args.fp_density,
+        args.fp_scaffold_density,
+        args.fp_scaffold_share_min,
+        rng,
+    )
+    ext = args.table_format
+    paths = {
+        "family_details_tsv_file": os.path.join(data_dir, f"family_addl_info.{ext}"),
+        "target_tsv_file": os.path.join(data_dir, f"target_info.{ext}"),
+        "assay_tsv_file": os.path.join(data_dir, f"assay_info.{ext}"),
+        "activities_tsv_file": os.path.join(data_dir, f"activity_info.{ext}"),
+        "fingerprints_npy_file": os.path.join(data_dir, "fingerprints.npy"),
+        "fingerprint_ids_npy_file": os.path.join(data_dir, "fingerprint_ids.npy"),
+    }
+    write_table(fam_df, paths["family_details_tsv_file"])
+    write_table(target_df, paths["target_tsv_file"])
+    write_table(assay_df, paths["assay_tsv_file"])
+    write_table(activity_df, paths["activities_tsv_file"])
+    save_packed_fps(
+        paths["fingerprints_npy_file"],
+        paths["fingerprint_ids_npy_file"],
+        np.arange(1, n_ligands + 1),
+        packed,
+    )
+    return paths
+
+
+def get_stage_commands(
+    paths: dict[str, str], out_dir: str, args: argparse.Namespace
+) -> list[tuple[str, str, list[str]]]:
+    """
+    Get the commands of all stages to benchmark, in the order they need to be run.
+
+    :return list[tuple[str, str, list[str]]]: (stage, variant, command) of each run
+    """
+    similarity_npy_file = os.path.join(out_dir, "similarity.npy")
+    similarity_id_pkl_file = os.path.join(out_dir, "similarity_ids.pkl")
+    cluster_dir = os.path.join(out_dir, "family_clusters")
+    cluster2sim_dir = os.path.join(out_dir, "cluster2sim")
+    class_level_args = [
+        "--min_class_level",
+        str(ROOT_CLASS_LEVEL + 1),
+        "--max_class_level",
+        str(ROOT_CLASS_LEVEL + 2),
+    ]
+    commands = []
+    for backend in args.similarity_backends:
+        cmd = [
+            os.path.join(SRC_DIR, "calculate_fp_similarity.py"),
+            "--fingerprints_npy_file",
+            paths["fingerprints_npy_file"],
+            "--fingerprint_ids_npy_file",
+            paths["fingerprint_ids_npy_file"],
+            "--similarity_npy_file",
+            similarity_npy_file,
+            "--similarity_id_pkl_file",
+            similarity_id_pkl_file,
+            "--max_n_compounds",
+            str(max(args.n_ligands) + 1),
+            "--backend",
+            backend,
+            "--similarity_dtype",
+            args.similarity_dtype,
+            "--n_jobs",
+            str(args.n_jobs),
+        ]
+        if args.tile_budget_mb is not None:
+            cmd += ["--tile_budget_mb", str(args.tile_budget_mb)]
+        commands.append(("calculate_fp_similarity", backend, cmd))
+    cmd = [
+        os.path.join(SRC_DIR, "assign_family_clusters.py"),
+        "--activities_tsv_file",
+        paths["activities_tsv_file"],
+        "--assay_tsv_file",
+        paths["assay_tsv_file"],
+        "--target_tsv_file",
+        paths["target_tsv_file"],
+        "--family_details_tsv_file",
+        paths["family_details_tsv_file"],
+        "--cluster_dir",
+        cluster_dir,
+        "--table_format",
+        args.table_format,
+    ]
+    commands.append(("assign_family_clusters", "", cmd + class_level_args))
+    cmd = [
+        os.path.join(SRC_DIR, "gather_similarity_values.py"),
+        "--similarity_npy_file",
+        similarity_npy_file,
+        "--similarity_id_pkl_file",
+        similarity_id_pkl_file,
+        "--cluster_dir",
+        cluster_dir,
+        "--cluster2sim_dir",
+        cluster2sim_dir,
+        "--per_target",
+        "--per_assay",
+    ]
+    commands.append(("gather_similarity_values", "", cmd + class_level_args))
+    cmd = [
+        os.path.join(SRC_DIR, "probability_analysis.py"),
+        "--similarity_npy_file",
+        similarity_npy_file,
+        "--similarity_id_pkl_file",
+        similarity_id_pkl_file,
+        "--cluster_dir",
+        cluster_dir,
+        "--prob_analysis_dir",
+        os.path.join(out_dir, "cluster_stats"),
+        "--per_target",
+        "--per_assay",
+        "--similarity_threshold_min",
+        str(SIMILARITY_THRESHOLD_MIN),
+        "--similarity_threshold_max",
+        "0.9",
+        "--similarity_threshold_N",
+        "8",
+        "--table_format",
+        args.table_format,
+    ]
+    commands.append(("probability_analysis", "", cmd + class_level_args))
+    for utest_method in args.utest_methods:
+        cmd = [
+            os.path.join(SRC_DIR, "mann_whitney_utest.py"),
+            "--similarity_npy_file",
+            similarity_npy_file,
+            "--similarity_id_pkl_file",
+            similarity_id_pkl_file,
+            "--cluster2sim_dir",
+            cluster2sim_dir,
+            "--cluster_dir",
+            cluster_dir,
+            "--family_details_tsv_file",
+            paths["family_details_tsv_file"],
+            "--mann_whitney_utest_dir",
+            os.path.join(out_dir, f"mann_whitney_utest_{utest_method}"),
+            "--utest_method",
+            utest_method,
+            "--table_format",
+            args.table_format,
+        ]
+        commands.append(("mann_whitney_utest", utest_method, cmd + class_level_args))
+    return commands
+
+
+def get_fraction_above(
+    similarity_npy_file: str, threshold: float, chunk_size: int = 10_000_000
+) -> float:
+    # fraction of all pairs with a similarity > threshold
+    sim_matrix = load_sim_matrix(similarity_npy_file, mmap_mode="r")
+    n_above = 0
+    for i in range(0, len(sim_matrix), chunk_size):
+        values = dequantize_sim_values(np.asarray(sim_matrix[i : i + chunk_size]))
+        n_above += int(np.count_nonzero(values > threshold))
+    return n_above / max(len(sim_matrix), 1)
+
+
+def get_dataset_info(out_dir: str, n_ligands: int) -> dict:
+    # size of the synthetic dataset (as seen by the stages)
+    id_list = load_from_pkl(os.path.join(out_dir, "similarity_ids.pkl"))
+    fraction_above = get_fraction_above(
+        os.path.join(out_dir, "similarity.npy"), SIMILARITY_THRESHOLD_MIN
+    )
+    # otherwise probability_analysis.py only benchmarks empty results
+    assert (
+        fraction_above > 0
+    ), f"No pairs with similarity > {SIMILARITY_THRESHOLD_MIN}, increase --fp_scaffold_density"
+    info = {
+        "n_ligands": n_ligands,
+        "n_pairs": get_triangle_number(len(id_list)),
+        "fraction_above_threshold_min": fraction_above,
+    }
+    cluster_dir = os.path.join(out_dir, "family_clusters")
+    for grouping in [f"class_level={ROOT_CLASS_LEVEL + 1}", "tid", "assay_id"]:
+        membership, group_ids = load_membership(
+            get_membership_fpath(cluster_dir, grouping)
+        )
+        sizes = np.diff(membership.tocsc().indptr)
+        info[grouping] = {
+            "n_groups": len(group_ids),
+            "n_memberships": int(membership.nnz),
+            "n_within_group_pairs": int((sizes * (sizes - 1) // 2).sum()),
+        }
+    return info
+
+
+def main():
+    args = parse_args()
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="laa_benchmark_")
+    report = {
+        "config": vars(args),
+        "environment": get_environment_info(),
+        "datasets": [],
+        "results": [],
+    }
+    try:
+        for n_ligands in args.n_ligands:
+            data_dir = os.path.join(work_dir, f"n_ligands={n_ligands}")
+            print(f"Generating synthetic data for {n_ligands} ligands...")
+            paths = write_synthetic_data(data_dir, n_ligands, args)
+            for repeat in range(args.n_repeats):
+                out_dir = os.path.join(data_dir, f"repeat={repeat}")
+                log_dir = os.path.join(out_dir, "logs")
+                os.makedirs(log_dir, exist_ok=True)
+                for stage, variant, cmd in get_stage_commands(paths, out_dir, args):
+                    name = f"{stage}-{variant}" if variant else stage
+                    result = run_stage(cmd, os.path.join(log_dir, f"{name}.log"))
+                    result = {
+                        "stage": stage,
+                        "variant": variant,
+                        "n_ligands": n_ligands,
+                        "repeat": repeat,
+                        **result,
+                    }
+                    report["results"].append(result)
+                    # later stages depend on the outputs of earlier ones
+                    assert (
+                        result["exit_code"] == 0
+                    ), f"{name} failed, see {os.path.join(log_dir, f'{name}.log')}"
+                    peak_rss_mb = result["peak_rss_mb"]
+                    peak_rss = "n/a" if peak_rss_mb is None else f"{peak_rss_mb:.1f} MB"
+                    print(
+                        f"N={n_ligands} repeat={repeat} {name}: "
+                        f"{result['stage_time_s']:.3f}s (process: {result['wall_time_s']:.2f}s), {peak_rss}"
+                    )
+            dataset_info = get_dataset_info(out_dir, n_ligands)
+            report["datasets"].append(dataset_info)
+            print(
+                f"N={n_ligands}: {dataset_info['fraction_above_threshold_min']:.2%} "
+                f"of pairs with similarity > {SIMILARITY_THRESHOLD_MIN}"
+            )
+            # keep at most one similarity matrix on disk at a time
+            if args.work_dir is None:
+                shutil.rmtree(data_dir)
+    finally:
+        os.makedirs(
+            os.path.dirname(os.path.abspath(args.report_json_file)), exist_ok=True
+        )
+        with open(args.report_json_file, "w") as f:
+            json.dump(report, f, indent=2)
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # in-process timings of each phase, process wall time is dominated by startup for small N
+    phase_df = (
+        pl.DataFrame(
+            [
+                {
+                    "stage": result["stage"],
+                    "variant": result["variant"],
+                    "n_ligands": result["n_ligands"],
+                    "phase": phase["name"],
+                    "wall_time_s": phase["wall_time_s"],
+                    "peak_rss_mb": phase["peak_rss_mb"],
+                }
+                for result in report["results"]
+                for phase in [
+                    {
+                        "name": "total",
+                        "wall_time_s": result["stage_time_s"],
+                        "peak_rss_mb": result["peak_rss_mb"],
+                    }
+                ]
+                + result["phases"]
+            ]
+        )
+        .group_by(["stage", "variant", "n_ligands", "phase"], maintain_order=True)
+        .agg(
+            pl.col("wall_time_s").median(),
+            pl.col("peak_rss_mb").max(),
+        )
+    )
+    with pl.Config(tbl_rows=-1, tbl_width_chars=160, fmt_str_lengths=40):
+        print(phase_df)
+    print(f"Saved benchmark report to: {args.report_json_file}")
+
+
+if __name__ == "__main__":
+    main()
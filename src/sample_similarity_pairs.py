@@ -0,0 +1,175 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Approximate alternative to calculate_fp_similarity.py + gather_similarity_values.py
+for very large sets of ligands: compute the similarity of random pairs of
+ligands only. Draws uniformly random pairs from all ligand pairs (global sample)
+and from the pairs within each cluster/target/assay (stratified sample), so the
+cost is O(sample size) instead of O(N^2). The samples can be used by
+probability_analysis.py and mann_whitney_utest.py (--similarity_sample_dir).
+"""
+
+import argparse
+import os
+
+import numpy as np
+from scipy.sparse import csr_array
+
+from utils.args import add_grouping_args, add_profiling_args, get_groupings
+from utils.constants import get_group_sample_fpath, get_membership_fpath
+from utils.fingerprints import get_popcounts, load_packed_fps, pairwise_tanimoto_packed
+from utils.ltm import get_triangle_number
+from utils.membership import get_group_members, load_membership
+from utils.pair_sample import sample_pairs, save_global_sample
+from utils.profiling import StageProfiler
+from utils.ragged import create_group_values
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compute similarity values of random pairs of ligands, globally and within each cluster/target/assay",
+        epilog="",
+    )
+    parser.add_argument(
+        "--fingerprints_npy_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input .npy file containing packed fingerprints (created by generate_fingerprints.py)",
+    )
+    parser.add_argument(
+        "--fingerprint_ids_npy_file",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input .npy file containing compound IDs (in order used by fingerprints_npy_file)",
+    )
+    parser.add_argument(
+        "--cluster_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Input directory where clustered ligands and targets were saved to by assign_family_clusters.py",
+    )
+    parser.add_argument(
+        "--similarity_sample_dir",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="Output directory of sampled pairs and their similarity values",
+    )
+    add_grouping_args(parser, "sample pairs within")
+    parser.add_argument(
+        "--n_global_pairs",
+        type=int,
+        default=1_000_000,
+        help="Number of pairs sampled from all ligand pairs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--n_group_pairs",
+        type=int,
+        default=10_000,
+        help="Maximum number of pairs sampled within each group, all pairs are used for smaller groups (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=1_000_000,
+        help="Number of sampled pairs (of multiple groups) whose similarity is computed in one batch (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed (default: %(default)s)",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def sample_group_similarity_values(
+    membership: csr_array,
+    group_ids: np.ndarray,
+    packed: np.ndarray,
+    counts: np.ndarray,
+    n_group_pairs: int,
+    save_path: str,
+    rng: np.random.Generator,
+    chunk_size: int,
+) -> int:
+    """
+    Sample (up to n_group_pairs) pairs within each group and save their similarity
+    values as a ragged array. Returns the number of sampled pairs.
+    """
+    group_members = get_group_members(membership)
+    sizes = [
+        min(get_triangle_number(len(idx_array)), n_group_pairs)
+        for idx_array in group_members
+    ]
+    group_values = create_group_values(save_path, group_ids, sizes)
+    # group_ids are sorted, so values of consecutive groups are contiguous in flat_values.
+    # pairs of multiple groups are buffered, so similarity is computed in large batches
+    buffer_rows, buffer_cols, n_buffered = [], [], 0
+    start = 0
+    for i, idx_array in enumerate(group_members):
+        rows, cols = sample_pairs(len(idx_array), n_group_pairs, rng)
+        buffer_rows.append(idx_array[rows])
+        buffer_cols.append(idx_array[cols])
+        n_buffered += len(rows)
+        if n_buffered >= chunk_size or i == len(group_members) - 1:
+            values = pairwise_tanimoto_packed(
+                packed, np.concatenate(buffer_rows), np.concatenate(buffer_cols), counts
+            )
+            group_values.flat_values[start : start + n_buffered] = values
+            start += n_buffered
+            buffer_rows, buffer_cols, n_buffered = [], [], 0
+    group_values.flush()
+    return start
+
+
+def main():
+    args = parse_args()
+    with StageProfiler(
+        "sample_similarity_pairs", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        rng = np.random.default_rng(args.seed)
+        with profiler.phase("load_fingerprints", unit="fingerprints"):
+            ids, packed = load_packed_fps(
+                args.fingerprints_npy_file, args.fingerprint_ids_npy_file
+            )
+            ids = np.asarray(ids, dtype=np.int64)
+            packed = np.ascontiguousarray(packed)
+            counts = get_popcounts(packed)
+            N = len(ids)
+            profiler.add_items(N)
+
+        os.makedirs(args.similarity_sample_dir, exist_ok=True)
+        with profiler.phase("global", unit="pairs"):
+            rows, cols = sample_pairs(N, args.n_global_pairs, rng)
+            values = pairwise_tanimoto_packed(packed, rows, cols, counts)
+            save_global_sample(args.similarity_sample_dir, ids, rows, cols, values)
+            profiler.add_items(len(values))
+        print(f"Sampled {len(values)} of {get_triangle_number(N)} pairs of {N} ligands")
+
+        for grouping, _, _ in get_groupings(args):
+            with profiler.phase(grouping, unit="pairs"):
+                membership, group_ids = load_membership(
+                    get_membership_fpath(args.cluster_dir, grouping), ids
+                )
+                n_sampled = sample_group_similarity_values(
+                    membership,
+                    group_ids,
+                    packed,
+                    counts,
+                    args.n_group_pairs,
+                    get_group_sample_fpath(args.similarity_sample_dir, grouping),
+                    rng,
+                    args.chunk_size,
+                )
+                profiler.add_items(n_sampled)
+
+
+if __name__ == "__main__":
+    main()
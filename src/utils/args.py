@@ -7,6 +7,8 @@ Shared arguments.
 
 import argparse
 
+from utils.tables import TABLE_FORMATS
+
 
 def add_chembl_db_args(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
@@ -43,3 +45,107 @@ def add_chembl_db_args(parser: argparse.ArgumentParser) -> None:
         required=False,
         help="Database port",
     )
+
+
+def add_batch_size_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10_000,
+        help="Number of rows fetched from the DB (server-side cursor) and written to the output at a time (default: %(default)s)",
+    )
+
+
+def add_query_cache_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--query_cache_dir",
+        type=str,
+        default=None,
+        help="(Optional) Directory of local query-result cache (Parquet), keyed by query + parameters + ChEMBL version",
+    )
+    parser.add_argument(
+        "--query_cache_max_mb",
+        type=float,
+        default=None,
+        help="(Optional) Maximum size of query cache in MB, least-recently-used entries are evicted beyond this",
+    )
+
+
+def add_table_format_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--table_format",
+        type=str,
+        choices=TABLE_FORMATS,
+        default="tsv",
+        help="Format of the tables in cluster_dir and of other tables created by this script (default: %(default)s)",
+    )
+
+
+def add_grouping_args(parser: argparse.ArgumentParser, purpose: str) -> None:
+    """
+    Add the arguments selecting the groupings of ligands (clusters of each class_level,
+    targets and assays) a script is run for, see get_groupings.
+
+    :param argparse.ArgumentParser parser: parser to add the arguments to
+    :param str purpose: what the script does per group, used in the help (e.g., "test")
+    """
+    parser.add_argument(
+        "--min_class_level",
+        type=int,
+        required=True,
+        default=argparse.SUPPRESS,
+        help=f"Minimum class_level of the clusters to {purpose} (inclusive)",
+    )
+    parser.add_argument(
+        "--max_class_level",
+        type=int,
+        required=True,
+        default=argparse.SUPPRESS,
+        help=f"Maximum class_level of the clusters to {purpose} (inclusive)",
+    )
+    parser.add_argument(
+        "--per_target",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=f"Also {purpose} each TID (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--per_assay",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=f"Also {purpose} each ASSAY_ID (default: %(default)s)",
+    )
+
+
+def get_groupings(args: argparse.Namespace) -> list[tuple[str, str, str]]:
+    """
+    Get the groupings selected by the arguments of add_grouping_args.
+
+    :param argparse.Namespace args: parsed arguments
+    :return list[tuple[str, str, str]]: (grouping, group column, save name) of each grouping,
+        e.g., ("class_level=4", "cluster", "class_level=4") or ("tid", "tid", "per_target")
+    """
+    groupings = [
+        (f"class_level={cl}", "cluster", f"class_level={cl}")
+        for cl in range(args.min_class_level, args.max_class_level + 1)
+    ]
+    if args.per_target:
+        groupings.append(("tid", "tid", "per_target"))
+    if args.per_assay:
+        groupings.append(("assay_id", "assay_id", "per_assay"))
+    return groupings
+
+
+def add_profiling_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile_json_file",
+        type=str,
+        default=None,
+        help="(Optional) Output .json file of the timings, peak memory, I/O and throughput of each phase of this script",
+    )
+    parser.add_argument(
+        "--cprofile_file",
+        type=str,
+        default=None,
+        help="(Optional) Output cProfile dump (pstats format, e.g. for snakeviz) of this script. For sampling without overhead run the script with py-spy instead",
+    )
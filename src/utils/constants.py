@@ -9,21 +9,66 @@ locations in the project.
 import os
 
 
-def get_ligand2cluster_fpath(cluster_dir: str, class_level: int) -> str:
-    return os.path.join(cluster_dir, f"ligand2cluster-class_level={class_level}.tsv")
+def get_ligand2cluster_fpath(
+    cluster_dir: str, class_level: int, table_format: str = "tsv"
+) -> str:
+    return os.path.join(
+        cluster_dir, f"ligand2cluster-class_level={class_level}.{table_format}"
+    )
 
 
-def get_target2cluster_fpath(cluster_dir: str, class_level: str) -> str:
-    return os.path.join(cluster_dir, f"target2cluster-class_level={class_level}.tsv")
+def get_target2cluster_fpath(
+    cluster_dir: str, class_level: str, table_format: str = "tsv"
+) -> str:
+    return os.path.join(
+        cluster_dir, f"target2cluster-class_level={class_level}.{table_format}"
+    )
+
+
+def get_membership_fpath(cluster_dir: str, grouping: str) -> str:
+    # grouping is e.g., "class_level=4", "tid" or "assay_id"
+    return os.path.join(cluster_dir, f"membership-{grouping}.npz")
 
 
 def get_cluster2sim_fpath(cluster2sim_dir: str, class_level: str) -> str:
-    return os.path.join(cluster2sim_dir, f"cluster2sim_class_level={class_level}.pkl")
+    return os.path.join(cluster2sim_dir, f"cluster2sim_class_level={class_level}")
 
 
 def get_tid2sim_fpath(cluster2sim_dir: str):
-    return os.path.join(cluster2sim_dir, f"tid2sim.pkl")
+    return os.path.join(cluster2sim_dir, "tid2sim")
 
 
 def get_assay2sim_fpath(cluster2sim_dir: str):
-    return os.path.join(cluster2sim_dir, f"assay2sim.pkl")
+    return os.path.join(cluster2sim_dir, "assay2sim")
+
+
+def get_group_values_fpath(cluster2sim_dir: str, grouping: str) -> str:
+    # grouping is e.g., "class_level=4", "tid" or "assay_id"
+    if grouping == "tid":
+        return get_tid2sim_fpath(cluster2sim_dir)
+    if grouping == "assay_id":
+        return get_assay2sim_fpath(cluster2sim_dir)
+    return get_cluster2sim_fpath(cluster2sim_dir, grouping.removeprefix("class_level="))
+
+
+def get_sample_ids_fpath(similarity_sample_dir: str) -> str:
+    return os.path.join(similarity_sample_dir, "ids.npy")
+
+
+def get_global_sample_fpath(similarity_sample_dir: str) -> str:
+    return os.path.join(similarity_sample_dir, "global_pairs.npz")
+
+
+def get_group_sample_fpath(similarity_sample_dir: str, grouping: str) -> str:
+    # grouping is e.g., "class_level=4", "tid" or "assay_id"
+    return os.path.join(similarity_sample_dir, f"group_pairs-{grouping}")
+
+
+def get_stats_fpath(stats_dir: str, grouping: str, table_format: str = "tsv") -> str:
+    # grouping is e.g., "all" (whole LTM), "class_level=4", "tid" or "assay_id"
+    return os.path.join(stats_dir, f"similarity_stats-{grouping}.{table_format}")
+
+
+def get_histogram_fpath(histogram_dir: str, grouping: str) -> str:
+    # grouping is e.g., "all" (whole LTM), "class_level=4", "tid" or "assay_id"
+    return os.path.join(histogram_dir, f"histograms-{grouping}.npz")
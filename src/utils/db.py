@@ -0,0 +1,143 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Shared utilities for querying the ChEMBL DB.
+"""
+
+import csv
+import os
+from typing import Callable, Optional
+
+import polars as pl
+import pyarrow.parquet as pq
+from psycopg2 import sql
+from psycopg2.extensions import connection as Connection
+from psycopg2.extensions import cursor as TupleCursor
+
+from utils.tables import get_table_format
+
+# PostgreSQL type OIDs -> polars dtypes of Parquet columns (other types stored as strings)
+PG_TYPE_TO_DTYPE = {
+    16: pl.Boolean,  # bool
+    20: pl.Int64,  # int8
+    21: pl.Int64,  # int2
+    23: pl.Int64,  # int4
+    700: pl.Float64,  # float4
+    701: pl.Float64,  # float8
+    1700: pl.Float64,  # numeric
+}
+
+
+def stream_query_to_tsv(
+    connection: Connection,
+    query: sql.Composable,
+    fpath: str,
+    header: list[str],
+    batch_size: int = 10_000,
+    on_batch: Optional[Callable[[list[tuple]], None]] = None,
+) -> int:
+    """
+    Run query using a named (server-side) cursor and write the result to a TSV file
+    batch_size rows at a time, so memory use does not depend on the number of rows.
+    Output is the same as write_to_tsv on the full result.
+
+    :param Connection connection: DB connection
+    :param sql.Composable query: query to run
+    :param str fpath: output TSV file
+    :param list[str] header: column names
+    :param int batch_size: number of rows fetched per round trip
+    :param Callable on_batch: (Optional) called with each batch of rows (e.g., to collect IDs)
+    :return int: number of rows written
+    """
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    n_rows = 0
+    # plain tuple rows (no DictRow construction)
+    with connection.cursor(name="stream_query", cursor_factory=TupleCursor) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query)
+        with open(fpath, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(header)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                writer.writerows(rows)
+                n_rows += len(rows)
+                if on_batch is not None:
+                    on_batch(rows)
+    return n_rows
+
+
+def get_parquet_schema(description, header: list[str]) -> dict:
+    if description is None:
+        return {col: pl.String for col in header}
+    return {
+        col: PG_TYPE_TO_DTYPE.get(column.type_code, pl.String)
+        for col, column in zip(header, description)
+    }
+
+
+def stream_query_to_parquet(
+    connection: Connection,
+    query: sql.Composable,
+    fpath: str,
+    header: list[str],
+    batch_size: int = 10_000,
+    on_batch: Optional[Callable[[list[tuple]], None]] = None,
+) -> int:
+    """
+    Same as stream_query_to_tsv, but the result is written to a Parquet file
+    (one row group per batch of rows). Column types are derived from the DB column types.
+    """
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    n_rows = 0
+    writer = None
+    with connection.cursor(name="stream_query", cursor_factory=TupleCursor) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            # description of named cursors is only available after the first fetch
+            if writer is None:
+                schema = get_parquet_schema(cursor.description, header)
+                writer = pq.ParquetWriter(
+                    fpath, pl.DataFrame(schema=schema).to_arrow().schema
+                )
+            if len(rows) == 0:
+                break
+            batch_df = pl.DataFrame(rows, schema=schema, orient="row", strict=False)
+            writer.write_table(batch_df.to_arrow())
+            n_rows += len(rows)
+            if on_batch is not None:
+                on_batch(rows)
+    writer.close()
+    return n_rows
+
+
+def stream_query_to_file(
+    connection: Connection,
+    query: sql.Composable,
+    fpath: str,
+    header: list[str],
+    batch_size: int = 10_000,
+    on_batch: Optional[Callable[[list[tuple]], None]] = None,
+) -> int:
+    # TSV or Parquet depending on file extension
+    if get_table_format(fpath) == "parquet":
+        return stream_query_to_parquet(
+            connection, query, fpath, header, batch_size, on_batch
+        )
+    return stream_query_to_tsv(connection, query, fpath, header, batch_size, on_batch)
+
+
+def get_int_array_literal(ids: list[int]) -> sql.Composed:
+    """
+    Get a list of IDs as a single int[] constant (e.g., '{1,2,3}'::int[]) to be used
+    with "col = ANY(...)". Compared to "col IN (1, 2, 3)" this keeps the query text
+    compact and cheap to parse for long lists, and lets the planner use an index scan.
+    """
+    # sorted so the same set of IDs always gives the same query text
+    array_str = "{" + ",".join(str(x) for x in sorted(set(int(x) for x in ids))) + "}"
+    return sql.SQL("{}::int[]").format(sql.Literal(array_str))
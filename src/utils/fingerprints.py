@@ -0,0 +1,149 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Helper functions for working with fingerprints stored as packed
+bits (uint64 words) in numpy arrays.
+Bit i of a fingerprint is stored in word i // 64 at bit position i % 64.
+"""
+
+import os
+
+import numpy as np
+from rdkit import DataStructs
+
+
+def get_n_words(n_bits: int) -> int:
+    return (n_bits + 63) // 64
+
+
+def fps_to_packed_array(fingerprints: list) -> np.ndarray:
+    """
+    Convert RDKit ExplicitBitVects to a packed (N, n_bits/64) uint64 array.
+
+    :param list fingerprints: RDKit ExplicitBitVects (all of same length)
+    :return np.ndarray: packed fingerprints
+    """
+    n_bits = fingerprints[0].GetNumBits() if len(fingerprints) > 0 else 0
+    n_words = get_n_words(n_bits)
+    packed = np.zeros((len(fingerprints), n_words), dtype="<u8")
+    bits = np.zeros(n_bits, dtype=np.uint8)
+    packed_bytes = packed.view(np.uint8)
+    for i, fp in enumerate(fingerprints):
+        DataStructs.ConvertToNumpyArray(fp, bits)
+        row_bytes = np.packbits(bits, bitorder="little")
+        packed_bytes[i, : len(row_bytes)] = row_bytes
+    return packed
+
+
+def get_popcounts(packed: np.ndarray) -> np.ndarray:
+    return np.bitwise_count(packed).sum(axis=1, dtype=np.int64)
+
+
+def bulk_tanimoto_packed(
+    query: np.ndarray,
+    packed: np.ndarray,
+    query_count: int,
+    counts: np.ndarray,
+) -> np.ndarray:
+    """
+    Packed-bit equivalent of DataStructs.BulkTanimotoSimilarity.
+    Returns the same float64 values as RDKit (0.0 when neither fingerprint has bits set).
+
+    :param np.ndarray query: packed query fingerprint, shape (n_words,)
+    :param np.ndarray packed: packed fingerprints to compare against, shape (M, n_words)
+    :param int query_count: number of bits set in query
+    :param np.ndarray counts: number of bits set in each row of packed
+    :return np.ndarray: Tanimoto coeffs, shape (M,)
+    """
+    common = np.bitwise_count(packed & query).sum(axis=1, dtype=np.int64)
+    denom = query_count + counts - common
+    sims = np.zeros(len(packed), dtype=np.float64)
+    np.divide(common, denom, out=sims, where=denom > 0)
+    return sims
+
+
+def pairwise_tanimoto_packed(
+    packed: np.ndarray,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    counts: np.ndarray,
+    chunk_size: int = 100_000,
+) -> np.ndarray:
+    """
+    Tanimoto coeffs of the given pairs of fingerprints (same values as bulk_tanimoto_packed).
+
+    :param np.ndarray packed: packed fingerprints, shape (N, n_words)
+    :param np.ndarray rows: index (in packed) of the first fingerprint of each pair
+    :param np.ndarray cols: index (in packed) of the second fingerprint of each pair
+    :param np.ndarray counts: number of bits set in each row of packed
+    :param int chunk_size: number of pairs to process at once (limits memory use)
+    :return np.ndarray: Tanimoto coeffs, shape (len(rows),)
+    """
+    sims = np.zeros(len(rows), dtype=np.float64)
+    for i in range(0, len(rows), chunk_size):
+        r = rows[i : i + chunk_size]
+        c = cols[i : i + chunk_size]
+        common = np.bitwise_count(packed[r] & packed[c]).sum(axis=1, dtype=np.int64)
+        denom = counts[r] + counts[c] - common
+        np.divide(common, denom, out=sims[i : i + chunk_size], where=denom > 0)
+    return sims
+
+
+def packed_array_to_fps(packed: np.ndarray, n_bits: int = None) -> list:
+    """
+    Convert a packed (N, n_bits/64) uint64 array back to RDKit ExplicitBitVects.
+
+    :param np.ndarray packed: packed fingerprints
+    :param int n_bits: number of bits per fingerprint (default: 64 * n_words)
+    :return list: RDKit ExplicitBitVects
+    """
+    n_bits = packed.shape[1] * 64 if n_bits is None else n_bits
+    fingerprints = []
+    for row in packed:
+        row_bytes = np.ascontiguousarray(row, dtype="<u8").view(np.uint8)
+        bits = np.unpackbits(row_bytes, count=n_bits, bitorder="little")
+        fp = DataStructs.ExplicitBitVect(n_bits)
+        fp.SetBitsFromList(np.flatnonzero(bits).tolist())
+        fingerprints.append(fp)
+    return fingerprints
+
+
+def save_packed_fps(
+    fingerprints_npy_file: str,
+    fingerprint_ids_npy_file: str,
+    ids: np.ndarray,
+    packed: np.ndarray,
+) -> None:
+    """
+    Save packed fingerprints + compound IDs (sorted by ID) to two .npy files.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    for fpath in [fingerprints_npy_file, fingerprint_ids_npy_file]:
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    np.save(fingerprints_npy_file, np.ascontiguousarray(packed[order], dtype="<u8"))
+    np.save(fingerprint_ids_npy_file, ids[order])
+
+
+def load_packed_fps(
+    fingerprints_npy_file: str,
+    fingerprint_ids_npy_file: str,
+    mmap_mode: str = "r",
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Load packed fingerprints saved by save_packed_fps.
+
+    :return tuple[np.ndarray, np.ndarray]: (sorted compound IDs, packed fingerprints)
+    """
+    ids = np.load(fingerprint_ids_npy_file, mmap_mode=mmap_mode)
+    packed = np.load(fingerprints_npy_file, mmap_mode=mmap_mode)
+    assert len(ids) == len(
+        packed
+    ), f"Mismatch between number of IDs ({len(ids)}) and fingerprints ({len(packed)})"
+    return ids, packed
+
+
+def packed_fps_to_dict(ids: np.ndarray, packed: np.ndarray) -> dict:
+    # same format as the .pkl file created by generate_fingerprints.py
+    return dict(zip(ids.tolist(), packed_array_to_fps(packed)))
@@ -0,0 +1,101 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Persistent on-disk cache of packed fingerprints, shared across runs/data subdirs.
+Compounds are keyed by the SHA-1 digest of their canonical SMILES. Each generator
+configuration (radius, fpSize) gets its own subdir of shards, each run adding
+(at most) one new shard with the fingerprints it had to compute. Shards are
+evicted least-recently-used first once the cache exceeds the given size.
+"""
+
+import glob
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from utils.fingerprints import get_n_words
+
+KEY_DTYPE = "S20"
+
+
+def get_cache_subdir(cache_dir: str, radius: int, fp_size: int) -> str:
+    return os.path.join(cache_dir, f"morgan_radius{radius}_fpsize{fp_size}")
+
+
+def smiles_to_keys(smiles_list: list[str]) -> np.ndarray:
+    return np.array(
+        [hashlib.sha1(smiles.encode()).digest() for smiles in smiles_list],
+        dtype=KEY_DTYPE,
+    )
+
+
+def get_shard_paths(cache_subdir: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(cache_subdir, "shard_*.npz")))
+
+
+def lookup_cached_fps(
+    cache_subdir: str, keys: np.ndarray, fp_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Look up fingerprints of the given keys in the cache.
+
+    :param str cache_subdir: cache subdir (see get_cache_subdir)
+    :param np.ndarray keys: compound keys (see smiles_to_keys)
+    :param int fp_size: number of bits per fingerprint
+    :return tuple[np.ndarray, np.ndarray]: packed fingerprints (zeros where not found)
+        and boolean mask of the keys that were found
+    """
+    packed = np.zeros((len(keys), get_n_words(fp_size)), dtype="<u8")
+    found = np.zeros(len(keys), dtype=bool)
+    for shard_path in get_shard_paths(cache_subdir):
+        if found.all():
+            break
+        with np.load(shard_path) as shard:
+            shard_keys = shard["keys"]
+            pos = np.minimum(np.searchsorted(shard_keys, keys), len(shard_keys) - 1)
+            is_hit = ~found & (shard_keys[pos] == keys)
+            if is_hit.any():
+                packed[is_hit] = shard["fps"][pos[is_hit]]
+                found |= is_hit
+                # mark shard as recently used (for eviction)
+                os.utime(shard_path)
+    return packed, found
+
+
+def add_to_cache(cache_subdir: str, keys: np.ndarray, packed: np.ndarray) -> None:
+    """
+    Add fingerprints to the cache as a new shard (sorted by key).
+    """
+    if len(keys) == 0:
+        return
+    keys, first_idx = np.unique(keys, return_index=True)
+    os.makedirs(cache_subdir, exist_ok=True)
+    shard_name = f"shard_{time.time_ns()}_{os.getpid()}.npz"
+    shard_path = os.path.join(cache_subdir, shard_name)
+    # write to temporary file first so concurrent runs never see partial shards
+    tmp_path = os.path.join(cache_subdir, f"tmp_{shard_name}")
+    np.savez(tmp_path, keys=keys, fps=packed[first_idx])
+    os.replace(tmp_path, shard_path)
+
+
+def evict_from_cache(cache_subdir: str, max_size_mb: float) -> int:
+    """
+    Remove least-recently-used shards until the cache is at most max_size_mb.
+
+    :return int: number of shards removed
+    """
+    shard_paths = get_shard_paths(cache_subdir)
+    shard_paths.sort(key=os.path.getmtime)
+    total_size = sum(os.path.getsize(path) for path in shard_paths)
+    max_size = max_size_mb * 1024**2
+    n_removed = 0
+    for shard_path in shard_paths:
+        if total_size <= max_size:
+            break
+        total_size -= os.path.getsize(shard_path)
+        os.remove(shard_path)
+        n_removed += 1
+    return n_removed
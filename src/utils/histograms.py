@@ -0,0 +1,189 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Exact histograms of similarity values on the fixed-point grid of the "uint16"
+storage type of the LTM (bin k holds the values that round to k / 65535).
+The histograms of all groups of a grouping (e.g., all clusters of a class_level)
+are stored as a sparse group x bin matrix of counts, which is typically a few
+KB/MB while the values themselves take GBs. Histograms are exact, mergeable
+summaries: counts of chunks of the values (e.g., computed by different
+processes) are summed up. Summary statistics (mean, std, min/max, quantiles) of
+the (rounded) values are computed from these directly.
+"""
+
+import numpy as np
+from scipy.sparse import csr_array
+
+from utils.io import load_csr, save_csr
+from utils.ltm import FIXED_POINT_SCALE
+from utils.ragged import get_chunk_bounds
+
+N_BINS = FIXED_POINT_SCALE + 1
+# similarity value of each bin
+BIN_VALUES = np.arange(N_BINS) / FIXED_POINT_SCALE
+# group ID of the histogram of all values of the LTM
+ALL_GROUP_ID = -1
+
+
+def get_value_bins(values: np.ndarray) -> np.ndarray:
+    # bin of each similarity value (values of a "uint16" LTM already are bins)
+    if values.dtype == np.uint16:
+        return values.astype(np.int64)
+    return np.rint(np.asarray(values, dtype=np.float64) * FIXED_POINT_SCALE).astype(
+        np.int64
+    )
+
+
+def get_chunk_histograms(
+    values: np.ndarray, offsets: np.ndarray, start: int, stop: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count the values[start:stop] of each group of a ragged array (see utils/ragged.py) per bin.
+    Counts of different chunks are merged with merge_chunk_histograms.
+
+    :param np.ndarray values: flat values of all groups (e.g., memory-mapped LTM or ragged array)
+    :param np.ndarray offsets: offsets of the groups in values
+    :param int start: first value of the chunk
+    :param int stop: end of the chunk (exclusive)
+    :return tuple[np.ndarray, np.ndarray, np.ndarray]: (group position, bin, count) of each non-empty bin
+    """
+    positions, bounds = get_chunk_bounds(offsets, start, stop)
+    bins = get_value_bins(values[start:stop])
+    keys = np.repeat(np.arange(len(positions)), np.diff(bounds)) * N_BINS + bins
+    if len(positions) * N_BINS <= 4 * len(keys):
+        key_counts = np.bincount(keys, minlength=len(positions) * N_BINS)
+        keys = np.flatnonzero(key_counts)
+        key_counts = key_counts[keys]
+    else:
+        # many small groups: avoid allocating a mostly empty dense histogram
+        keys, key_counts = np.unique(keys, return_counts=True)
+    return positions[keys // N_BINS], keys % N_BINS, key_counts.astype(np.int64)
+
+
+def merge_chunk_histograms(
+    chunk_histograms: list[tuple[np.ndarray, np.ndarray, np.ndarray]], n_groups: int
+) -> csr_array:
+    """
+    Merge the counts of chunks (see get_chunk_histograms) into one histogram per group.
+    Counts are summed, so the result does not depend on how the values were split up.
+
+    :param list chunk_histograms: output of get_chunk_histograms for each chunk
+    :param int n_groups: number of groups
+    :return csr_array: group x bin matrix of counts
+    """
+    if len(chunk_histograms) == 0:
+        return csr_array((n_groups, N_BINS), dtype=np.int64)
+    rows, cols, counts = zip(*chunk_histograms)
+    # counts of groups split across chunks are summed up
+    histograms = csr_array(
+        (np.concatenate(counts), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_groups, N_BINS),
+    )
+    histograms.sum_duplicates()
+    return histograms
+
+
+def get_chunks(n_values: int, chunk_size: int) -> list[tuple[int, int]]:
+    # (start, stop) of consecutive chunks of at most chunk_size values
+    return [
+        (start, min(start + chunk_size, n_values))
+        for start in range(0, n_values, chunk_size)
+    ]
+
+
+def save_histograms(
+    histograms: csr_array, group_ids: np.ndarray, save_path: str
+) -> None:
+    save_csr(histograms, save_path, group_ids=np.asarray(group_ids, dtype=np.int64))
+
+
+def load_histograms(save_path: str) -> tuple[csr_array, np.ndarray]:
+    """
+    Load histograms saved by save_histograms.
+
+    :param str save_path: .npz file saved by save_histograms
+    :return tuple[csr_array, np.ndarray]: group x bin matrix of counts and group ID of each row
+    """
+    histograms, arrays = load_csr(save_path)
+    return histograms, arrays["group_ids"]
+
+
+def get_histogram_quantiles(
+    histograms: csr_array, quantiles: list[float]
+) -> np.ndarray:
+    """
+    Quantiles of the (rounded) values of each group, same as np.quantile
+    (linear interpolation) on the values of the group.
+
+    :param csr_array histograms: group x bin matrix of counts
+    :param list[float] quantiles: quantiles in [0, 1]
+    :return np.ndarray: array of shape (n_groups, len(quantiles)), nan for empty groups
+    """
+    histograms.sort_indices()
+    n_groups = histograms.shape[0]
+    cum_counts = np.cumsum(histograms.data)
+    # number of values in all groups before each group
+    n_before = np.concatenate([[0], cum_counts])[histograms.indptr[:-1]]
+    sizes = histograms.sum(axis=1)
+    valid = sizes > 0
+    result = np.full((n_groups, len(quantiles)), np.nan)
+
+    def get_values_at_ranks(ranks: np.ndarray) -> np.ndarray:
+        # value of the 0-based rank within each (valid) group
+        positions = np.searchsorted(cum_counts, n_before[valid] + ranks, side="right")
+        return BIN_VALUES[histograms.indices[positions]]
+
+    for j, q in enumerate(quantiles):
+        rank = q * (sizes[valid] - 1)
+        lo, hi = np.floor(rank), np.ceil(rank)
+        lo_values = get_values_at_ranks(lo.astype(np.int64))
+        hi_values = get_values_at_ranks(hi.astype(np.int64))
+        result[valid, j] = lo_values + (rank - lo) * (hi_values - lo_values)
+    return result
+
+
+def get_histogram_stats(histograms: csr_array) -> dict[str, np.ndarray]:
+    """
+    Summary statistics of the (rounded) values of each group. These are exact for
+    "uint16" LTMs, for other types values are off by at most 1 / (2 * 65535).
+
+    :param csr_array histograms: group x bin matrix of counts
+    :return dict[str, np.ndarray]: statistics (columns of a table) with one entry per group, nan for empty groups
+    """
+    histograms.sort_indices()
+    n_groups = histograms.shape[0]
+    counts = np.asarray(histograms.sum(axis=1), dtype=np.int64)
+    valid = counts > 0
+    values = BIN_VALUES[histograms.indices]
+    rows = np.repeat(np.arange(n_groups), np.diff(histograms.indptr))
+    means = np.full(n_groups, np.nan)
+    means[valid] = (
+        np.bincount(rows, weights=histograms.data * values, minlength=n_groups)[valid]
+        / counts[valid]
+    )
+    # sample standard deviation (ddof=1, as scipy.stats.describe), nan for groups with < 2 values
+    m2 = np.bincount(
+        rows,
+        weights=histograms.data * (values - means[rows]) ** 2,
+        minlength=n_groups,
+    )
+    std = np.full(n_groups, np.nan)
+    std[counts > 1] = np.sqrt(m2[counts > 1] / (counts[counts > 1] - 1))
+    # non-empty bins of each row are sorted
+    mins = np.full(n_groups, np.nan)
+    maxs = np.full(n_groups, np.nan)
+    mins[valid] = BIN_VALUES[histograms.indices[histograms.indptr[:-1][valid]]]
+    maxs[valid] = BIN_VALUES[histograms.indices[histograms.indptr[1:][valid] - 1]]
+    q1, median, q3 = get_histogram_quantiles(histograms, [0.25, 0.5, 0.75]).T
+    return {
+        "n_pairs": counts,
+        "mean": means,
+        "std": std,
+        "min": mins,
+        "q1": q1,
+        "median": median,
+        "q3": q3,
+        "iqr": q3 - q1,
+        "max": maxs,
+    }
@@ -9,6 +9,9 @@ import csv
 import os
 import pickle
 
+import numpy as np
+from scipy.sparse import csr_array
+
 
 def write_to_tsv(fpath: str, rows: list, header: list[str]) -> None:
     os.makedirs(os.path.dirname(fpath), exist_ok=True)
@@ -29,3 +32,42 @@ def load_from_pkl(save_path: str) -> object:
     with open(save_path, "rb") as f:
         obj = pickle.load(f)
     return obj
+
+
+def save_csr(matrix: csr_array, save_path: str, **arrays: np.ndarray) -> None:
+    """
+    Save a CSR matrix to a .npz file, together with additional arrays
+    (e.g., the IDs of its rows/columns).
+
+    :param csr_array matrix: matrix to save
+    :param str save_path: output .npz file
+    :param np.ndarray arrays: additional arrays, saved under their keyword
+    """
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    np.savez(
+        save_path,
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        shape=np.array(matrix.shape),
+        **arrays,
+    )
+
+
+def load_csr(save_path: str) -> tuple[csr_array, dict[str, np.ndarray]]:
+    """
+    Load a CSR matrix saved by save_csr.
+
+    :param str save_path: .npz file saved by save_csr
+    :return tuple[csr_array, dict[str, np.ndarray]]: matrix and additional arrays by keyword
+    """
+    with np.load(save_path) as f:
+        matrix = csr_array(
+            (f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"])
+        )
+        arrays = {
+            key: f[key]
+            for key in f.files
+            if key not in ("data", "indices", "indptr", "shape")
+        }
+    return matrix, arrays
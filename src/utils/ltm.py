@@ -10,6 +10,10 @@ import math
 
 import numpy as np
 
+# supported storage types of the LTM, "uint16" stores fixed-point values (value * 65535)
+SIM_DTYPES = ["float64", "float32", "float16", "uint16"]
+FIXED_POINT_SCALE = 65535
+
 
 def get_triangle_number(n: int) -> int:
     return (n * (n - 1)) // 2
@@ -91,3 +95,182 @@ def get_all_ltm_indices_from_idx(i: int, N: int) -> list[int]:
     ltm_row_idxes = get_ltm_indices_from_row(i)
     ltm_col_idxes = get_ltm_indices_from_col(i, N)
     return ltm_row_idxes + ltm_col_idxes
+
+
+def get_ltm_indices_from_rows_cols(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of get_ltm_idx. Unlike get_ltm_idx, rows and cols
+    do not need to be ordered (the max/min of each pair is taken here).
+
+    :param np.ndarray rows: indices of molecule 1 in id_list
+    :param np.ndarray cols: indices of molecule 2 in id_list
+    :return np.ndarray: indices in the LTM with coeff values
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    r = np.maximum(rows, cols)
+    c = np.minimum(rows, cols)
+    return (r * (r - 1)) // 2 + c
+
+
+def get_rows_cols_from_ltm_indices(
+    ltm_indices: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized version of get_row_col_from_ltm_idx.
+
+    :param np.ndarray ltm_indices: indices in the LTM
+    :return tuple[np.ndarray, np.ndarray]: (rows, cols) with col < row for each index
+    """
+    ltm_indices = np.asarray(ltm_indices, dtype=np.int64)
+    rows = ((1 + np.sqrt(1 + 8 * ltm_indices.astype(np.float64))) // 2).astype(np.int64)
+    # correct for floating point error of sqrt for large indices
+    rows -= (rows * (rows - 1)) // 2 > ltm_indices
+    rows += ((rows + 1) * rows) // 2 <= ltm_indices
+    cols = ltm_indices - (rows * (rows - 1)) // 2
+    return rows, cols
+
+
+def get_pair_positions(n: int, start: int = 0, stop: int = None) -> tuple:
+    """
+    Get positions (a, b) with a < b of all pairs within a group of size n,
+    in the same order as itertools.combinations(range(n), 2).
+    Only pairs whose first position a is in [start, stop) are returned.
+    """
+    stop = n if stop is None else stop
+    counts = np.arange(n - 1 - start, n - 1 - stop, -1, dtype=np.int64)
+    a = np.repeat(np.arange(start, stop, dtype=np.int64), counts)
+    # position of each pair within its run of a, then shifted past a
+    run_starts = np.cumsum(counts) - counts
+    b = np.arange(len(a), dtype=np.int64) - np.repeat(run_starts, counts) + a + 1
+    return a, b
+
+
+def get_group_ltm_indices(idx_array: np.ndarray) -> np.ndarray:
+    """
+    Get the LTM indices of all pairs within a group of ligands.
+    Order matches itertools.combinations(idx_array, 2).
+
+    :param np.ndarray idx_array: indices (in id_list) of ligands in the group
+    :return np.ndarray: LTM index for each pair
+    """
+    a, b = get_pair_positions(len(idx_array))
+    return get_ltm_indices_from_rows_cols(idx_array[a], idx_array[b])
+
+
+def iter_group_ltm_indices(idx_array: np.ndarray, chunk_size: int):
+    """
+    Chunked version of get_group_ltm_indices, yields (a, b, ltm_indices) where
+    a/b are positions in idx_array. Each chunk covers whole runs of pairs sharing
+    the same first ligand, so a chunk holds at most max(chunk_size, n - 1) pairs.
+    """
+    n = len(idx_array)
+    assert chunk_size > 0
+    counts = np.arange(n - 1, -1, -1, dtype=np.int64)
+    cum_counts = np.cumsum(counts)
+    start = 0
+    while start < n - 1:
+        done = cum_counts[start - 1] if start > 0 else 0
+        stop = int(np.searchsorted(cum_counts, done + chunk_size, side="right"))
+        stop = min(max(stop, start + 1), n)
+        a, b = get_pair_positions(n, start, stop)
+        yield a, b, get_ltm_indices_from_rows_cols(idx_array[a], idx_array[b])
+        start = stop
+
+
+def get_row_tiles(N: int, max_tile_values: int, start: int = 1):
+    """
+    Split the rows [start, N) of the LTM into contiguous tiles of rows [start, stop).
+    Each tile contains at most max_tile_values similarity values (or a single row
+    if one row already exceeds max_tile_values).
+    """
+    start = max(start, 1)  # row 0 of the LTM is empty
+    while start < N:
+        stop = start + 1
+        while (
+            stop < N
+            and get_triangle_number(stop + 1) - get_triangle_number(start)
+            <= max_tile_values
+        ):
+            stop += 1
+        yield start, stop
+        start = stop
+
+
+def quantize_sim_values(values: np.ndarray, dtype: str) -> np.ndarray:
+    """
+    Convert similarity values (in [0, 1]) to the given storage type.
+
+    :param np.ndarray values: similarity values
+    :param str dtype: one of SIM_DTYPES
+    :return np.ndarray: values in the storage type
+    """
+    assert (
+        dtype in SIM_DTYPES
+    ), f"Unsupported dtype={dtype}, expected one of {SIM_DTYPES}"
+    if dtype == "uint16":
+        return np.rint(np.asarray(values) * FIXED_POINT_SCALE).astype(np.uint16)
+    return np.asarray(values).astype(dtype, copy=False)
+
+
+def dequantize_sim_values(values: np.ndarray) -> np.ndarray:
+    """
+    Convert values read from an LTM of any storage type back to similarity values (float64).
+    Downstream math (e.g., medians, rank sums) is always done in float64 this way.
+    """
+    if values.dtype == np.uint16:
+        return values / FIXED_POINT_SCALE
+    return values.astype(np.float64, copy=False)
+
+
+def get_max_quantization_error(dtype: np.dtype) -> float:
+    # max absolute error of similarity values (in [0, 1]) stored as the given type
+    if dtype == np.uint16:
+        return 0.5 / FIXED_POINT_SCALE
+    return float(np.finfo(dtype).eps)
+
+
+def load_sim_matrix(similarity_npy_file: str, mmap_mode: str = None) -> np.ndarray:
+    """
+    Load LTM saved by calculate_fp_similarity.py. Values are kept in their storage
+    type, use dequantize_sim_values on values read from the matrix.
+    """
+    sim_matrix = np.load(similarity_npy_file, mmap_mode=mmap_mode)
+    assert (
+        sim_matrix.dtype.name in SIM_DTYPES
+    ), f"Unsupported dtype of LTM: {sim_matrix.dtype}"
+    return sim_matrix
+
+
+def resize_sim_matrix_file(similarity_npy_file: str, n_values: int) -> np.memmap:
+    """
+    Resize the LTM saved in similarity_npy_file to n_values in place (existing values are
+    kept, new values are zero) and return it memory-mapped for writing. Only the .npy header
+    is rewritten, numpy reserves space in the header for the shape to grow.
+    """
+    with open(similarity_npy_file, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        assert version in [(1, 0), (2, 0)], f"Unsupported .npy version: {version}"
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        assert len(shape) == 1, f"Expected 1D LTM, got shape {shape}"
+        data_offset = f.tell()
+        # magic string (6 bytes) + version (2 bytes) + header length (2 or 4 bytes)
+        header_start = 8 + (2 if version == (1, 0) else 4)
+        header_len = data_offset - header_start
+        header = str(
+            {
+                "descr": np.lib.format.dtype_to_descr(dtype),
+                "fortran_order": False,
+                "shape": (n_values,),
+            }
+        )
+        assert (
+            len(header) < header_len
+        ), f"No space left in .npy header of {similarity_npy_file} to resize in place"
+        f.seek(header_start)
+        f.write((header.ljust(header_len - 1) + "\n").encode("latin1"))
+        f.truncate(data_offset + n_values * dtype.itemsize)
+    return np.load(similarity_npy_file, mmap_mode="r+")
@@ -0,0 +1,103 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Helper functions for the sparse ligand x group membership matrices created by
+assign_family_clusters.py. Each matrix is a boolean CSR matrix where rows are
+ligands (sorted by molregno, reordered to the similarity matrix id_list on load)
+and columns are groups (clusters of a class_level, targets or assays), saved
+with the IDs of its rows/columns.
+"""
+
+import numpy as np
+import polars as pl
+from scipy.sparse import csr_array
+
+from utils.io import load_csr, save_csr
+
+
+def build_membership_matrix(
+    df: pl.DataFrame, row_ids: list[int], id_col: str, group_col: str
+) -> tuple[csr_array, np.ndarray]:
+    """
+    Build membership matrix from a ligand -> group mapping.
+
+    :param pl.DataFrame df: mapping of ligands (id_col) to groups (group_col)
+    :param list[int] row_ids: ligand ID of each row, must include all ligands in df
+    :param str id_col: column of ligand IDs
+    :param str group_col: column of group IDs
+    :return tuple[csr_array, np.ndarray]: membership matrix and group ID of each column (sorted)
+    """
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    df = df.select(
+        pl.col(id_col).cast(pl.Int64), pl.col(group_col).cast(pl.Int64)
+    ).unique()
+    col_ids = np.sort(df[group_col].unique().to_numpy())
+    row_df = pl.DataFrame(
+        {id_col: row_ids, "row": np.arange(len(row_ids), dtype=np.int64)}
+    )
+    df = df.join(row_df, on=id_col, how="left")
+    n_missing = df["row"].null_count()
+    assert n_missing == 0, f"{n_missing} ligand-group pairs have ligands not in row_ids"
+    rows = df["row"].to_numpy()
+    cols = np.searchsorted(col_ids, df[group_col].to_numpy())
+    membership = csr_array(
+        (np.ones(len(rows), dtype=bool), (rows, cols)),
+        shape=(len(row_ids), len(col_ids)),
+    )
+    membership.sort_indices()
+    return membership, col_ids
+
+
+def save_membership(
+    membership: csr_array, row_ids: np.ndarray, col_ids: np.ndarray, save_path: str
+) -> None:
+    save_csr(
+        membership,
+        save_path,
+        row_ids=np.asarray(row_ids, dtype=np.int64),
+        col_ids=np.asarray(col_ids, dtype=np.int64),
+    )
+
+
+def load_membership(
+    save_path: str, id_list: list[int] = None
+) -> tuple[csr_array, np.ndarray]:
+    """
+    Load membership matrix saved by save_membership.
+
+    :param str save_path: .npz file saved by save_membership
+    :param list[int] id_list: (Optional) ligand IDs in order of the similarity matrix.
+        If given, rows are reordered to match id_list (if they do not already)
+    :return tuple[csr_array, np.ndarray]: membership matrix and group ID of each column
+    """
+    membership, arrays = load_csr(save_path)
+    row_ids, col_ids = arrays["row_ids"], arrays["col_ids"]
+    if id_list is not None and not np.array_equal(row_ids, id_list):
+        id2idx = pl.DataFrame(
+            {"id": np.asarray(id_list, dtype=np.int64), "idx": np.arange(len(id_list))}
+        )
+        idx = pl.DataFrame({"id": row_ids}).join(
+            id2idx, on="id", how="left", maintain_order="left"
+        )["idx"]
+        assert idx.null_count() == 0, "Membership matrix has ligands not in id_list"
+        idx = idx.to_numpy()
+        coo = membership.tocoo()
+        membership = csr_array(
+            (coo.data, (idx[coo.row], coo.col)),
+            shape=(len(id_list), len(col_ids)),
+        )
+        membership.sort_indices()
+    return membership, col_ids
+
+
+def get_group_members(membership: csr_array) -> list[np.ndarray]:
+    """
+    Get the (sorted) row indices of the ligands in each group, in O(nnz).
+
+    :param csr_array membership: membership matrix
+    :return list[np.ndarray]: ligand indices of each column/group
+    """
+    csc = membership.tocsc()
+    csc.sort_indices()
+    return np.split(csc.indices.astype(np.int64), csc.indptr[1:-1])
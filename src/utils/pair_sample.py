@@ -0,0 +1,131 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Random samples of ligand pairs, used to estimate statistics of the similarity
+values without computing the full (O(N^2)) similarity matrix. Pairs are drawn
+uniformly without replacement, either from all pairs of ligands (global sample)
+or from the pairs within each group (stratified sample), see
+sample_similarity_pairs.py. Also contains the (analytic) error bars of the
+estimates made from these samples.
+"""
+
+import math
+
+import numpy as np
+
+from utils.constants import get_global_sample_fpath, get_sample_ids_fpath
+from utils.ltm import get_rows_cols_from_ltm_indices, get_triangle_number
+
+# z-score of a two-sided 95% confidence interval
+Z_95 = 1.959963984540054
+
+
+def sample_pairs(
+    n: int, n_samples: int, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sample pairs uniformly without replacement from all pairs of n items.
+    If n_samples >= the number of pairs, all pairs are returned.
+
+    :param int n: number of items
+    :param int n_samples: number of pairs to sample
+    :param np.random.Generator rng: random number generator
+    :return tuple[np.ndarray, np.ndarray]: (rows, cols) with col < row, ordered by LTM index
+    """
+    n_pairs = get_triangle_number(n)
+    if n_samples >= n_pairs:
+        ltm_indices = np.arange(n_pairs, dtype=np.int64)
+    else:
+        # O(n_samples) for n_samples << n_pairs
+        ltm_indices = np.sort(rng.choice(n_pairs, n_samples, replace=False))
+    return get_rows_cols_from_ltm_indices(ltm_indices)
+
+
+def save_global_sample(
+    similarity_sample_dir: str,
+    ids: np.ndarray,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    values: np.ndarray,
+) -> None:
+    np.save(get_sample_ids_fpath(similarity_sample_dir), ids)
+    np.savez(
+        get_global_sample_fpath(similarity_sample_dir),
+        rows=rows,
+        cols=cols,
+        values=values,
+    )
+
+
+def load_global_sample(
+    similarity_sample_dir: str,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load sample saved by save_global_sample.
+
+    :return tuple: (ligand IDs, rows, cols, values), rows/cols are indices in the ligand IDs
+    """
+    ids = np.load(get_sample_ids_fpath(similarity_sample_dir))
+    with np.load(get_global_sample_fpath(similarity_sample_dir)) as f:
+        rows, cols, values = f["rows"], f["cols"], f["values"]
+    return ids, rows, cols, values
+
+
+def get_proportion_rel_var(
+    counts: np.ndarray, n_sampled: int, n_population: int
+) -> np.ndarray:
+    """
+    Relative variance (Var(p_hat) / p_hat^2) of proportions estimated as
+    counts / n_sampled from a sample drawn without replacement, incl. the
+    finite population correction (0 when the whole population was sampled).
+    Undefined (nan) for counts of 0 (unless the whole population was sampled).
+
+    :param np.ndarray counts: number of sampled pairs with the property of interest
+    :param int n_sampled: number of sampled pairs
+    :param int n_population: number of pairs sampled from
+    :return np.ndarray: relative variance of each proportion
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    if n_sampled >= n_population:
+        # exact
+        return np.zeros(len(counts))
+    fpc = (n_population - n_sampled) / max(n_population - 1, 1)
+    rel_var = np.full(len(counts), np.nan)
+    p = counts / max(n_sampled, 1)
+    nonzero = counts > 0
+    rel_var[nonzero] = (1 - p[nonzero]) / counts[nonzero] * fpc
+    return rel_var
+
+
+def get_ratio_error_bars(
+    ratio: np.ndarray, rel_var_num: np.ndarray, rel_var_denom: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Standard error and 95% CI of a ratio of two independent estimates
+    (delta method, CI computed on the log scale so it stays positive).
+
+    :param np.ndarray ratio: estimated ratios
+    :param np.ndarray rel_var_num: relative variance of the numerators
+    :param np.ndarray rel_var_denom: relative variance of the denominators
+    :return tuple[np.ndarray, np.ndarray, np.ndarray]: standard error, CI lower bound, CI upper bound
+    """
+    rel_se = np.sqrt(rel_var_num + rel_var_denom)
+    return ratio * rel_se, ratio * np.exp(-Z_95 * rel_se), ratio * np.exp(Z_95 * rel_se)
+
+
+def get_median_ci(sorted_values: np.ndarray) -> tuple[float, float]:
+    """
+    Distribution-free 95% CI of the median of sampled values,
+    using order statistics (normal approximation of the binomial).
+
+    :param np.ndarray sorted_values: sampled values, sorted
+    :return tuple[float, float]: CI lower bound, CI upper bound
+    """
+    n = len(sorted_values)
+    if n == 0:
+        return np.nan, np.nan
+    half_width = Z_95 * math.sqrt(n) / 2
+    lo = max(math.floor(n / 2 - half_width), 0)
+    hi = min(math.ceil(n / 2 + half_width), n - 1)
+    return float(sorted_values[lo]), float(sorted_values[hi])
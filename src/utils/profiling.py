@@ -0,0 +1,216 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Instrumentation shared by the scripts of the workflow. A StageProfiler records
+named (optionally nested) phases of a script: wall-clock/CPU time, peak memory
+(RSS), bytes read/written and item throughput (e.g., pairs/s). Results are
+saved as JSON (next to the log of the Snakemake rule) and optionally a cProfile
+dump of the whole script can be saved.
+
+Bytes read/written are taken from /proc/self/io, "bytes_read"/"bytes_written"
+count read()/write() calls (incl. page cache hits) while "disk_bytes_read"/
+"disk_bytes_written" count I/O that reached storage (incl. page faults of
+memory-mapped files). These and the per-phase peak RSS are only available on
+Linux, elsewhere peak RSS is that of the whole script so far. Note the per-phase
+peak RSS is measured by resetting the peak RSS (VmHWM) of the process at the
+start of each phase, so use the "total" of the profile for the peak of the script.
+"""
+
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PROC_STATUS = "/proc/self/status"
+PROC_IO = "/proc/self/io"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+IO_FIELDS = {
+    "rchar": "bytes_read",
+    "wchar": "bytes_written",
+    "read_bytes": "disk_bytes_read",
+    "write_bytes": "disk_bytes_written",
+}
+
+
+def get_peak_rss_kb() -> int:
+    # peak RSS (high water mark) of this process in KB
+    if os.path.exists(PROC_STATUS):
+        with open(PROC_STATUS) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak_rss // 1024 if sys.platform == "darwin" else peak_rss
+
+
+def reset_peak_rss() -> bool:
+    # reset the high water mark to the current RSS (Linux >= 4.0), returns True if successful
+    try:
+        with open(PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_io_counters() -> dict[str, int]:
+    if not os.path.exists(PROC_IO):
+        return {}
+    counters = {}
+    with open(PROC_IO) as f:
+        for line in f:
+            key, value = line.split(":")
+            if key in IO_FIELDS:
+                counters[IO_FIELDS[key]] = int(value)
+    return counters
+
+
+def get_cpu_times() -> tuple[float, float]:
+    # CPU time of this process and its (finished) child processes, e.g. workers of a Pool
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        self_usage.ru_utime + self_usage.ru_stime,
+        child_usage.ru_utime + child_usage.ru_stime,
+    )
+
+
+class StageProfiler:
+    """
+    Profiler of a script, used as a context manager around main:
+
+        with StageProfiler("my_script", args.profile_json_file) as profiler:
+            with profiler.phase("load_matrix"):
+                ...
+            with profiler.phase("compute", unit="pairs"):
+                ...
+                profiler.add_items(n_pairs)
+    """
+
+    def __init__(
+        self, stage: str, profile_json_file: str = None, cprofile_file: str = None
+    ):
+        """
+        :param str stage: name of the stage (script)
+        :param str profile_json_file: (Optional) output .json file of phase measurements
+        :param str cprofile_file: (Optional) output cProfile (pstats) dump of the stage
+        """
+        self.stage = stage
+        self.profile_json_file = profile_json_file
+        self.cprofile_file = cprofile_file
+        self.phases = []
+        # records of open phases, the first being the whole stage
+        self._stack = []
+        self._can_reset_rss = False
+        self._cprofile = None
+
+    def _start_record(self, name: str, unit: str) -> dict:
+        # the peak RSS measured so far belongs to the enclosing phase
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak_rss_kb"] = max(parent["peak_rss_kb"], get_peak_rss_kb())
+        self._can_reset_rss = reset_peak_rss()
+        cpu_time, child_cpu_time = get_cpu_times()
+        return {
+            "name": name,
+            "unit": unit,
+            "n_items": None,
+            "peak_rss_kb": get_peak_rss_kb(),
+            "_start": time.perf_counter(),
+            "_cpu": cpu_time,
+            "_child_cpu": child_cpu_time,
+            "_io": get_io_counters(),
+        }
+
+    def _end_record(self, record: dict) -> dict:
+        wall_time = time.perf_counter() - record["_start"]
+        cpu_time, child_cpu_time = get_cpu_times()
+        peak_rss_kb = max(record["peak_rss_kb"], get_peak_rss_kb())
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak_rss_kb"] = max(parent["peak_rss_kb"], peak_rss_kb)
+        result = {
+            "name": record["name"],
+            "wall_time_s": wall_time,
+            "cpu_time_s": cpu_time - record["_cpu"],
+            "child_cpu_time_s": child_cpu_time - record["_child_cpu"],
+            "peak_rss_mb": peak_rss_kb / 1024,
+        }
+        io = get_io_counters()
+        for key, start_value in record["_io"].items():
+            result[key] = io[key] - start_value
+        if record["n_items"] is not None:
+            result[f"n_{record['unit']}"] = record["n_items"]
+            result[f"{record['unit']}_per_s"] = (
+                record["n_items"] / wall_time if wall_time > 0 else None
+            )
+        return result
+
+    @contextmanager
+    def phase(self, name: str, unit: str = "items"):
+        """
+        Measure a named phase. Phases can be nested, the name of a nested phase
+        is prefixed by the names of the enclosing phases (e.g. "gather/class_level=4").
+
+        :param str name: name of the phase
+        :param str unit: name of the items processed in the phase (see add_items)
+        """
+        if len(self._stack) > 1:
+            name = f"{self._stack[-1]['name']}/{name}"
+        record = self._start_record(name, unit)
+        self._stack.append(record)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            result = self._end_record(record)
+            self.phases.append(result)
+            print(f"[{self.stage}] {name}: {result['wall_time_s']:.2f}s", flush=True)
+
+    def add_items(self, n_items: int) -> None:
+        # add to the number of items processed in the current (innermost) phase
+        assert len(self._stack) > 1, "add_items must be called within a phase"
+        record = self._stack[-1]
+        record["n_items"] = (record["n_items"] or 0) + int(n_items)
+
+    def __enter__(self):
+        self._started_at = datetime.now().isoformat(timespec="seconds")
+        self._stack = [self._start_record("total", "items")]
+        if self.cprofile_file is not None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            os.makedirs(
+                os.path.dirname(os.path.abspath(self.cprofile_file)), exist_ok=True
+            )
+            self._cprofile.dump_stats(self.cprofile_file)
+        total = self._end_record(self._stack.pop())
+        if self.profile_json_file is None:
+            return False
+        report = {
+            "stage": self.stage,
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "started_at": self._started_at,
+            "status": "ok" if exc_type is None else "error",
+            "error": None if exc_type is None else repr(exc_value),
+            "per_phase_peak_rss": self._can_reset_rss,
+            "total": total,
+            "phases": self.phases,
+        }
+        os.makedirs(
+            os.path.dirname(os.path.abspath(self.profile_json_file)), exist_ok=True
+        )
+        with open(self.profile_json_file, "w") as f:
+            json.dump(report, f, indent=2)
+        return False
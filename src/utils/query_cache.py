@@ -0,0 +1,200 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Local on-disk cache of ChEMBL query results (stored as Parquet).
+Entries are keyed by a hash of the ChEMBL version and the rendered SQL (which
+includes all parameters). Queries with a minimum-value filter (e.g., pchembl_value)
+can also be served from a cached result of the same query with a lower minimum,
+by filtering the cached superset locally. Entries are evicted least-recently-used
+first once the cache exceeds the given size.
+Results are cached exactly as written to the output file (TSV values are kept as
+strings), so files served from the cache are identical to those written from the DB.
+"""
+
+import glob
+import hashlib
+import os
+import shutil
+from typing import Callable, Optional
+
+import polars as pl
+from psycopg2 import sql
+from psycopg2.extensions import connection as Connection
+
+from utils.db import stream_query_to_file
+from utils.tables import get_table_format
+
+
+def get_chembl_version(connection: Connection) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM version;")
+        result = cursor.fetchone()
+    return result[0]
+
+
+def get_query_key(
+    connection: Connection, query: sql.Composable, table_format: str = "tsv"
+) -> str:
+    query_str = query.as_string(connection)
+    chembl_version = get_chembl_version(connection)
+    key_str = f"{chembl_version}\n{table_format}\n{query_str}"
+    return hashlib.sha256(key_str.encode()).hexdigest()
+
+
+def get_cache_entries(cache_dir: str) -> list[str]:
+    return glob.glob(os.path.join(cache_dir, "*.parquet"))
+
+
+def save_file_to_cache(fpath: str, cache_fpath: str) -> None:
+    os.makedirs(os.path.dirname(cache_fpath), exist_ok=True)
+    tmp_fpath = f"{cache_fpath}.{os.getpid()}.tmp"
+    if get_table_format(fpath) == "parquet":
+        shutil.copyfile(fpath, tmp_fpath)
+    else:
+        # keep all values as their string representation in the TSV file
+        pl.scan_csv(fpath, separator="\t", infer_schema=False).sink_parquet(tmp_fpath)
+    os.replace(tmp_fpath, cache_fpath)
+
+
+def write_cached_df_to_file(
+    df: pl.DataFrame,
+    fpath: str,
+    batch_size: int,
+    on_batch: Optional[Callable[[list[tuple]], None]] = None,
+) -> int:
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    if get_table_format(fpath) == "parquet":
+        df.write_parquet(fpath)
+    else:
+        # same format as write_to_tsv (csv module)
+        df.write_csv(fpath, separator="\t", line_terminator="\r\n")
+    if on_batch is not None:
+        for batch in df.iter_slices(batch_size):
+            on_batch(batch.rows())
+    return len(df)
+
+
+def find_superset_entry(
+    cache_dir: str, superset_key: str, min_value: float
+) -> tuple[Optional[str], Optional[float]]:
+    """
+    Find the cached result with the largest minimum value <= min_value among the
+    entries of the given superset key (i.e., the smallest cached superset).
+
+    :return tuple[Optional[str], Optional[float]]: path and minimum value of entry (None if not found)
+    """
+    best_fpath, best_value = None, None
+    for fpath in glob.glob(os.path.join(cache_dir, f"{superset_key}_min=*.parquet")):
+        value = float(os.path.basename(fpath)[len(superset_key) + 5 : -8])
+        if value <= min_value and (best_value is None or value > best_value):
+            best_fpath, best_value = fpath, value
+    return best_fpath, best_value
+
+
+def evict_from_cache(cache_dir: str, max_size_mb: float) -> int:
+    """
+    Remove least-recently-used entries until the cache is at most max_size_mb.
+
+    :return int: number of entries removed
+    """
+    fpaths = get_cache_entries(cache_dir)
+    fpaths.sort(key=os.path.getmtime)
+    total_size = sum(os.path.getsize(fpath) for fpath in fpaths)
+    max_size = max_size_mb * 1024**2
+    n_removed = 0
+    for fpath in fpaths:
+        if total_size <= max_size:
+            break
+        total_size -= os.path.getsize(fpath)
+        os.remove(fpath)
+        n_removed += 1
+    return n_removed
+
+
+def cached_query_to_file(
+    connection: Connection,
+    query: sql.Composable,
+    fpath: str,
+    header: list[str],
+    cache_dir: Optional[str],
+    batch_size: int = 10_000,
+    max_size_mb: Optional[float] = None,
+    on_batch: Optional[Callable[[list[tuple]], None]] = None,
+    min_filter: Optional[tuple[Callable[[float], sql.Composable], str, float]] = None,
+    superset_min_value: Optional[float] = None,
+) -> int:
+    """
+    Same as stream_query_to_file, but results are served from/added to the query cache.
+    Note that rows passed to on_batch contain strings when served from a cached TSV result.
+    If cache_dir is None, the query is run without cache.
+
+    :param Connection connection: DB connection
+    :param sql.Composable query: query to run
+    :param str fpath: output TSV/Parquet file
+    :param list[str] header: column names
+    :param str cache_dir: directory of query cache (None to disable cache)
+    :param int batch_size: number of rows fetched per round trip
+    :param float max_size_mb: (Optional) maximum size of cache in MB
+    :param Callable on_batch: (Optional) called with each batch of rows (e.g., to collect IDs)
+    :param tuple min_filter: (Optional) (get_query, column, min_value) if query has a
+        "column >= min_value" filter and get_query(x) returns the query using min_value=x
+        (i.e., query == get_query(min_value)). Allows serving the query from a cached
+        result with a lower min_value
+    :param float superset_min_value: (Optional) on a cache miss, query and cache the result
+        for this (lower) min_value of min_filter instead, and filter it locally
+    :return int: number of rows written
+    """
+    if cache_dir is None:
+        return stream_query_to_file(
+            connection, query, fpath, header, batch_size, on_batch
+        )
+    table_format = get_table_format(fpath)
+    if min_filter is None:
+        cache_fpath = os.path.join(
+            cache_dir, f"{get_query_key(connection, query, table_format)}.parquet"
+        )
+        if os.path.exists(cache_fpath):
+            print(f"Query cache hit: {cache_fpath}")
+            os.utime(cache_fpath)
+            df = pl.read_parquet(cache_fpath)
+            return write_cached_df_to_file(df, fpath, batch_size, on_batch)
+        n_rows = stream_query_to_file(
+            connection, query, fpath, header, batch_size, on_batch
+        )
+        save_file_to_cache(fpath, cache_fpath)
+    else:
+        get_query, column, min_value = min_filter
+        # key of the query independent of min_value
+        superset_key = get_query_key(connection, get_query(float("nan")), table_format)
+        cache_fpath, _ = find_superset_entry(cache_dir, superset_key, min_value)
+        if cache_fpath is not None:
+            print(f"Query cache hit: {cache_fpath}")
+            os.utime(cache_fpath)
+            df = pl.read_parquet(cache_fpath)
+            df = df.filter(pl.col(column).cast(pl.Float64) >= min_value)
+            n_rows = write_cached_df_to_file(df, fpath, batch_size, on_batch)
+        elif superset_min_value is None or superset_min_value >= min_value:
+            cache_fpath = os.path.join(
+                cache_dir, f"{superset_key}_min={min_value}.parquet"
+            )
+            n_rows = stream_query_to_file(
+                connection, query, fpath, header, batch_size, on_batch
+            )
+            save_file_to_cache(fpath, cache_fpath)
+        else:
+            cache_fpath = os.path.join(
+                cache_dir, f"{superset_key}_min={superset_min_value}.parquet"
+            )
+            stream_query_to_file(
+                connection, get_query(superset_min_value), fpath, header, batch_size
+            )
+            save_file_to_cache(fpath, cache_fpath)
+            df = pl.read_parquet(cache_fpath)
+            df = df.filter(pl.col(column).cast(pl.Float64) >= min_value)
+            n_rows = write_cached_df_to_file(df, fpath, batch_size, on_batch)
+
+    if max_size_mb is not None:
+        n_removed = evict_from_cache(cache_dir, max_size_mb)
+        print(f"Query cache: evicted {n_removed} entries")
+    return n_rows
@@ -0,0 +1,133 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Storage of values gathered per group (e.g., similarity values per cluster,
+target or assay) as a ragged array: one flat array holding the values of all
+groups, the offsets of each group's values within it and the (sorted) group IDs.
+Each array is saved as a .npy file in a directory. Files are memory-mapped on
+load, so the values of a group are only read from disk once accessed, and the
+values of each group are a (zero-copy) view of the flat array.
+"""
+
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+VALUES_FNAME = "values.npy"
+OFFSETS_FNAME = "offsets.npy"
+GROUP_IDS_FNAME = "group_ids.npy"
+
+
+class RaggedGroupValues(Mapping):
+    """
+    Read-only mapping from group ID to the values of the group
+    (can be used in place of a dict of group ID -> np.ndarray).
+    """
+
+    def __init__(
+        self, flat_values: np.ndarray, offsets: np.ndarray, group_ids: np.ndarray
+    ):
+        assert len(offsets) == len(group_ids) + 1
+        assert offsets[-1] == len(flat_values)
+        self.flat_values = flat_values
+        self.offsets = offsets
+        self.group_ids = group_ids
+
+    def get_position(self, group_id: int) -> int:
+        pos = int(np.searchsorted(self.group_ids, group_id))
+        if pos == len(self.group_ids) or self.group_ids[pos] != group_id:
+            raise KeyError(group_id)
+        return pos
+
+    def __getitem__(self, group_id: int) -> np.ndarray:
+        pos = self.get_position(group_id)
+        return self.flat_values[self.offsets[pos] : self.offsets[pos + 1]]
+
+    def __iter__(self):
+        return iter(self.group_ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.group_ids)
+
+    def flush(self) -> None:
+        # write changes to values back to disk (if memory-mapped)
+        if isinstance(self.flat_values, np.memmap):
+            self.flat_values.flush()
+
+    def get_sizes(self) -> np.ndarray:
+        # number of values of each group (in order of group_ids)
+        return np.diff(self.offsets)
+
+
+def create_group_values(
+    save_dir: str, group_ids: list[int], sizes: list[int], dtype=np.float64
+) -> RaggedGroupValues:
+    """
+    Create the files of a ragged array with the given group sizes. Values are
+    written in place through the returned mapping (e.g., values[group_id][:] = x),
+    so the full set of values never has to be held in memory.
+
+    :param str save_dir: output directory
+    :param list[int] group_ids: ID of each group
+    :param list[int] sizes: number of values of each group
+    :param dtype: type of values
+    :return RaggedGroupValues: mapping of groups to writable (memory-mapped) values
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    assert len(group_ids) == len(sizes)
+    assert len(np.unique(group_ids)) == len(group_ids), "group IDs must be unique"
+    order = np.argsort(group_ids)
+    group_ids = group_ids[order]
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes[order], out=offsets[1:])
+    np.save(os.path.join(save_dir, GROUP_IDS_FNAME), group_ids)
+    np.save(os.path.join(save_dir, OFFSETS_FNAME), offsets)
+    values_path = os.path.join(save_dir, VALUES_FNAME)
+    if offsets[-1] == 0:
+        # empty arrays cannot be memory-mapped
+        flat_values = np.empty(0, dtype=dtype)
+        np.save(values_path, flat_values)
+    else:
+        flat_values = np.lib.format.open_memmap(
+            values_path, mode="w+", dtype=dtype, shape=(int(offsets[-1]),)
+        )
+    return RaggedGroupValues(flat_values, offsets, group_ids)
+
+
+def load_group_values(save_dir: str, mmap: bool = True) -> RaggedGroupValues:
+    """
+    Load ragged array created by create_group_values.
+
+    :param str save_dir: directory of ragged array
+    :param bool mmap: if True (default), memory-map the values instead of reading them into memory
+    :return RaggedGroupValues: mapping of group ID -> values
+    """
+    flat_values = np.load(
+        os.path.join(save_dir, VALUES_FNAME), mmap_mode="r" if mmap else None
+    )
+    offsets = np.load(os.path.join(save_dir, OFFSETS_FNAME))
+    group_ids = np.load(os.path.join(save_dir, GROUP_IDS_FNAME))
+    return RaggedGroupValues(flat_values, offsets, group_ids)
+
+
+def get_chunk_bounds(
+    offsets: np.ndarray, start: int, stop: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the groups overlapping with values[start:stop] of a ragged array (see utils/ragged.py)
+    and the boundaries of their segments within it.
+
+    :param np.ndarray offsets: offsets of the groups in the flat values
+    :param int start: first value of the chunk
+    :param int stop: end of the chunk (exclusive)
+    :return tuple[np.ndarray, np.ndarray]: (positions of the groups, segment boundaries relative to start)
+    """
+    first = np.searchsorted(offsets, start, side="right") - 1
+    last = np.searchsorted(offsets, stop, side="left")
+    positions = np.arange(first, last)
+    bounds = np.clip(offsets[first : last + 1], start, stop) - start
+    return positions, bounds
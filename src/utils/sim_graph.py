@@ -0,0 +1,80 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Helper functions for the sparse graph of high-similarity ligand pairs
+created by build_similarity_graph.py. The graph is a lower-triangular
+CSR matrix (row > col) keyed by the ligand indices of the LTM.
+"""
+
+import numpy as np
+from scipy.sparse import coo_array, csr_array
+
+from utils.io import load_csr, save_csr
+from utils.ltm import dequantize_sim_values, get_row_tiles, get_triangle_number
+
+
+def get_sim_graph(
+    sim_matrix: np.ndarray, N: int, floor: float, chunk_size: int
+) -> coo_array:
+    """
+    Find all pairs with similarity >= floor, processing the LTM in tiles of rows.
+
+    :param np.ndarray sim_matrix: 1D array containing similarity values (LTM, any storage type)
+    :param int N: number of ligands
+    :param float floor: minimum similarity value included in the graph
+    :param int chunk_size: approximate number of LTM values per tile
+    :return coo_array: lower-triangular (row > col) N x N graph, values in storage type of sim_matrix
+        (float32 for float16 LTMs)
+    """
+    # scipy.sparse does not support float16, float16 values are exact in float32
+    graph_dtype = np.float32 if sim_matrix.dtype == np.float16 else sim_matrix.dtype
+    rows, cols, values = [], [], []
+    for start, stop in get_row_tiles(N, chunk_size):
+        tile_offset = get_triangle_number(start)
+        tile = sim_matrix[tile_offset : get_triangle_number(stop)]
+        tile_indices = np.flatnonzero(dequantize_sim_values(tile) >= floor)
+        # offsets of each row within the tile
+        row_offsets = (
+            get_triangle_number(np.arange(start, stop, dtype=np.int64)) - tile_offset
+        )
+        tile_rows = np.searchsorted(row_offsets, tile_indices, side="right") - 1
+        rows.append(tile_rows + start)
+        cols.append(tile_indices - row_offsets[tile_rows])
+        values.append(tile[tile_indices].astype(graph_dtype))
+    if len(values) == 0:
+        return coo_array((N, N), dtype=graph_dtype)
+    return coo_array(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(N, N),
+    )
+
+
+def save_sim_graph(graph: csr_array, floor: float, save_path: str) -> None:
+    # floor (minimum similarity value included in the graph) is saved alongside the graph
+    save_csr(graph, save_path, floor=np.array(floor))
+
+
+def load_sim_graph(save_path: str) -> tuple[csr_array, float]:
+    """
+    Load sparse graph of similarity values saved by save_sim_graph.
+    Values are left in the storage type of the LTM they were taken from.
+
+    :param str save_path: .npz file saved by save_sim_graph
+    :return tuple[csr_array, float]: graph and floor of the graph
+    """
+    graph, arrays = load_csr(save_path)
+    return graph, float(arrays["floor"])
+
+
+def get_group_graph_values(graph: csr_array, idx_array: np.ndarray) -> np.ndarray:
+    """
+    Get the values of all graph edges between ligands of a group.
+    Only pairs with similarity >= floor of the graph are included.
+
+    :param csr_array graph: lower-triangular graph of similarity values
+    :param np.ndarray idx_array: indices (in id_list) of ligands in the group
+    :return np.ndarray: similarity values of edges within the group
+    """
+    idx_array = np.sort(idx_array)
+    return graph[idx_array][:, idx_array].data
@@ -0,0 +1,69 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Shared utilities for reading/writing tables passed between stages.
+Tables are stored as TSV or Parquet, selected by file extension (".parquet"
+for Parquet, TSV otherwise). Parquet files are read lazily, so only the
+requested columns (and row groups matching any filters) are loaded.
+"""
+
+import os
+
+import polars as pl
+
+from utils.io import write_to_tsv
+
+TABLE_FORMATS = ["tsv", "parquet"]
+
+
+def get_table_format(fpath: str) -> str:
+    return "parquet" if fpath.endswith(".parquet") else "tsv"
+
+
+def scan_table(
+    fpath: str, columns: list[str] = None, predicate: pl.Expr = None
+) -> pl.LazyFrame:
+    """
+    Lazily scan a TSV/Parquet table, selecting only the given columns (default: all)
+    and rows matching the given predicate (default: all).
+    """
+    if get_table_format(fpath) == "parquet":
+        lf = pl.scan_parquet(fpath)
+    else:
+        lf = pl.scan_csv(fpath, separator="\t")
+    if predicate is not None:
+        lf = lf.filter(predicate)
+    if columns is not None:
+        lf = lf.select(columns)
+    return lf
+
+
+def read_table(
+    fpath: str, columns: list[str] = None, predicate: pl.Expr = None
+) -> pl.DataFrame:
+    return scan_table(fpath, columns, predicate).collect()
+
+
+def write_table(df: pl.DataFrame, fpath: str) -> None:
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    if get_table_format(fpath) == "parquet":
+        df.write_parquet(fpath)
+    else:
+        df.write_csv(fpath, separator="\t")
+
+
+def write_rows(fpath: str, rows: list, header: list[str]) -> None:
+    """
+    Write rows (e.g., fetched from the DB) to a TSV/Parquet table.
+    """
+    if get_table_format(fpath) == "parquet":
+        df = pl.DataFrame(
+            [tuple(row) for row in rows],
+            schema=header,
+            orient="row",
+            infer_schema_length=None,
+        )
+        write_table(df, fpath)
+    else:
+        write_to_tsv(fpath, rows, header)
@@ -0,0 +1,110 @@
+"""
+@author Jack Ringer
+Date: 10/18/2026
+Description:
+Helper functions for running the Mann-Whitney U-test from exact value counts.
+Tanimoto coefficients only take a limited number of distinct values, so
+each distribution can be represented by the counts of each distinct value.
+This avoids copying/re-ranking the full similarity matrix for every test.
+"""
+
+import numpy as np
+from scipy.stats import norm
+
+
+def get_value_counts(
+    values: np.ndarray, chunk_size: int = 10_000_000
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the sorted distinct values of the given array and their counts,
+    processing the array in chunks to avoid a full (sorted) copy.
+
+    :param np.ndarray values: 1D array of values (e.g., the LTM)
+    :param int chunk_size: number of values to process at once
+    :return tuple[np.ndarray, np.ndarray]: (distinct values, counts)
+    """
+    unique_values = np.empty(0, dtype=values.dtype)
+    counts = np.empty(0, dtype=np.int64)
+    for i in range(0, len(values), chunk_size):
+        chunk_values, chunk_counts = np.unique(
+            values[i : i + chunk_size], return_counts=True
+        )
+        merged_values = np.concatenate([unique_values, chunk_values])
+        merged_counts = np.concatenate([counts, chunk_counts])
+        unique_values, inverse = np.unique(merged_values, return_inverse=True)
+        counts = np.bincount(inverse, weights=merged_counts).astype(np.int64)
+    return unique_values, counts
+
+
+def get_counts_on_values(values: np.ndarray, unique_values: np.ndarray) -> np.ndarray:
+    """
+    Count how often each of unique_values occurs in values.
+    All entries of values are expected to be contained in unique_values.
+    """
+    bins = np.searchsorted(unique_values, values)
+    assert np.array_equal(
+        unique_values[np.minimum(bins, len(unique_values) - 1)], values
+    ), "Found value not contained in unique_values"
+    return np.bincount(bins, minlength=len(unique_values)).astype(np.int64)
+
+
+def get_median_from_counts(unique_values: np.ndarray, counts: np.ndarray) -> float:
+    # same convention as np.median (average of middle two values for even n)
+    n = counts.sum()
+    if n == 0:
+        return np.nan
+    cum_counts = np.cumsum(counts)
+    lo = unique_values[np.searchsorted(cum_counts, (n - 1) // 2, side="right")]
+    hi = unique_values[np.searchsorted(cum_counts, n // 2, side="right")]
+    return (lo + hi) / 2
+
+
+def mannwhitneyu_from_counts(
+    x_counts: np.ndarray,
+    y_counts: np.ndarray,
+    alternative: str = "greater",
+    use_continuity: bool = True,
+) -> tuple[float, float]:
+    """
+    Mann-Whitney U-test computed from value counts of two samples x/y. Both
+    count arrays must be defined on the same sorted distinct values. Matches
+    scipy.stats.mannwhitneyu(x, y, method="asymptotic") (tie correction included).
+
+    :param np.ndarray x_counts: counts of each distinct value in sample x
+    :param np.ndarray y_counts: counts of each distinct value in sample y
+    :param str alternative: one of "greater", "less", "two-sided"
+    :param bool use_continuity: whether to apply the continuity correction
+    :return tuple[float, float]: U statistic of x (U1) and p-value, (nan, nan) if a sample is empty
+    """
+    x_counts = x_counts.astype(np.float64)
+    y_counts = y_counts.astype(np.float64)
+    n1, n2 = x_counts.sum(), y_counts.sum()
+    if n1 == 0 or n2 == 0:
+        # same as scipy for empty samples
+        return np.nan, np.nan
+    # number of y values strictly less than each distinct value
+    y_below = np.cumsum(y_counts) - y_counts
+    U1 = float(np.sum(x_counts * (y_below + 0.5 * y_counts)))
+    U2 = n1 * n2 - U1
+
+    if alternative == "greater":
+        U, f = U1, 1
+    elif alternative == "less":
+        U, f = U2, 1
+    elif alternative == "two-sided":
+        U, f = max(U1, U2), 2
+    else:
+        raise ValueError(f"Unknown alternative: {alternative}")
+
+    # tie correction, see scipy.stats.mannwhitneyu
+    n = n1 + n2
+    t = x_counts + y_counts
+    tie_term = np.sum(t**3 - t)
+    s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    numerator = U - n1 * n2 / 2
+    if use_continuity:
+        numerator -= 0.5
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = numerator / s
+    p_val = min(float(norm.sf(z) * f), 1.0)
+    return U1, p_val
@@ -16,6 +16,10 @@ from bigtree import polars_to_tree_by_relation, tree_to_newick
 from ete4 import Tree
 from ete4.treeview import NodeStyle, TreeStyle
 
+from utils.args import add_profiling_args
+from utils.profiling import StageProfiler
+from utils.tables import read_table
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -27,7 +31,7 @@ def parse_args():
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="Input TSV file containing protein_class_id and additional information (pref_name, short_name, class_level)",
+        help="Input TSV/Parquet file containing protein_class_id and additional information (pref_name, short_name, class_level)",
     )
     parser.add_argument(
         "--out_path",
@@ -48,6 +52,7 @@ def parse_args():
         default="hls",
         help="Seaborn pallette to use for coloring tree by major family (sns.color_palette(pallette)). Will print out hex colors from this pallette to support manually adding in legend.",
     )
+    add_profiling_args(parser)
     args = parser.parse_args()
     return args
 
@@ -116,40 +121,50 @@ def customize_tree_appearance(tree: Tree, df: pl.DataFrame, major_family_colors:
 
 def main():
     args = parse_args()
-    df = pl.read_csv(args.family_details_tsv_file, separator="\t")
-    df = df.with_columns((pl.col("short_name").str.to_uppercase()))
-
-    # Build tree
-    t = polars_to_tree_by_relation(
-        df, child_col="protein_class_id", parent_col="parent_id"
-    )
-    nwt = tree_to_newick(t, attr_list=["short_name", "class_level"])
-    nwt = nwt + ";"
-    et = Tree(nwt, parser=1)
-
-    # Customize tree appearance
-    major_family_colors = get_major_family_colors(
-        args.major_family_short_names, args.pallette
-    )
-
-    customize_tree_appearance(et, df.to_pandas(), major_family_colors)
-
-    # Set up circular tree style
-    circular_style = TreeStyle()
-    circular_style.mode = "c"  # circular mode
-    circular_style.scale = 20
-    circular_style.show_leaf_name = False
-    circular_style.show_branch_length = False
-    circular_style.show_branch_support = False
-    circular_style.show_scale = False
-
-    # print legend
-    print("LEGEND (short_name to hex color):", major_family_colors)
+    with StageProfiler(
+        "visualize_protein_family_tree", args.profile_json_file, args.cprofile_file
+    ) as profiler:
+        with profiler.phase("build_tree"):
+            df = read_table(args.family_details_tsv_file)
+            df = df.with_columns((pl.col("short_name").str.to_uppercase()))
+
+            # Build tree
+            t = polars_to_tree_by_relation(
+                df, child_col="protein_class_id", parent_col="parent_id"
+            )
+            nwt = tree_to_newick(t, attr_list=["short_name", "class_level"])
+            nwt = nwt + ";"
+            et = Tree(nwt, parser=1)
+
+        # Customize tree appearance
+        major_family_colors = get_major_family_colors(
+            args.major_family_short_names, args.pallette
+        )
 
-    # Render the tree
-    et.render(
-        args.out_path, w=1024, h=1024, units="px", tree_style=circular_style, dpi=300
-    )
+        customize_tree_appearance(et, df.to_pandas(), major_family_colors)
+
+        # Set up circular tree style
+        circular_style = TreeStyle()
+        circular_style.mode = "c"  # circular mode
+        circular_style.scale = 20
+        circular_style.show_leaf_name = False
+        circular_style.show_branch_length = False
+        circular_style.show_branch_support = False
+        circular_style.show_scale = False
+
+        # print legend
+        print("LEGEND (short_name to hex color):", major_family_colors)
+
+        with profiler.phase("render"):
+            # Render the tree
+            et.render(
+                args.out_path,
+                w=1024,
+                h=1024,
+                units="px",
+                tree_style=circular_style,
+                dpi=300,
+            )
 
 
 if __name__ == "__main__":